@@ -1,6 +1,14 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete, post_save
 
 
 class AccountsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'accounts'
+
+    def ready(self):
+        from rest_framework.authtoken.models import Token
+        from . import signals
+        from .models import CustomUser
+        post_delete.connect(signals.forget_deleted_token, sender=Token, dispatch_uid='accounts.forget_deleted_token')
+        post_save.connect(signals.forget_user_tokens, sender=CustomUser, dispatch_uid='accounts.forget_user_tokens')
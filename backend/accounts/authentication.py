@@ -0,0 +1,46 @@
+import hashlib
+from django.conf import settings
+from django.core.cache import cache
+from rest_framework.authentication import TokenAuthentication
+from rest_framework.authtoken.models import Token
+from .models import CustomUser
+
+
+def token_cache_key(key):
+    # Hashed so raw tokens never appear in the cache
+    return f"auth:token:{hashlib.sha256(key.encode()).hexdigest()}"
+
+
+class CachedTokenAuthentication(TokenAuthentication):
+    """
+    TokenAuthentication that keeps the token -> user lookup in the cache.
+
+    Entries live for AUTH_TOKEN_CACHE_TTL seconds and are dropped as soon as the
+    token is deleted (login rotation, logout) or its user changes, so
+    revocation takes effect immediately while repeat requests skip the
+    Token + CustomUser query. An entry holds only what permission checks read
+    (user id and user_type); the user is rebuilt as a CustomUser with the other
+    fields deferred. Only active users are cached, and deactivating one drops
+    its entries.
+    """
+
+    def authenticate_credentials(self, key):
+        cache_key = token_cache_key(key)
+        cached = cache.get(cache_key)
+        if cached is None:
+            user, token = super().authenticate_credentials(key)
+            cached = {'user_id': user.pk, 'user_type': user.user_type}
+            cache.set(cache_key, cached, settings.AUTH_TOKEN_CACHE_TTL)
+            return user, token
+
+        # from_db takes values in field order
+        user = CustomUser.from_db(
+            None, ['id', 'is_active', 'user_type'], [cached['user_id'], True, cached['user_type']]
+        )
+        token = Token.from_db(None, ['key', 'user_id'], [key, user.pk])
+        token.user = user
+        return user, token
+
+
+def forget_token(key):
+    cache.delete(token_cache_key(key))
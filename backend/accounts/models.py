@@ -13,5 +13,23 @@ class CustomUser(AbstractUser):
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
 
+    # Fields cached token lookups depend on; see accounts.signals.forget_user_tokens
+    AUTH_FIELDS = ('user_type', 'is_active', 'password')
+
     def __str__(self):
-        return f"{self.username} ({self.get_user_type_display()})"
\ No newline at end of file
+        return f"{self.username} ({self.get_user_type_display()})"
+
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance.remember_auth_state()
+        return instance
+
+    def remember_auth_state(self):
+        # Deferred fields are absent from __dict__ and compare as unchanged
+        self._loaded_auth_state = tuple(self.__dict__.get(field) for field in self.AUTH_FIELDS)
+
+    def auth_state_changed(self):
+        """Whether user_type, is_active or password differ from what was loaded"""
+        loaded = getattr(self, '_loaded_auth_state', None)
+        return loaded != tuple(self.__dict__.get(field) for field in self.AUTH_FIELDS)
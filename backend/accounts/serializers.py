@@ -16,4 +16,12 @@ class UserSerializer(serializers.ModelSerializer):
         user = CustomUser.objects.create(**validated_data)
         user.set_password(password)
         user.save()
-        return user
\ No newline at end of file
+        return user
+
+class UserSummarySerializer(serializers.ModelSerializer):
+    """Read-only user columns shown next to payments and receipts in lists"""
+
+    class Meta:
+        model = CustomUser
+        fields = ('id', 'username', 'first_name', 'last_name', 'user_type')
+        read_only_fields = fields
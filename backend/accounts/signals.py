@@ -0,0 +1,22 @@
+from rest_framework.authtoken.models import Token
+from .authentication import forget_token
+
+
+def forget_deleted_token(sender, instance, **kwargs):
+    """LoginView rotation and logout_view delete tokens; revoke their cached lookups"""
+    forget_token(instance.key)
+
+
+def forget_user_tokens(sender, instance, created, update_fields=None, **kwargs):
+    """Cached lookups carry user_type and is_active; drop them when those or the password change"""
+    if created:
+        instance.remember_auth_state()
+        return
+    # e.g. the last_login write on every login
+    if update_fields is not None and not set(update_fields) & set(instance.AUTH_FIELDS):
+        return
+    if not instance.auth_state_changed():
+        return
+    for key in Token.objects.filter(user=instance).values_list('key', flat=True):
+        forget_token(key)
+    instance.remember_auth_state()
@@ -1,3 +1,86 @@
+from django.core.cache import cache
 from django.test import TestCase
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APIClient
+from .authentication import token_cache_key
+from .models import CustomUser
 
-# Create your tests here.
+
+class CachedTokenAuthenticationTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.user = CustomUser.objects.create_user(username='staff', password='secret', user_type='staff')
+        self.client = APIClient()
+
+    def login(self):
+        response = self.client.post('/api/accounts/login/', {'username': 'staff', 'password': 'secret'})
+        self.assertEqual(response.status_code, 200)
+        return response.data['token']
+
+    def profile(self, token):
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {token}')
+        return self.client.get('/api/accounts/profile/')
+
+    def test_repeat_requests_skip_auth_query(self):
+        token = self.login()
+        self.assertEqual(self.profile(token).status_code, 200)
+        # Only the profile's own read of the columns the cache does not hold
+        with self.assertNumQueries(1):
+            response = self.profile(token)
+        self.assertEqual((response.data['user_type'], response.data['username']), ('staff', 'staff'))
+
+    def test_cache_holds_only_the_auth_fields(self):
+        token = self.login()
+        self.profile(token)
+        self.assertEqual(
+            cache.get(token_cache_key(token)),
+            {'user_id': self.user.pk, 'user_type': 'staff'},
+        )
+
+    def test_deactivated_user_is_rejected(self):
+        token = self.login()
+        self.profile(token)
+        self.user.is_active = False
+        self.user.save()
+        self.assertEqual(self.profile(token).status_code, 401)
+
+    def test_only_auth_field_changes_drop_cached_tokens(self):
+        token = self.login()
+        self.profile(token)
+        # The last_login write done on every login
+        with self.assertNumQueries(1):
+            self.user.save(update_fields=['last_login'])
+        self.user.first_name = 'Jane'
+        with self.assertNumQueries(1):
+            self.user.save()
+        self.assertIsNotNone(cache.get(token_cache_key(token)))
+
+        self.user.set_password('changed')
+        self.user.save()
+        self.assertIsNone(cache.get(token_cache_key(token)))
+
+    def test_deleted_token_is_rejected(self):
+        token = self.login()
+        self.profile(token)
+        Token.objects.filter(key=token).delete()
+        self.assertEqual(self.profile(token).status_code, 401)
+
+    def test_login_rotation_revokes_cached_token(self):
+        old_token = self.login()
+        self.profile(old_token)
+        self.login()
+        self.assertEqual(self.profile(old_token).status_code, 401)
+
+    def test_logout_revokes_cached_token(self):
+        token = self.login()
+        self.profile(token)
+        self.client.post('/api/accounts/logout/')
+        self.assertFalse(Token.objects.exists())
+        self.assertEqual(self.profile(token).status_code, 401)
+
+    def test_user_changes_refresh_cached_user(self):
+        token = self.login()
+        self.profile(token)
+        self.user.user_type = 'auditor'
+        self.user.save()
+        self.assertEqual(self.profile(token).data['user_type'], 'auditor')
@@ -54,6 +54,6 @@ def logout_view(request):
 
 @api_view(['GET'])
 def user_profile(request):
-    # This will require authentication
-    serializer = UserSerializer(request.user)
+    # This will require authentication; the cached token user only has id and user_type loaded
+    serializer = UserSerializer(User.objects.get(pk=request.user.pk))
     return Response(serializer.data)
@@ -1,45 +1,218 @@
+import atexit
+import contextvars
+import json
+import logging
 import os
+import queue
+import random
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from logging.handlers import QueueHandler, QueueListener
 
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'formatters': {
-        'verbose': {
-            'format': '{levelname} {asctime} {module} {process:d} {thread:d} {message}',
-            'style': '{',
-        },
-        'simple': {
-            'format': '{levelname} {message}',
-            'style': '{',
+# Fields every JSON line carries when they are known for the current request / job
+CONTEXT_FIELDS = ('request_id', 'payment_reference', 'provider', 'duration_ms')
+
+_log_context = contextvars.ContextVar('log_context', default={})
+
+# Attributes of a bare LogRecord; anything else on a record came from `extra=`
+_RECORD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def bind_log_context(**fields):
+    """Attach fields to every record logged from this context; returns a token for reset"""
+    return _log_context.set({**_log_context.get(), **fields})
+
+
+@contextmanager
+def log_context(**fields):
+    token = bind_log_context(**fields)
+    try:
+        yield
+    finally:
+        _log_context.reset(token)
+
+
+class ContextFilter(logging.Filter):
+    """Copies the bound context (request id, payment reference, ...) onto the record"""
+
+    def filter(self, record):
+        for name, value in _log_context.get().items():
+            if not hasattr(record, name):
+                setattr(record, name, value)
+        return True
+
+
+class DebugSamplingFilter(logging.Filter):
+    """Keeps only a fraction of DEBUG records so verbose events stay affordable"""
+
+    def __init__(self, rate=1.0):
+        super().__init__()
+        self.rate = float(rate)
+
+    def filter(self, record):
+        if record.levelno > logging.DEBUG or self.rate >= 1:
+            return True
+        if random.random() >= self.rate:
+            return False
+        record.sample_rate = self.rate
+        return True
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: timestamp, level, logger, message, context and `extra` fields"""
+
+    def format(self, record):
+        entry = {
+            'timestamp': datetime.fromtimestamp(record.created, timezone.utc).isoformat(timespec='milliseconds'),
+            'level': record.levelname,
+            'logger': record.name,
+            'message': record.getMessage(),
+            'process': record.process,
+            'thread': record.threadName,
+        }
+        for name, value in vars(record).items():
+            if name not in _RECORD_ATTRIBUTES and not name.startswith('_'):
+                entry[name] = value
+        if record.exc_info:
+            entry['exception'] = self.formatException(record.exc_info)
+        if record.stack_info:
+            entry['stack'] = self.formatStack(record.stack_info)
+        return json.dumps(entry, default=str)
+
+
+class QueueListenerHandler(QueueHandler):
+    """
+    Hands records to a background QueueListener that formats and writes them.
+
+    The calling thread only merges the message arguments and enqueues the
+    record, which costs microseconds; JSON encoding and file / stream I/O
+    happen on the listener thread. `handlers` are names of handlers defined
+    earlier in the same dictConfig (as 'cfg://handlers.<name>').
+
+    The listener thread is started by the first record each process logs, so
+    gunicorn workers forked from a --preload master get their own.
+    """
+
+    def __init__(self, handlers, respect_handler_level=True):
+        super().__init__(queue.SimpleQueue())
+        self.targets = [handlers[i] for i in range(len(handlers))]  # resolve cfg:// references
+        for handler in self.targets:
+            if not isinstance(handler, logging.Handler):
+                raise ValueError('target not configured yet')
+        self.respect_handler_level = respect_handler_level
+        self.listener = None
+        self.listener_pid = None
+        self.start_lock = threading.Lock()
+        # A fork can happen while another thread holds the lock
+        os.register_at_fork(after_in_child=self._after_fork)
+
+    def _after_fork(self):
+        self.start_lock = threading.Lock()
+
+    def ensure_listener(self):
+        """Start this process's listener thread unless it is already running"""
+        if self.listener_pid == os.getpid():
+            return
+        with self.start_lock:
+            if self.listener_pid != os.getpid():
+                self.listener = QueueListener(self.queue, *self.targets,
+                                              respect_handler_level=self.respect_handler_level)
+                self.listener.start()
+                atexit.register(self.stop_listener)
+                self.listener_pid = os.getpid()
+
+    def stop_listener(self):
+        """Flush the queue and stop this process's listener thread, if it runs"""
+        with self.start_lock:
+            if self.listener_pid == os.getpid():
+                self.listener.stop()
+                self.listener_pid = None
+
+    def prepare(self, record):
+        # Unlike the stdlib version, leave formatting to the listener thread
+        record.msg = record.getMessage()
+        record.args = None
+        return record
+
+    def enqueue(self, record):
+        self.ensure_listener()
+        super().enqueue(record)
+
+
+class RequestLogContextMiddleware:
+    """Binds a request id (X-Request-ID, or a fresh one) to every record logged during the request"""
+
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        request_id = request.headers.get('X-Request-ID') or uuid.uuid4().hex
+        request.request_id = request_id
+        started = time.perf_counter()
+        with log_context(request_id=request_id):
+            response = self.get_response(request)
+            response['X-Request-ID'] = request_id
+            logging.getLogger('business_portal.requests').debug(
+                'Request handled',
+                extra={
+                    'method': request.method,
+                    'path': request.path,
+                    'status': response.status_code,
+                    'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+                },
+            )
+        return response
+
+
+def get_logging_config(log_dir, level='INFO', debug_sample_rate=1.0):
+    """dictConfig for the project: JSON lines to stdout and logs/django.log through one queue"""
+    os.makedirs(log_dir, exist_ok=True)
+    return {
+        'version': 1,
+        'disable_existing_loggers': False,
+        'filters': {
+            'context': {'()': ContextFilter},
+            'debug_sampling': {'()': DebugSamplingFilter, 'rate': debug_sample_rate},
         },
-    },
-    'handlers': {
-        'file': {
-            'level': 'INFO',
-            'class': 'logging.FileHandler',
-            'filename': os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'logs', 'django.log'),
-            'formatter': 'verbose',
+        'formatters': {
+            'json': {'()': JsonFormatter},
         },
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-            'formatter': 'simple'
+        'handlers': {
+            'console': {
+                'class': 'logging.StreamHandler',
+                'formatter': 'json',
+            },
+            'file': {
+                'class': 'logging.FileHandler',
+                'filename': os.path.join(log_dir, 'django.log'),
+                'formatter': 'json',
+            },
+            # Filters run on the calling thread so they see its context
+            'queue': {
+                '()': QueueListenerHandler,
+                'handlers': ['cfg://handlers.console', 'cfg://handlers.file'],
+                'filters': ['debug_sampling', 'context'],
+            },
         },
-    },
-    'root': {
-        'handlers': ['console'],
-        'level': 'INFO',
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['file', 'console'],
+        'root': {
+            'handlers': ['queue'],
             'level': 'INFO',
-            'propagate': True,
         },
-        'payments': {
-            'handlers': ['file', 'console'],
-            'level': 'INFO',
-            'propagate': True,
+        'loggers': {
+            'django': {
+                'level': 'INFO',
+            },
+            'payments': {
+                'level': level,
+            },
+            'receipts': {
+                'level': level,
+            },
+            'business_portal': {
+                'level': level,
+            },
         },
-    },
-}
\ No newline at end of file
+    }
@@ -0,0 +1,296 @@
+import atexit
+import os
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+
+METRICS_KEY_PREFIX = 'metrics'
+METRICS_LOCK_TIMEOUT = 1
+METRICS_SERIES_RECHECK = 300  # seconds before a process re-checks a series is indexed
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+
+
+def _incr(key, amount=1):
+    try:
+        cache.incr(key, amount)
+    except ValueError:
+        # First write of this counter; another process may have just created it
+        if not cache.add(key, amount, timeout=None):
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                pass
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(labels):
+    if not labels:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in labels) + '}'
+
+
+def _format_value(value):
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Metric:
+    """
+    A named metric whose samples live in the shared cache.
+
+    Every gunicorn worker increments the same cache counters (in batches, see
+    Registry), so a scrape of any worker returns totals for the whole deployment (with Redis; the local
+    memory cache only sees its own process). The label combinations seen are
+    kept in a per-metric series index that each process re-checks every few
+    minutes, so the index survives cache evictions.
+    """
+    type = None
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._known_series = {}
+        self._lock = threading.Lock()
+        REGISTRY.register(self)
+
+    def _series(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        series = tuple((name, str(labels[name])) for name in self.labelnames)
+        if time.monotonic() - self._known_series.get(series, float('-inf')) > METRICS_SERIES_RECHECK:
+            self._index_series(series)
+        return series
+
+    def _index_series(self, series):
+        index_key = f'{METRICS_KEY_PREFIX}:{self.name}:series'
+        lock_key = f'{index_key}:lock'
+        for _ in range(50):
+            if cache.add(lock_key, 1, timeout=METRICS_LOCK_TIMEOUT):
+                try:
+                    known = cache.get(index_key) or []
+                    if series not in known:
+                        cache.set(index_key, known + [series], timeout=None)
+                finally:
+                    cache.delete(lock_key)
+                with self._lock:
+                    self._known_series[series] = time.monotonic()
+                return
+            time.sleep(0.002)
+
+    def all_series(self):
+        return cache.get(f'{METRICS_KEY_PREFIX}:{self.name}:series') or []
+
+    def key(self, series, suffix=''):
+        labels = ','.join(f'{name}={value}' for name, value in series)
+        return f'{METRICS_KEY_PREFIX}:{self.name}:{labels}:{suffix}'
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        lines.extend(self.render_samples())
+        return lines
+
+    def render_samples(self):
+        raise NotImplementedError
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        REGISTRY.add(self.key(self._series(labels)), amount)
+
+    def render_samples(self):
+        series = self.all_series()
+        values = cache.get_many([self.key(s) for s in series])
+        return [f'{self.name}{_format_labels(s)} {values.get(self.key(s), 0)}' for s in series]
+
+
+class Histogram(Metric):
+    """Latency histogram; sums are kept in microseconds so they can use atomic integer increments"""
+    type = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, seconds, **labels):
+        series = self._series(labels)
+        bucket = next((str(le) for le in self.buckets if seconds <= le), '+Inf')
+        REGISTRY.add(self.key(series, f'bucket:{bucket}'))
+        REGISTRY.add(self.key(series, 'count'))
+        REGISTRY.add(self.key(series, 'sum_us'), int(seconds * 1_000_000))
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render_samples(self):
+        lines = []
+        for series in self.all_series():
+            bounds = [str(le) for le in self.buckets] + ['+Inf']
+            keys = [self.key(series, f'bucket:{le}') for le in bounds]
+            keys += [self.key(series, 'count'), self.key(series, 'sum_us')]
+            values = cache.get_many(keys)
+            cumulative = 0
+            for le, key in zip(bounds, keys):
+                cumulative += values.get(key, 0)
+                lines.append(f'{self.name}_bucket{_format_labels(series + (("le", le),))} {cumulative}')
+            lines.append(f'{self.name}_count{_format_labels(series)} {values.get(self.key(series, "count"), 0)}')
+            total = values.get(self.key(series, 'sum_us'), 0) / 1_000_000
+            lines.append(f'{self.name}_sum{_format_labels(series)} {_format_value(total)}')
+        return lines
+
+
+class Collected:
+    """Metric computed at scrape time by `collect`, which returns [(labels dict, value)]"""
+
+    def __init__(self, name, documentation, collect, type='gauge'):
+        self.name = name
+        self.documentation = documentation
+        self.collect = collect
+        self.type = type
+        REGISTRY.register(self)
+
+    def render(self):
+        lines = [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.type}']
+        for labels, value in self.collect():
+            lines.append(f'{self.name}{_format_labels(tuple(labels.items()))} {_format_value(value)}')
+        return lines
+
+
+class Registry:
+    """
+    The metrics to expose, plus this process's increments not yet written.
+
+    Observations only add to an in-process dict; every METRICS_FLUSH_INTERVAL
+    seconds the summed increments go to the cache, one incr per key, so a hot
+    histogram costs a few cache round trips per interval instead of three per
+    observation. A daemon thread per process also flushes on that interval,
+    so an idle worker's last increments still reach the cache; scrapes flush
+    first, leaving other workers at most one interval behind.
+    """
+
+    def __init__(self):
+        self.metrics = {}
+        self.pending = {}
+        self.pending_lock = threading.Lock()
+        self.flushed_at = time.monotonic()
+        self.flusher_pid = None
+        # A forked worker must not write its parent's increments a second time
+        os.register_at_fork(after_in_child=self._discard_pending)
+        atexit.register(self.flush)
+
+    def register(self, metric):
+        self.metrics[metric.name] = metric
+
+    def add(self, key, amount=1):
+        if self.flusher_pid != os.getpid():
+            self._start_flusher()
+        with self.pending_lock:
+            self.pending[key] = self.pending.get(key, 0) + amount
+            due = time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL
+        if due:
+            self.flush()
+
+    def flush(self):
+        """Write this process's pending increments to the cache"""
+        with self.pending_lock:
+            pending, self.pending = self.pending, {}
+            self.flushed_at = time.monotonic()
+        for key, amount in pending.items():
+            _incr(key, amount)
+
+    def _start_flusher(self):
+        with self.pending_lock:
+            if self.flusher_pid == os.getpid():
+                return
+            self.flusher_pid = os.getpid()
+        threading.Thread(target=self._flush_periodically, name='metrics-flusher', daemon=True).start()
+
+    def _flush_periodically(self):
+        pid = os.getpid()
+        while self.flusher_pid == pid:
+            # Poll at most once a second so a shortened interval takes effect
+            time.sleep(min(settings.METRICS_FLUSH_INTERVAL, 1.0) or 1.0)
+            if self.pending and time.monotonic() - self.flushed_at >= settings.METRICS_FLUSH_INTERVAL:
+                self.flush()
+
+    def _discard_pending(self):
+        self.pending_lock = threading.Lock()
+        self.pending = {}
+        self.flushed_at = time.monotonic()
+
+    def render(self):
+        """All metrics in the Prometheus text exposition format"""
+        self.flush()
+        lines = []
+        for metric in self.metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+REGISTRY = Registry()
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+
+# Application metrics
+
+provider_request_seconds = Histogram(
+    'payment_provider_request_seconds', 'Latency of Daraja and Paystack API calls',
+    ('provider', 'operation', 'outcome'),
+)
+payment_status_transitions = Counter(
+    'payment_status_transitions_total', 'Payment status changes, including creation (from_status="none")',
+    ('payment_method', 'from_status', 'to_status'),
+)
+callback_processing_seconds = Histogram(
+    'payment_callback_processing_seconds', 'Time spent handling M-Pesa callbacks and Paystack webhooks',
+    ('provider',),
+)
+receipt_generation_seconds = Histogram(
+    'receipt_generation_seconds', 'Time to compile and render one receipt',
+)
+
+
+def _throttle_rejections():
+    from business_portal.throttling import TokenBucketThrottle
+    return [({'scope': scope}, count) for scope, count in TokenBucketThrottle.get_rejection_counts().items()]
+
+
+def _circuit_states():
+    from django.conf import settings
+    from payments.clients import CircuitBreaker
+    states = ('closed', 'half_open', 'open')
+    samples = []
+    for provider in ('mpesa', 'paystack'):
+        for operation in settings.PAYMENT_PROVIDER_HTTP['TIMEOUTS']:
+            if operation == 'default':
+                continue
+            current = CircuitBreaker(provider, operation).state()
+            samples.extend(
+                ({'provider': provider, 'operation': operation, 'state': state}, int(state == current))
+                for state in states
+            )
+    return samples
+
+
+def _inbox_lag():
+    from payments.models import CallbackInbox
+    lag = CallbackInbox.lag()
+    return [({'measure': 'pending'}, lag['pending']), ({'measure': 'oldest_pending_seconds'}, lag['oldest_pending_seconds'])]
+
+
+Collected('payment_throttle_rejections_total', 'Payment initiations rejected by each throttle', _throttle_rejections,
+          type='counter')
+Collected('payment_provider_circuit_state', 'Circuit breaker state per provider operation (1 = current)',
+          _circuit_states)
+Collected('payment_callback_inbox_lag', 'Callbacks waiting in the inbox and the age of the oldest', _inbox_lag)
@@ -25,4 +25,11 @@ class IsAuditor(permissions.BasePermission):
     Custom permission for auditors - read-only access.
     """
     def has_permission(self, request, view):
-        return request.user and request.user.user_type == 'auditor'
\ No newline at end of file
+        return request.user and request.user.user_type == 'auditor'
+
+class IsAdmin(permissions.BasePermission):
+    """
+    Custom permission for admin-only operational endpoints.
+    """
+    def has_permission(self, request, view):
+        return bool(request.user and request.user.is_authenticated and request.user.user_type == 'admin')
@@ -0,0 +1,120 @@
+import contextvars
+import logging
+import time
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+
+logger = logging.getLogger('business_portal.profiling')
+
+_current_profile = contextvars.ContextVar('request_profile', default=None)
+
+
+class RequestProfile:
+    """Where one request spent its time: SQL, provider HTTP calls and response rendering"""
+
+    def __init__(self):
+        self.started = time.perf_counter()
+        self.queries = []  # (duration seconds, sql)
+        self.db_time = 0.0
+        self.provider_calls = 0
+        self.provider_time = 0.0
+        self.serialize_time = 0.0
+
+    def elapsed(self):
+        return time.perf_counter() - self.started
+
+    def __call__(self, execute, sql, params, many, context):
+        """connection.execute_wrapper hook timing every query"""
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            duration = time.perf_counter() - started
+            self.db_time += duration
+            self.queries.append((duration, sql))
+
+    def server_timing(self, total):
+        metrics = [
+            ('db', self.db_time, f'{len(self.queries)} queries'),
+            ('provider', self.provider_time, f'{self.provider_calls} calls'),
+            ('serialize', self.serialize_time, None),
+            ('total', total, None),
+        ]
+        return ', '.join(
+            f'{name};dur={seconds * 1000:.1f}' + (f';desc="{desc}"' if desc else '')
+            for name, seconds, desc in metrics
+        )
+
+
+def record_provider_call(seconds):
+    """Called by ProviderClient for every Daraja / Paystack request"""
+    profile = _current_profile.get()
+    if profile is not None:
+        profile.provider_calls += 1
+        profile.provider_time += seconds
+
+
+class RequestProfilingMiddleware:
+    """
+    Opt-in (REQUEST_PROFILING) per-request profiler.
+
+    Adds a Server-Timing header (db, provider, serialize, total) to every
+    response, visible in the browser dev tools, and logs requests slower than
+    SLOW_REQUEST_THRESHOLD_MS, with the slowest SQL statements, as structured
+    fields of a single log record.
+    """
+
+    def __init__(self, get_response):
+        if not settings.REQUEST_PROFILING:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        profile = RequestProfile()
+        token = _current_profile.set(profile)
+        try:
+            with connection.execute_wrapper(profile):
+                response = self.get_response(request)
+        finally:
+            _current_profile.reset(token)
+
+        total = profile.elapsed()
+        response['Server-Timing'] = profile.server_timing(total)
+        if total * 1000 >= settings.SLOW_REQUEST_THRESHOLD_MS:
+            self.log_slow_request(request, response, profile, total)
+        return response
+
+    def process_template_response(self, request, response):
+        # DRF renders (serializes) the response after the view returns; time that step
+        profile = _current_profile.get()
+        render = response.render
+
+        def timed_render():
+            started = time.perf_counter()
+            try:
+                return render()
+            finally:
+                if profile is not None:
+                    profile.serialize_time += time.perf_counter() - started
+
+        response.render = timed_render
+        return response
+
+    def log_slow_request(self, request, response, profile, total):
+        slowest = sorted(profile.queries, key=lambda query: query[0], reverse=True)
+        logger.warning('Slow request', extra={
+            'method': request.method,
+            'path': request.path,
+            'status': response.status_code,
+            'duration_ms': round(total * 1000, 1),
+            'db_queries': len(profile.queries),
+            'db_ms': round(profile.db_time * 1000, 1),
+            'provider_calls': profile.provider_calls,
+            'provider_ms': round(profile.provider_time * 1000, 1),
+            'serialize_ms': round(profile.serialize_time * 1000, 1),
+            'top_sql': [
+                {'ms': round(duration * 1000, 1), 'sql': sql}
+                for duration, sql in slowest[:settings.SLOW_REQUEST_TOP_SQL]
+            ],
+        })
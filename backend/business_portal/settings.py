@@ -1,6 +1,7 @@
 import os
 from pathlib import Path
 from decouple import Config, RepositoryEnv
+from .logging_config import get_logging_config
 
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
 BASE_DIR = Path(__file__).resolve().parent.parent
@@ -44,6 +45,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'business_portal.logging_config.RequestLogContextMiddleware',
+    'business_portal.tracing.TracingMiddleware',  # only active with TRACING_ENABLED
     'corsheaders.middleware.CorsMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'whitenoise.middleware.WhiteNoiseMiddleware',  # Add for static files
@@ -53,6 +56,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'business_portal.profiling.RequestProfilingMiddleware',  # only active with REQUEST_PROFILING
 ]
 
 ROOT_URLCONF = 'business_portal.urls'
@@ -90,6 +94,22 @@ DATABASES = {
     }
 }
 
+# Cache shared by all gunicorn workers (falls back to per-process memory locally)
+REDIS_URL = config('REDIS_URL', default='')
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
 # Password validation
 AUTH_PASSWORD_VALIDATORS = [
     {
@@ -165,17 +185,51 @@ CORS_ALLOW_HEADERS = [
 # FIXED: Rest Framework settings
 REST_FRAMEWORK = {
     'DEFAULT_AUTHENTICATION_CLASSES': [
-        'rest_framework.authentication.TokenAuthentication',
+        'accounts.authentication.CachedTokenAuthentication',
         'rest_framework.authentication.SessionAuthentication',
     ],
     # NOTE: Leaving permissions empty → login endpoint stays open
+    # Default page size for the keyset-paginated list endpoints
+    'PAGE_SIZE': config('API_PAGE_SIZE', default=50, cast=int),
 }
+# pagination_class is set per list view, so PAGE_SIZE without a default class is intended
+SILENCED_SYSTEM_CHECKS = ['rest_framework.W001']
+
+# Token-bucket limits on payment initiation ("N/s|min|hour|day"; empty disables).
+# A bucket allows bursts of N and refills at N per period; batch items count individually.
+PAYMENT_THROTTLE_RATES = {
+    'payment_user': config('PAYMENT_THROTTLE_USER', default='30/min') or None,
+    'payment_phone': config('PAYMENT_THROTTLE_PHONE', default='3/min') or None,
+    'payment_till': config('PAYMENT_THROTTLE_TILL', default='10/s') or None,
+}
+
+# Per-request profiling: Server-Timing header plus a JSON log line for slow requests
+REQUEST_PROFILING = config('REQUEST_PROFILING', default=False, cast=bool)
+SLOW_REQUEST_THRESHOLD_MS = config('SLOW_REQUEST_THRESHOLD_MS', default=500, cast=int)
+SLOW_REQUEST_TOP_SQL = config('SLOW_REQUEST_TOP_SQL', default=5, cast=int)
+
+# Metric increments are summed in each process and written to the cache at most
+# every METRICS_FLUSH_INTERVAL seconds (and on every scrape); 0 writes them at once
+METRICS_FLUSH_INTERVAL = config('METRICS_FLUSH_INTERVAL', default=5.0, cast=float)
+
+# In-process tracing with W3C traceparent propagation. Spans go to TRACING_EXPORTER
+# (a business_portal.tracing.SpanExporter); initiations are remembered for
+# TRACING_SETTLEMENT_TTL seconds so the callback that settles them joins their trace.
+TRACING_ENABLED = config('TRACING_ENABLED', default=False, cast=bool)
+TRACING_EXPORTER = config('TRACING_EXPORTER', default='business_portal.tracing.FileSpanExporter')
+TRACING_FILE = config('TRACING_FILE', default=os.path.join(BASE_DIR, 'logs', 'traces.jsonl'))
+TRACING_SETTLEMENT_TTL = config('TRACING_SETTLEMENT_TTL', default=86400, cast=int)
+
+# Seconds a token -> user lookup is cached; deleting the token revokes it at once
+AUTH_TOKEN_CACHE_TTL = config('AUTH_TOKEN_CACHE_TTL', default=300, cast=int)
 
 # Custom configurations from your original settings
 PAYSTACK_SECRET_KEY = config('PAYSTACK_SECRET_KEY', default='')
 PAYSTACK_PUBLIC_KEY = config('PAYSTACK_PUBLIC_KEY', default='')
 PAYSTACK_WEBHOOK_SECRET = config('PAYSTACK_WEBHOOK_SECRET', default='')
 FRONTEND_URL = config('FRONTEND_URL', default='http://localhost:5173')
+# API root; point it and MPESA_BASE_URL at `manage.py run_provider_simulator` for load tests
+PAYSTACK_BASE_URL = config('PAYSTACK_BASE_URL', default='https://api.paystack.co')
 
 
 # Mpesa / Safaricom configuration
@@ -183,36 +237,95 @@ MPESA_CONSUMER_KEY = config('MPESA_CONSUMER_KEY', default='')
 MPESA_CONSUMER_SECRET = config('MPESA_CONSUMER_SECRET', default='')
 MPESA_BUSINESS_SHORT_CODE = config('MPESA_BUSINESS_SHORT_CODE', default='')
 MPESA_PASSKEY = config('MPESA_PASSKEY', default='')
+# https://sandbox.safaricom.co.ke for the Daraja sandbox
+MPESA_BASE_URL = config('MPESA_BASE_URL', default='https://api.safaricom.co.ke')
 MPESA_CALLBACK_URL = config('MPESA_CALLBACK_URL', default='https://business-portal-i5by.onrender.com/api/payments/mpesa/callback/')
 MPESA_TILL_NUMBER = config("MPESA_TILL_NUMBER")
+# Refresh the cached OAuth token this many seconds before Daraja expires it
+MPESA_TOKEN_REFRESH_MARGIN = config('MPESA_TOKEN_REFRESH_MARGIN', default=60, cast=int)
 
+# Queue M-Pesa STK pushes for `manage.py run_payment_workers` and answer 202
+PAYMENT_ASYNC_INITIATION = config('PAYMENT_ASYNC_INITIATION', default=False, cast=bool)
+PAYMENT_WORKER_CONCURRENCY = config('PAYMENT_WORKER_CONCURRENCY', default=8, cast=int)
+PAYMENT_WORKER_POLL_INTERVAL = config('PAYMENT_WORKER_POLL_INTERVAL', default=1.0, cast=float)
+PAYMENT_WORKER_LEASE_SECONDS = config('PAYMENT_WORKER_LEASE_SECONDS', default=300, cast=int)
+# A job that errors is retried after RETRY_DELAY * attempts seconds; after
+# MAX_ATTEMPTS claims (including reclaims of abandoned leases) its payment is failed
+PAYMENT_JOB_MAX_ATTEMPTS = config('PAYMENT_JOB_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_JOB_RETRY_DELAY = config('PAYMENT_JOB_RETRY_DELAY', default=30, cast=int)
 
+# Batch STK push: items per request and concurrent Daraja calls per batch
+PAYMENT_BATCH_MAX_ITEMS = config('PAYMENT_BATCH_MAX_ITEMS', default=100, cast=int)
+PAYMENT_BATCH_CONCURRENCY = config('PAYMENT_BATCH_CONCURRENCY', default=10, cast=int)
 
-os.makedirs(os.path.join(BASE_DIR, 'logs'), exist_ok=True)
-# Logging configuration
-LOGGING = {
-    'version': 1,
-    'disable_existing_loggers': False,
-    'handlers': {
-        'console': {
-            'level': 'DEBUG',
-            'class': 'logging.StreamHandler',
-        },
-    },
-    'root': {
-        'handlers': ['console'],
-        'level': 'INFO',
-    },
-    'loggers': {
-        'django': {
-            'handlers': ['console'],
-            'level': 'INFO',
-            'propagate': True,
-        },
-        'payments': {
-            'handlers': ['console'],
-            'level': 'INFO',
-            'propagate': True,
-        },
+# `manage.py reconcile_payments`: payments still `processing` after MIN_AGE seconds
+# are checked with the provider; after TTL seconds they are expired to `timeout`
+PAYMENT_RECONCILE_MIN_AGE = config('PAYMENT_RECONCILE_MIN_AGE', default=120, cast=int)
+PAYMENT_RECONCILE_TTL = config('PAYMENT_RECONCILE_TTL', default=86400, cast=int)
+PAYMENT_RECONCILE_BATCH_SIZE = config('PAYMENT_RECONCILE_BATCH_SIZE', default=100, cast=int)
+PAYMENT_RECONCILE_CONCURRENCY = config('PAYMENT_RECONCILE_CONCURRENCY', default=4, cast=int)
+PAYMENT_RECONCILE_RATE = config('PAYMENT_RECONCILE_RATE', default=5.0, cast=float)  # queries per second
+PAYMENT_RECONCILE_INTERVAL = config('PAYMENT_RECONCILE_INTERVAL', default=60.0, cast=float)
+
+# Store M-Pesa callbacks / Paystack webhooks in an inbox table and acknowledge at
+# once; `manage.py drain_callback_inbox` applies them in batches
+PAYMENT_CALLBACK_INBOX = config('PAYMENT_CALLBACK_INBOX', default=False, cast=bool)
+PAYMENT_INBOX_BATCH_SIZE = config('PAYMENT_INBOX_BATCH_SIZE', default=200, cast=int)
+PAYMENT_INBOX_POLL_INTERVAL = config('PAYMENT_INBOX_POLL_INTERVAL', default=0.5, cast=float)
+PAYMENT_INBOX_MAX_ATTEMPTS = config('PAYMENT_INBOX_MAX_ATTEMPTS', default=5, cast=int)
+PAYMENT_INBOX_RETRY_DELAY = config('PAYMENT_INBOX_RETRY_DELAY', default=30, cast=int)  # seconds
+
+# Days a processed callback stays in the dedupe ledger (pruned by reconcile_payments)
+PAYMENT_EVENT_RETENTION_DAYS = config('PAYMENT_EVENT_RETENTION_DAYS', default=30, cast=int)
+
+# Seconds the dashboard's status counters live before being recounted
+PAYMENT_STATS_CACHE_TTL = config('PAYMENT_STATS_CACHE_TTL', default=60, cast=int)
+# Upper bound for versioned analytics entries that are not closed days
+PAYMENT_ANALYTICS_CACHE_TTL = config('PAYMENT_ANALYTICS_CACHE_TTL', default=3600, cast=int)
+
+# Browser cache lifetime for exported receipts (they never change once issued)
+RECEIPT_EXPORT_MAX_AGE = config('RECEIPT_EXPORT_MAX_AGE', default=31536000, cast=int)
+# Rows fetched per round trip when streaming bulk receipt exports
+RECEIPT_EXPORT_CHUNK_SIZE = config('RECEIPT_EXPORT_CHUNK_SIZE', default=500, cast=int)
+
+# Rows fetched per round trip when streaming payments/export/
+PAYMENT_EXPORT_CHUNK_SIZE = config('PAYMENT_EXPORT_CHUNK_SIZE', default=2000, cast=int)
+
+# Pooled HTTP clients for Daraja and Paystack
+PAYMENT_PROVIDER_HTTP = {
+    'POOL_CONNECTIONS': config('PROVIDER_HTTP_POOL_CONNECTIONS', default=4, cast=int),
+    'POOL_MAXSIZE': config('PROVIDER_HTTP_POOL_MAXSIZE', default=20, cast=int),
+    'RETRIES': config('PROVIDER_HTTP_RETRIES', default=2, cast=int),
+    'BACKOFF_FACTOR': config('PROVIDER_HTTP_BACKOFF_FACTOR', default=0.5, cast=float),
+    # (connect, read) timeouts in seconds, per provider operation
+    'TIMEOUTS': {
+        'default': (3.05, 30),
+        'get_access_token': (3.05, 10),
+        'initiate_stk_push': (3.05, 30),
+        'query_transaction_status': (3.05, 15),
+        'register_url': (3.05, 15),
+        'initialize_transaction': (3.05, 20),
+        'verify_transaction': (3.05, 15),
+        'charge_authorization': (3.05, 30),
+        'create_customer': (3.05, 15),
     },
 }
+
+# Circuit breaker per provider operation, shared by all workers through the cache.
+# FAILURE_THRESHOLD errors (connection errors, timeouts, 5xx, or calls slower than
+# SLOW_CALL_SECONDS) within WINDOW seconds open it; calls then fail fast for
+# OPEN_SECONDS, after which HALF_OPEN_PROBES calls at a time test the provider.
+PAYMENT_CIRCUIT_BREAKER = {
+    'FAILURE_THRESHOLD': config('CIRCUIT_FAILURE_THRESHOLD', default=5, cast=int),
+    'WINDOW': config('CIRCUIT_WINDOW', default=60, cast=int),
+    'SLOW_CALL_SECONDS': config('CIRCUIT_SLOW_CALL_SECONDS', default=10.0, cast=float),
+    'OPEN_SECONDS': config('CIRCUIT_OPEN_SECONDS', default=30, cast=int),
+    'HALF_OPEN_PROBES': config('CIRCUIT_HALF_OPEN_PROBES', default=1, cast=int),
+}
+
+
+
+# Logging configuration: JSON lines, written off the request path by a queue listener
+LOG_LEVEL = config('LOG_LEVEL', default='INFO')
+LOG_DEBUG_SAMPLE_RATE = config('LOG_DEBUG_SAMPLE_RATE', default=0.01, cast=float)  # share of DEBUG records kept
+LOGGING = get_logging_config(os.path.join(BASE_DIR, 'logs'), LOG_LEVEL, LOG_DEBUG_SAMPLE_RATE)
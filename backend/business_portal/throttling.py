@@ -0,0 +1,209 @@
+import logging
+import time
+from collections import Counter
+from contextlib import contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import ValidationError
+from rest_framework.throttling import BaseThrottle
+
+logger = logging.getLogger(__name__)
+
+THROTTLE_BUCKET_KEY = 'throttle:{scope}:{ident}'
+THROTTLE_REJECTED_KEY = 'throttle:rejected:{scope}'
+THROTTLE_LOCK_TIMEOUT = 1  # seconds a bucket update may hold its lock
+THROTTLE_LOCK_ATTEMPTS = 20
+
+
+class TokenBucketThrottle(BaseThrottle):
+    """
+    Cache-backed token bucket shared by every worker.
+
+    A rate of "N/period" is a bucket holding N tokens that refills at N per
+    period, so short bursts up to N pass while the sustained rate is capped.
+    The bucket is stored as a single "theoretical arrival time" (GCRA), which
+    keeps each check to one read and one write under a short cache lock.
+    Subclasses name a `scope` in PAYMENT_THROTTLE_RATES and return the
+    bucket identities a request draws from, with the tokens each costs.
+    A rejected request gives back whatever it already took from its other
+    buckets; views combining several throttles use AllOrNothingThrottleMixin
+    so the same holds across them.
+    """
+    scope = None
+    durations = {'s': 1, 'm': 60, 'h': 3600, 'd': 86400}
+
+    def __init__(self):
+        self.rate = settings.PAYMENT_THROTTLE_RATES.get(self.scope)
+        self.wait_seconds = None
+        self.charged = []  # (bucket key, seconds of arrival time it added, period) for this request
+
+    def parse_rate(self, rate):
+        """'30/min' -> (30, 60.0)"""
+        count, period = rate.split('/')
+        return int(count), float(self.durations[period[0]])
+
+    def get_buckets(self, request, view):
+        """{identity: cost} of the buckets this request draws from"""
+        raise NotImplementedError
+
+    def allow_request(self, request, view):
+        if not self.rate:
+            return True
+        capacity, period = self.parse_rate(self.rate)
+        for ident, cost in self.get_buckets(request, view).items():
+            # A request larger than the bucket needs (and drains) a full bucket
+            cost = min(cost, capacity)
+            key = THROTTLE_BUCKET_KEY.format(scope=self.scope, ident=ident)
+            wait = self.consume(key, cost, capacity, period)
+            if wait:
+                self.refund()
+                self.wait_seconds = wait
+                self.count_rejection()
+                return False
+            self.charged.append((key, cost * period / capacity, period))
+        return True
+
+    def consume(self, key, cost, capacity, period):
+        """Take `cost` tokens from a bucket; returns 0 or the seconds until they are available"""
+        interval = period / capacity
+        with self.bucket_lock(key) as locked:
+            if not locked:
+                # Updating unlocked could lose another worker's charge; deny and let the client retry
+                logger.warning("Throttle bucket lock not acquired; denying request", extra={'throttle_scope': self.scope})
+                return THROTTLE_LOCK_TIMEOUT
+            now = time.time()
+            arrival = max(cache.get(key) or now, now) + interval * cost
+            if arrival - now > period:
+                return arrival - now - period
+            cache.set(key, arrival, timeout=int(period) + 1)
+            return 0
+
+    def refund(self):
+        """Give back the tokens this request took, because it was rejected"""
+        for key, seconds, period in self.charged:
+            with self.bucket_lock(key) as locked:
+                if not locked:
+                    # Keeping the tokens only errs towards throttling
+                    logger.warning("Throttle bucket lock not acquired; refund skipped", extra={'throttle_scope': self.scope})
+                    continue
+                arrival = cache.get(key)
+                if arrival is not None:
+                    cache.set(key, arrival - seconds, timeout=int(period) + 1)
+        self.charged = []
+
+    @staticmethod
+    @contextmanager
+    def bucket_lock(key):
+        lock_key = f'{key}:lock'
+        locked = False
+        for _ in range(THROTTLE_LOCK_ATTEMPTS):
+            if cache.add(lock_key, 1, timeout=THROTTLE_LOCK_TIMEOUT):
+                locked = True
+                break
+            time.sleep(0.005)
+        try:
+            yield locked
+        finally:
+            if locked:
+                cache.delete(lock_key)
+
+    def wait(self):
+        return self.wait_seconds
+
+    def count_rejection(self):
+        key = THROTTLE_REJECTED_KEY.format(scope=self.scope)
+        cache.add(key, 0, timeout=None)
+        try:
+            cache.incr(key)
+        except ValueError:
+            pass
+
+    @staticmethod
+    def get_rejection_counts():
+        """Rejections per scope since the counters were last reset"""
+        keys = {scope: THROTTLE_REJECTED_KEY.format(scope=scope) for scope in settings.PAYMENT_THROTTLE_RATES}
+        counts = cache.get_many(keys.values())
+        return {scope: counts.get(key, 0) for scope, key in keys.items()}
+
+
+class AllOrNothingThrottleMixin:
+    """
+    View mixin: when one throttle rejects a request, the others that let it
+    through give their tokens back, and so do all of them when the view
+    answers 400 (e.g. the serializer rejected the payload), so a rejected
+    initiation costs nothing. DRF asks every throttle either way to report
+    the longest wait.
+    """
+
+    def check_throttles(self, request):
+        allowed, durations = [], []
+        for throttle in self.get_throttles():
+            if throttle.allow_request(request, self):
+                allowed.append(throttle)
+            else:
+                durations.append(throttle.wait())
+        if durations:
+            self.refund_throttles(allowed)
+            durations = [duration for duration in durations if duration is not None]
+            self.throttled(request, max(durations, default=None))
+        self.charged_throttles = allowed
+
+    def handle_exception(self, exc):
+        response = super().handle_exception(exc)
+        if response.status_code == 400:
+            self.refund_throttles(getattr(self, 'charged_throttles', []))
+            self.charged_throttles = []
+        return response
+
+    @staticmethod
+    def refund_throttles(throttles):
+        for throttle in throttles:
+            if hasattr(throttle, 'refund'):
+                throttle.refund()
+
+
+def _payment_items(request):
+    """(phone_number, payment_method) of every payment a single or batch initiation asks for"""
+    data = request.data
+    if not hasattr(data, 'get'):
+        return []
+    items = data.get('items') if isinstance(data.get('items'), list) else [data]
+    return [
+        (str(item.get('phone_number', '')), item.get('payment_method', 'mpesa'))
+        for item in items if hasattr(item, 'get')
+    ]
+
+
+class UserPaymentThrottle(TokenBucketThrottle):
+    """Initiations per cashier, counting each payment of a batch"""
+    scope = 'payment_user'
+
+    def get_buckets(self, request, view):
+        if not request.user or not request.user.is_authenticated:
+            return {}
+        return {request.user.pk: max(len(_payment_items(request)), 1)}
+
+
+class PhonePaymentThrottle(TokenBucketThrottle):
+    """Payment requests pushed to one customer's phone"""
+    scope = 'payment_phone'
+
+    def get_buckets(self, request, view):
+        from payments.services import PaymentProcessor
+
+        phones = Counter()
+        for phone_number, _ in _payment_items(request):
+            try:
+                phones[PaymentProcessor.validate_phone_number(phone_number)] += 1
+            except ValidationError:
+                pass  # the serializer rejects it
+        return phones
+
+
+class TillPaymentThrottle(TokenBucketThrottle):
+    """STK pushes against our M-Pesa till, shared by everyone, to stay under Daraja's quota"""
+    scope = 'payment_till'
+
+    def get_buckets(self, request, view):
+        pushes = sum(1 for _, method in _payment_items(request) if method == 'mpesa')
+        return {settings.MPESA_TILL_NUMBER: pushes} if pushes else {}
@@ -0,0 +1,223 @@
+import contextvars
+import functools
+import json
+import logging
+import os
+import re
+import secrets
+import threading
+import time
+from contextlib import ExitStack, contextmanager
+from django.conf import settings
+from django.core.cache import cache
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connection
+from django.utils.module_loading import import_string
+from .logging_config import QueueListenerHandler, log_context
+
+TRACEPARENT_RE = re.compile(r'^00-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})$')
+
+_current_span = contextvars.ContextVar('current_span', default=None)
+_exporter = None
+_exporter_lock = threading.Lock()
+
+
+class SpanContext:
+    """The W3C trace-context identity of a span: what travels in a traceparent header"""
+
+    def __init__(self, trace_id, span_id, sampled=True):
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @classmethod
+    def from_traceparent(cls, header):
+        match = TRACEPARENT_RE.match((header or '').strip().lower())
+        if not match or match.group(1) == '0' * 32 or match.group(2) == '0' * 16:
+            return None
+        return cls(match.group(1), match.group(2), sampled=bool(int(match.group(3), 16) & 1))
+
+    def to_traceparent(self):
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+class Span:
+    def __init__(self, name, parent=None, attributes=None):
+        self.name = name
+        self.context = SpanContext(parent.trace_id if parent else secrets.token_hex(16), secrets.token_hex(8),
+                                   sampled=parent.sampled if parent else True)
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes or {})
+        self.status = 'ok'
+        self.start_ns = time.time_ns()
+        self.end_ns = None
+
+    def set_attribute(self, name, value):
+        self.attributes[name] = value
+
+    def end(self):
+        self.end_ns = time.time_ns()
+
+    def to_dict(self):
+        """OTLP-like JSON representation"""
+        return {
+            'traceId': self.context.trace_id,
+            'spanId': self.context.span_id,
+            'parentSpanId': self.parent_id,
+            'name': self.name,
+            'startTimeUnixNano': self.start_ns,
+            'endTimeUnixNano': self.end_ns,
+            'durationMs': round((self.end_ns - self.start_ns) / 1e6, 3),
+            'attributes': self.attributes,
+            'status': self.status,
+        }
+
+
+class SpanExporter:
+    """Receives every finished span; subclass and point TRACING_EXPORTER at it"""
+
+    def export(self, span):
+        raise NotImplementedError
+
+
+class SpanFormatter(logging.Formatter):
+    def format(self, record):
+        return json.dumps(record.span, default=str)
+
+
+class FileSpanExporter(SpanExporter):
+    """
+    Appends spans as JSON lines to TRACING_FILE, a local stand-in for an OTLP
+    collector. The request thread only enqueues the span; encoding and the
+    file write happen on the same kind of queue listener the JSON logs use.
+    """
+
+    def __init__(self, path=None):
+        self.path = path or settings.TRACING_FILE
+        os.makedirs(os.path.dirname(self.path), exist_ok=True)
+        file_handler = logging.FileHandler(self.path)
+        file_handler.setFormatter(SpanFormatter())
+        self.handler = QueueListenerHandler([file_handler])
+
+    def export(self, span):
+        self.handler.handle(logging.makeLogRecord({'levelno': logging.INFO, 'span': span.to_dict()}))
+
+
+class InMemorySpanExporter(SpanExporter):
+    def __init__(self):
+        self.spans = []
+
+    def export(self, span):
+        self.spans.append(span)
+
+
+def get_exporter():
+    global _exporter
+    if _exporter is None:
+        with _exporter_lock:
+            if _exporter is None:
+                _exporter = import_string(settings.TRACING_EXPORTER)()
+    return _exporter
+
+
+def set_exporter(exporter):
+    global _exporter
+    _exporter = exporter
+
+
+def current_span():
+    return _current_span.get()
+
+
+@contextmanager
+def start_span(name, parent=None, **attributes):
+    """Run the block in a child span of `parent` (a SpanContext) or of the current span.
+
+    Yields None without recording anything when TRACING_ENABLED is off. Spans
+    of a trace whose caller cleared the traceparent `sampled` flag are not
+    exported.
+    """
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+    if parent is None and _current_span.get() is not None:
+        parent = _current_span.get().context
+    span = Span(name, parent, attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = 'error'
+        span.set_attribute('exception', f'{type(e).__name__}: {e}')
+        raise
+    finally:
+        _current_span.reset(token)
+        span.end()
+        if span.context.sampled:
+            get_exporter().export(span)
+
+
+def traced(name=None):
+    """Decorator running the function in a span named after it"""
+    def decorator(func):
+        span_name = name or func.__qualname__
+
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            with start_span(span_name):
+                return func(*args, **kwargs)
+        return wrapper
+    return decorator
+
+
+def remember_trace(key, timeout):
+    """Store the current span's context under `key` so a later, unrelated request can join its trace"""
+    span = _current_span.get()
+    if span is not None:
+        cache.set(f'trace:{key}', {'traceparent': span.context.to_traceparent(), 'started_ns': span.start_ns}, timeout)
+
+
+def recall_trace(key):
+    """(SpanContext, start time in ns) stored by remember_trace, or None"""
+    if not settings.TRACING_ENABLED:
+        return None
+    stored = cache.get(f'trace:{key}')
+    if not stored:
+        return None
+    context = SpanContext.from_traceparent(stored['traceparent'])
+    return (context, stored['started_ns']) if context else None
+
+
+def trace_query(execute, sql, params, many, context):
+    """connection.execute_wrapper hook putting each SQL statement in its own span"""
+    with start_span('db.query', **{'db.statement': sql, 'db.executemany': many}):
+        return execute(sql, params, many, context)
+
+
+class TracingMiddleware:
+    """
+    Root span per request, continuing the caller's trace when a traceparent
+    header is sent. SQL executed while handling a sampled request gets child
+    spans, and the response carries a `traceresponse` header with the trace id.
+    """
+
+    def __init__(self, get_response):
+        if not settings.TRACING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+
+    def __call__(self, request):
+        parent = SpanContext.from_traceparent(request.headers.get('traceparent'))
+        with start_span(f'{request.method} {request.path}', parent=parent,
+                        **{'http.method': request.method, 'http.target': request.path}) as span:
+            with log_context(trace_id=span.context.trace_id), ExitStack() as stack:
+                if span.context.sampled:
+                    stack.enter_context(connection.execute_wrapper(trace_query))
+                response = self.get_response(request)
+            if request.resolver_match is not None:
+                span.name = f'{request.method} {request.resolver_match.route}'
+            span.set_attribute('http.status_code', response.status_code)
+            if response.status_code >= 500:
+                span.status = 'error'
+        response['traceresponse'] = span.context.to_traceparent()
+        return response
@@ -2,6 +2,10 @@
 from django.contrib import admin
 from django.urls import path, include
 from django.http import HttpResponse, JsonResponse
+from rest_framework.decorators import api_view, permission_classes
+from rest_framework.permissions import IsAuthenticated
+from business_portal.metrics import CONTENT_TYPE, REGISTRY
+from business_portal.permissions import IsAdmin
 
 def root_view(request):
     return HttpResponse("Welcome to Business Portal API")
@@ -17,10 +21,17 @@ def api_root_view(request):
         }
     })
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def metrics_view(request):
+    """Prometheus scrape endpoint, aggregated across all workers"""
+    return HttpResponse(REGISTRY.render(), content_type=CONTENT_TYPE)
+
 urlpatterns = [
     path('', root_view),
     path('admin/', admin.site.urls),
     path('api/', api_root_view),  # ← ADD THIS LINE
+    path('api/metrics/', metrics_view),
     path('api/accounts/', include('accounts.urls')),
     path('api/payments/', include('payments.urls')),
     path('api/receipts/', include('receipts.urls')),
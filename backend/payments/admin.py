@@ -1,5 +1,5 @@
 from django.contrib import admin
-from .models import Payment
+from .models import CallbackInbox, Payment, PaymentJob
 
 @admin.register(Payment)
 class PaymentAdmin(admin.ModelAdmin):
@@ -14,4 +14,17 @@ class PaymentAdmin(admin.ModelAdmin):
         if obj:  # Editing an existing object
             return self.readonly_fields
         # When creating a new object, allow reference_id to be set automatically
-        return [f for f in self.readonly_fields if f != 'reference_id']
\ No newline at end of file
+        return [f for f in self.readonly_fields if f != 'reference_id']
+
+@admin.register(PaymentJob)
+class PaymentJobAdmin(admin.ModelAdmin):
+    list_display = ('payment', 'status', 'attempts', 'available_at', 'locked_at', 'updated_at')
+    list_filter = ('status',)
+    search_fields = ('payment__reference_id',)
+    readonly_fields = ('payment', 'attempts', 'last_error', 'locked_at', 'created_at', 'updated_at')
+
+@admin.register(CallbackInbox)
+class CallbackInboxAdmin(admin.ModelAdmin):
+    list_display = ('id', 'provider', 'received_at', 'attempts', 'processed_at', 'error')
+    list_filter = ('provider', ('processed_at', admin.EmptyFieldListFilter))
+    readonly_fields = ('provider', 'body', 'received_at', 'available_at', 'attempts', 'processed_at', 'error')
@@ -1,29 +1,35 @@
-from django.db.models import Sum, Count
-from django.db.models.functions import TruncDate
-from .models import Payment
+import time
+from decimal import Decimal
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import Sum, Count, Q
+from django.db.models.functions import Coalesce
+from .models import Payment, PaymentDailyRollup
 from accounts.models import CustomUser
 from datetime import datetime, timedelta
 from django.utils import timezone
 
+PAYMENT_STATUSES = [status for status, _ in Payment.STATUS_CHOICES]
+STATS_COUNT_KEY = 'payments:stats:count:{status}'
+STATS_AMOUNT_KEY = 'payments:stats:success_amount_cents'
+
 class PaymentAnalytics:
     @staticmethod
     def get_daily_summary(start_date=None, end_date=None):
-        """Get daily payment summary"""
-        payments = Payment.objects.all()
+        """Get daily payment summary from the pre-aggregated rollups"""
+        rollups = PaymentDailyRollup.objects.all()
         
         if start_date:
-            payments = payments.filter(created_at__date__gte=start_date)
+            rollups = rollups.filter(date__gte=start_date)
         if end_date:
-            payments = payments.filter(created_at__date__lte=end_date)
+            rollups = rollups.filter(date__lte=end_date)
         
-        daily_summary = payments.annotate(
-            date=TruncDate('created_at')
-        ).values('date').annotate(
-            total_amount=Sum('amount'),
-            total_count=Count('id'),
-            success_count=Count('id', filter=Payment.objects.filter(status='success')),
-            failed_count=Count('id', filter=Payment.objects.filter(status='failed')),
-        ).order_by('-date')
+        daily_summary = rollups.values('date').annotate(
+            total_amount=Coalesce(Sum('total_amount'), Decimal('0')),
+            total_count=Coalesce(Sum('count'), 0),
+            success_count=Coalesce(Sum('count', filter=Q(status='success')), 0),
+            failed_count=Coalesce(Sum('count', filter=Q(status='failed')), 0),
+        ).filter(total_count__gt=0).order_by('-date')
         
         return list(daily_summary)
     
@@ -43,24 +49,216 @@ class PaymentAnalytics:
         ).annotate(
             total_amount=Sum('amount'),
             total_count=Count('id'),
-            success_count=Count('id', filter=Payment.objects.filter(status='success')),
+            success_count=Count('id', filter=Q(status='success')),
         ).order_by('-total_amount')
         
         return list(user_summary)
     
     @staticmethod
     def get_overall_stats():
-        """Get overall payment statistics"""
-        total_payments = Payment.objects.count()
-        successful_payments = Payment.objects.filter(status='success').count()
-        total_amount = Payment.objects.filter(status='success').aggregate(Sum('amount'))['amount__sum'] or 0
+        """Get overall payment statistics from the cached counters"""
+        return PaymentAnalytics.stats_from_counters(PaymentAnalytics.load_stats_counters()[0])
+
+    @staticmethod
+    def load_stats_counters():
+        """(counters, whether all of them were cached); missing ones are recounted"""
+        keys = [STATS_COUNT_KEY.format(status=status) for status in PAYMENT_STATUSES] + [STATS_AMOUNT_KEY]
+        cached = cache.get_many(keys)
+        if len(cached) != len(keys):
+            return PaymentAnalytics.refresh_stats_counters(), False
+        return cached, True
+
+    @staticmethod
+    def stats_from_counters(cached):
+        counts = {status: cached[STATS_COUNT_KEY.format(status=status)] for status in PAYMENT_STATUSES}
+        total_payments = sum(counts.values())
+        successful_payments = counts['success']
         
         stats = {
             'total_payments': total_payments,
             'successful_payments': successful_payments,
-            'failed_payments': total_payments - successful_payments,
+            'failed_payments': counts['failed'],
+            'pending_payments': counts['pending'],
+            'initiated_payments': counts['initiated'],
+            'processing_payments': counts['processing'],
+            'cancelled_payments': counts['cancelled'],
+            'timeout_payments': counts['timeout'],
             'success_rate': (successful_payments / total_payments * 100) if total_payments > 0 else 0,
-            'total_amount_processed': total_amount,
+            'total_amount_processed': Decimal(cached[STATS_AMOUNT_KEY]) / 100,
+        }
+        
+        return stats
+
+    @staticmethod
+    def refresh_stats_counters():
+        """Recount every status bucket in one query and reseed the cached counters"""
+        aggregates = {
+            status: Coalesce(Sum('count', filter=Q(status=status)), 0) for status in PAYMENT_STATUSES
         }
+        aggregates['success_amount'] = Coalesce(
+            Sum('total_amount', filter=Q(status='success')), Decimal('0')
+        )
+        totals = PaymentDailyRollup.objects.aggregate(**aggregates)
         
-        return stats
\ No newline at end of file
+        values = {STATS_COUNT_KEY.format(status=status): totals[status] for status in PAYMENT_STATUSES}
+        values[STATS_AMOUNT_KEY] = int(totals['success_amount'] * 100)
+        cache.set_many(values, timeout=settings.PAYMENT_STATS_CACHE_TTL)
+        return values
+
+    @staticmethod
+    def update_stats_counters(status, count, amount):
+        """Atomically adjust the cached counters for one status transition.
+
+        Missing counters are left alone; the next read reseeds them.
+        """
+        try:
+            cache.incr(STATS_COUNT_KEY.format(status=status), count)
+            if status == 'success':
+                cache.incr(STATS_AMOUNT_KEY, int(Decimal(amount) * 100))
+        except ValueError:
+            pass
+
+
+ANALYTICS_VERSION_KEY = 'payments:analytics:version'
+ANALYTICS_DAY_VERSION_KEY = 'payments:analytics:version:{day}'
+ANALYTICS_COUNTER_KEY = 'payments:analytics:{outcome}:{name}'
+ANALYTICS_ENDPOINTS = ('daily', 'user', 'overall')
+
+
+class CachedPaymentAnalytics:
+    """
+    Response cache in front of PaymentAnalytics.
+
+    Entries are keyed by a version counter that every payment status change
+    bumps, so a stale entry is simply never looked up again. Closed days only
+    change when one of their own payments does, so each one has its own
+    version and is cached without expiry; today's bucket is always recomputed.
+    """
+
+    @staticmethod
+    def get_daily_summary(start_date=None, end_date=None):
+        today = timezone.localdate()
+        first_day = CachedPaymentAnalytics._first_day()
+        end = min(end_date or today, today)
+        if first_day is None:
+            return []
+        # Days before the first payment have no rollups; don't key a cache entry per day back to start_date
+        start = max(start_date or first_day, first_day)
+        if start > end:
+            return []
+
+        last_closed = min(end, today - timedelta(days=1))
+        closed_days = [start + timedelta(days=n) for n in range((last_closed - start).days + 1)]
+        versions = CachedPaymentAnalytics._versions(
+            [ANALYTICS_DAY_VERSION_KEY.format(day=day) for day in closed_days]
+        )
+        entry_keys = {
+            day: f"payments:analytics:daily:{day}:{versions[ANALYTICS_DAY_VERSION_KEY.format(day=day)]}"
+            for day in closed_days
+        }
+        entries = cache.get_many(list(entry_keys.values()))
+        missing = [day for day, key in entry_keys.items() if key not in entries]
+        CachedPaymentAnalytics._count('daily', hits=len(closed_days) - len(missing), misses=len(missing))
+
+        if missing:
+            rows = {
+                row['date']: row
+                for row in PaymentAnalytics.get_daily_summary(min(missing), max(missing))
+            }
+            # Days without payments are cached too, as an empty dict
+            fresh = {entry_keys[day]: rows.get(day, {}) for day in missing}
+            cache.set_many(fresh, timeout=None)
+            entries.update(fresh)
+
+        summary = [entries[entry_keys[day]] for day in reversed(closed_days) if entries[entry_keys[day]]]
+        if end == today:
+            summary = PaymentAnalytics.get_daily_summary(today, today) + summary
+        return summary
+
+    @staticmethod
+    def get_user_summary(user_type=None):
+        version = CachedPaymentAnalytics._versions([ANALYTICS_VERSION_KEY])[ANALYTICS_VERSION_KEY]
+        key = f"payments:analytics:user:{user_type or 'all'}:{version}"
+        summary = cache.get(key)
+        CachedPaymentAnalytics._count('user', hits=int(summary is not None), misses=int(summary is None))
+        if summary is None:
+            summary = PaymentAnalytics.get_user_summary(user_type)
+            cache.set(key, summary, timeout=settings.PAYMENT_ANALYTICS_CACHE_TTL)
+        return summary
+
+    @staticmethod
+    def get_overall_stats():
+        # Served from incrementally maintained counters; a miss is a recount
+        counters, cached = PaymentAnalytics.load_stats_counters()
+        CachedPaymentAnalytics._count('overall', hits=int(cached), misses=int(not cached))
+        return PaymentAnalytics.stats_from_counters(counters)
+
+    @staticmethod
+    def bump_version(day):
+        """Invalidate the entries affected by a change to a payment created on `day`"""
+        for key in (ANALYTICS_VERSION_KEY, ANALYTICS_DAY_VERSION_KEY.format(day=day)):
+            try:
+                cache.incr(key)
+            except ValueError:
+                cache.set(key, time.time_ns(), timeout=None)
+
+    @staticmethod
+    def get_cache_stats():
+        keys = {
+            (name, outcome): ANALYTICS_COUNTER_KEY.format(outcome=outcome, name=name)
+            for name in ANALYTICS_ENDPOINTS for outcome in ('hits', 'misses')
+        }
+        counters = cache.get_many(list(keys.values()))
+        stats = {}
+        for name in ANALYTICS_ENDPOINTS:
+            hits = counters.get(keys[(name, 'hits')], 0)
+            misses = counters.get(keys[(name, 'misses')], 0)
+            stats[name] = {
+                'hits': hits,
+                'misses': misses,
+                'hit_rate': (hits / (hits + misses) * 100) if hits + misses else 0,
+            }
+        return stats
+
+    @staticmethod
+    def _first_day():
+        version = CachedPaymentAnalytics._versions([ANALYTICS_VERSION_KEY])[ANALYTICS_VERSION_KEY]
+        key = f"payments:analytics:first_day:{version}"
+        first_day = cache.get(key)
+        if first_day is None:
+            first_day = PaymentDailyRollup.objects.filter(count__gt=0).order_by('date').values_list(
+                'date', flat=True
+            ).first() or ''
+            cache.set(key, first_day, timeout=settings.PAYMENT_ANALYTICS_CACHE_TTL)
+        return first_day or None
+
+    @staticmethod
+    def _versions(keys):
+        """Current version of each key, seeding missing ones.
+
+        Seeds come from the clock so a version evicted from the cache never
+        comes back with a value an old entry was stored under.
+        """
+        versions = cache.get_many(keys)
+        missing = [key for key in keys if key not in versions]
+        if missing:
+            seed = time.time_ns()
+            for key in missing:
+                cache.add(key, seed, timeout=None)
+            versions.update(cache.get_many(missing))
+            # A full cache may evict a seed straight away; the entry is then just a miss
+            for key in missing:
+                versions.setdefault(key, seed)
+        return versions
+
+    @staticmethod
+    def _count(name, hits=0, misses=0):
+        for outcome, amount in (('hits', hits), ('misses', misses)):
+            if not amount:
+                continue
+            key = ANALYTICS_COUNTER_KEY.format(outcome=outcome, name=name)
+            cache.add(key, 0, timeout=None)
+            try:
+                cache.incr(key, amount)
+            except ValueError:
+                pass
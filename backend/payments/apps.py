@@ -1,6 +1,16 @@
 from django.apps import AppConfig
+from django.db.models.signals import post_delete
 
 
 class PaymentsConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'payments'
+
+    def ready(self):
+        from . import signals
+        from .models import Payment
+        signals.payment_status_changed.connect(signals.update_daily_rollup, dispatch_uid='payments.daily_rollup')
+        signals.payment_status_changed.connect(signals.update_stats_counters, dispatch_uid='payments.stats_counters')
+        signals.payment_status_changed.connect(signals.bump_analytics_version, dispatch_uid='payments.analytics_version')
+        signals.payment_status_changed.connect(signals.count_status_transition, dispatch_uid='payments.transition_metrics')
+        post_delete.connect(signals.forget_deleted_payment, sender=Payment, dispatch_uid='payments.daily_rollup_delete')
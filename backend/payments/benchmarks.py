@@ -0,0 +1,155 @@
+import hashlib
+import hmac
+import json
+import statistics
+import time
+from django.conf import settings
+from django.db import connection
+from django.db.models import Count
+from django.test import Client
+from django.test.utils import CaptureQueriesContext
+from accounts.models import CustomUser
+from .analytics import PaymentAnalytics
+from .models import Payment
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list"""
+    if not sorted_values:
+        return None
+    return sorted_values[max(0, min(len(sorted_values) - 1, round(fraction * len(sorted_values)) - 1))]
+
+
+def summarize(timings, query_counts):
+    timings = sorted(timings)
+    return {
+        'n': len(timings),
+        'p50_ms': round(percentile(timings, 0.50), 3),
+        'p95_ms': round(percentile(timings, 0.95), 3),
+        'p99_ms': round(percentile(timings, 0.99), 3),
+        'mean_ms': round(statistics.fmean(timings), 3),
+        'max_ms': round(timings[-1], 3),
+        'queries': max(query_counts),
+    }
+
+
+class EndpointBenchmark:
+    """
+    Times the list, analytics and callback paths against whatever is in the
+    database, as requests through the full middleware stack plus direct calls
+    to the uncached PaymentAnalytics queries.
+
+    Each case runs `warmup` untimed iterations, then `iterations` timed ones;
+    every timed iteration also counts its SQL statements. The callback cases
+    settle payments that are still `processing`, so run the suite against a
+    scratch database filled by generate_payment_data.
+    """
+
+    def __init__(self, iterations=50, warmup=5):
+        self.iterations = iterations
+        self.warmup = warmup
+        self.host = settings.ALLOWED_HOSTS[0].lstrip('.')
+        self.client = Client(HTTP_HOST=self.host)
+        self.user_clients = {}
+
+    def cases(self):
+        """[(name, callable)] for every benchmarked path, given the current data"""
+        admin = CustomUser.objects.filter(user_type='admin').first()
+        # The busiest initiator: the worst case for per-user listings and totals
+        busiest = (
+            Payment.objects.filter(initiated_by__isnull=False).values('initiated_by')
+            .annotate(n=Count('id')).order_by('-n').values_list('initiated_by', flat=True).first()
+        )
+        staff = CustomUser.objects.filter(pk=busiest).first()
+        settled = Payment.objects.filter(status='success', payment_method='mpesa').values_list(
+            'mpesa_transaction_id', flat=True
+        )[:1]
+        paystack_settled = Payment.objects.filter(status='success', payment_method='paystack').values_list(
+            'paystack_reference', flat=True
+        )[:1]
+        processing = iter(Payment.objects.filter(status='processing', payment_method='mpesa').values_list(
+            'mpesa_transaction_id', flat=True
+        )[:self.warmup + self.iterations])
+
+        cases = []
+        if admin:
+            cases += [
+                ('payment_list', self.get(admin, '/api/payments/list/')),
+                ('payment_list_page_10', self.deep_page(admin, '/api/payments/list/', 10)),
+                ('analytics_daily', self.get(admin, '/api/payments/analytics/daily/')),
+                ('analytics_user', self.get(admin, '/api/payments/analytics/user/')),
+                ('analytics_stats', self.get(admin, '/api/payments/analytics/stats/')),
+            ]
+        if staff:
+            cases += [
+                ('payment_list_busiest_user', self.get(staff, '/api/payments/list/')),
+                ('total_collected_busiest_user', self.get(staff, '/api/payments/total/')),
+            ]
+        cases += [
+            ('query_daily_summary', PaymentAnalytics.get_daily_summary),
+            ('query_user_summary', PaymentAnalytics.get_user_summary),
+            ('query_overall_stats', PaymentAnalytics.refresh_stats_counters),
+            ('mpesa_callback_unknown', lambda: self.mpesa_callback('ws_CO_benchmark_unknown')),
+        ]
+        if settled:
+            cases.append(('mpesa_callback_duplicate', lambda: self.mpesa_callback(settled[0], result_code=0)))
+        if paystack_settled:
+            cases.append(('paystack_webhook_duplicate', lambda: self.paystack_webhook(paystack_settled[0])))
+        cases.append(('mpesa_callback_settle', lambda: self.mpesa_callback(next(processing, 'ws_CO_benchmark_none'))))
+        return cases
+
+    def run(self, names=None, progress=None):
+        results = {}
+        for name, call in self.cases():
+            if names and name not in names:
+                continue
+            results[name] = self.measure(call)
+            if progress:
+                progress(name, results[name])
+        return results
+
+    def measure(self, call):
+        for _ in range(self.warmup):
+            call()
+        timings, query_counts = [], []
+        for _ in range(self.iterations):
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                call()
+                timings.append((time.perf_counter() - started) * 1000)
+            query_counts.append(len(queries))
+        return summarize(timings, query_counts)
+
+    def client_for(self, user):
+        """A client logged in as `user`, so session setup stays out of the timings"""
+        if user.pk not in self.user_clients:
+            self.user_clients[user.pk] = Client(HTTP_HOST=self.host)
+            self.user_clients[user.pk].force_login(user)
+        return self.user_clients[user.pk]
+
+    def get(self, user, path):
+        client = self.client_for(user)
+
+        def call():
+            response = client.get(path)
+            assert response.status_code == 200, f"GET {path}: {response.status_code}"
+            return response
+        return call
+
+    def deep_page(self, user, path, page):
+        """GET the `page`th page of a keyset-paginated list, following `next` links once up front"""
+        url = path
+        for _ in range(page - 1):
+            url = self.client_for(user).get(url).json().get('next') or url
+        return self.get(user, url)
+
+    def mpesa_callback(self, checkout_request_id, result_code=1032):
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code}}}
+        return self.client.post('/api/payments/mpesa/callback/', json.dumps(body), content_type='application/json')
+
+    def paystack_webhook(self, reference):
+        body = json.dumps({'event': 'charge.success', 'data': {'reference': reference, 'status': 'success'}})
+        signature = hmac.new(settings.PAYSTACK_WEBHOOK_SECRET.encode(), body.encode(), hashlib.sha512).hexdigest()
+        return self.client.post(
+            '/api/payments/webhook/', body, content_type='application/json', HTTP_X_PAYSTACK_SIGNATURE=signature
+        )
@@ -0,0 +1,221 @@
+import os
+import threading
+import time
+import requests
+from django.core.cache import cache
+from business_portal.metrics import provider_request_seconds
+from business_portal.profiling import record_provider_call
+from business_portal.tracing import start_span
+from django.conf import settings
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+RETRY_STATUS_CODES = (429, 500, 502, 503, 504)
+
+_clients = {}
+_clients_lock = threading.Lock()
+
+
+class ProviderUnavailable(Exception):
+    """Raised instead of calling a provider operation whose circuit is open"""
+
+    def __init__(self, provider, operation):
+        self.provider = provider
+        self.operation = operation
+        super().__init__(f"{provider} is temporarily unavailable ({operation}); please try again shortly")
+
+
+class CircuitBreaker:
+    """Closed / open / half-open breaker for one provider operation.
+
+    State lives in the cache so every worker sees the same circuit:
+    `open` exists while calls must fail fast, `tripped` stays until a probe
+    succeeds (its presence without `open` is the half-open state), `failures`
+    counts errors in the current window and `probes` the half-open calls in
+    flight.
+
+    The failure window is fixed, not sliding: it starts with the first failure
+    and lasts WINDOW seconds, then the count starts over. A burst straddling
+    two windows can therefore reach 2 * (FAILURE_THRESHOLD - 1) failures
+    within WINDOW seconds without tripping the circuit.
+    """
+
+    def __init__(self, provider, operation, options=None):
+        self.provider = provider
+        self.operation = operation
+        self.options = options or settings.PAYMENT_CIRCUIT_BREAKER
+        self.key = f'circuit:{provider}:{operation}'
+
+    def state(self):
+        if cache.get(f'{self.key}:open'):
+            return 'open'
+        return 'half_open' if cache.get(f'{self.key}:tripped') else 'closed'
+
+    def before_call(self):
+        """Raise ProviderUnavailable unless the call may go ahead; True if it is a probe"""
+        state = self.state()
+        if state == 'closed':
+            return False
+        if state == 'half_open' and self._take_probe_slot():
+            return True
+        raise ProviderUnavailable(self.provider, self.operation)
+
+    def record(self, failed, probe):
+        if probe:
+            self._release_probe_slot()
+            if failed:
+                self.trip()
+            else:
+                cache.delete_many([f'{self.key}:tripped', f'{self.key}:failures'])
+            return
+        if not failed:
+            return
+        failures_key = f'{self.key}:failures'
+        cache.add(failures_key, 0, timeout=self.options['WINDOW'])
+        try:
+            failures = cache.incr(failures_key)
+        except ValueError:
+            failures = 1
+        if failures >= self.options['FAILURE_THRESHOLD']:
+            self.trip()
+
+    def trip(self):
+        cache.set(f'{self.key}:open', 1, timeout=self.options['OPEN_SECONDS'])
+        cache.set(f'{self.key}:tripped', 1, timeout=None)
+        cache.delete(f'{self.key}:failures')
+
+    def _take_probe_slot(self):
+        probes_key = f'{self.key}:probes'
+        # Expires on its own if a probe's worker dies mid-call
+        cache.add(probes_key, 0, timeout=self.options['OPEN_SECONDS'])
+        try:
+            taken = cache.incr(probes_key) <= self.options['HALF_OPEN_PROBES']
+        except ValueError:
+            return False
+        if not taken:
+            self._release_probe_slot()
+        return taken
+
+    def _release_probe_slot(self):
+        # Only this probe's slot: others may still be in flight
+        try:
+            cache.decr(f'{self.key}:probes')
+        except ValueError:
+            pass  # expired meanwhile
+
+
+class ProviderClient:
+    """Long-lived, pooled HTTP client for one payment provider.
+
+    Connections are kept alive between calls so each payment no longer pays for
+    a fresh TCP + TLS handshake. Calls flagged as idempotent are retried with
+    backoff on connection errors and 429/5xx answers; every other call is only
+    retried when the connection could not be established at all, because the
+    request never reached the provider in that case.
+    """
+
+    def __init__(self, name, options=None):
+        options = options or settings.PAYMENT_PROVIDER_HTTP
+        self.name = name
+        self.timeouts = options['TIMEOUTS']
+        self.breakers = {}
+        self.session = self._build_session(options, Retry(
+            total=options['RETRIES'],
+            connect=options['RETRIES'],
+            read=0,
+            status=0,
+            backoff_factor=options['BACKOFF_FACTOR'],
+        ))
+        self.idempotent_session = self._build_session(options, Retry(
+            total=options['RETRIES'],
+            backoff_factor=options['BACKOFF_FACTOR'],
+            status_forcelist=RETRY_STATUS_CODES,
+            allowed_methods=None,  # we decide per call what is safe to repeat
+            raise_on_status=False,
+        ))
+
+    @staticmethod
+    def _build_session(options, retry):
+        session = requests.Session()
+        adapter = HTTPAdapter(
+            pool_connections=options['POOL_CONNECTIONS'],
+            pool_maxsize=options['POOL_MAXSIZE'],
+            max_retries=retry,
+        )
+        session.mount('https://', adapter)
+        session.mount('http://', adapter)
+        return session
+
+    def get_timeout(self, operation):
+        """(connect, read) timeout in seconds for a provider operation"""
+        return tuple(self.timeouts.get(operation, self.timeouts['default']))
+
+    def get_breaker(self, operation):
+        breaker = self.breakers.get(operation)
+        if breaker is None:
+            breaker = self.breakers[operation] = CircuitBreaker(self.name, operation)
+        return breaker
+
+    def request(self, method, url, operation, idempotent=False, **kwargs):
+        """Send a request through the operation's circuit breaker.
+
+        Raises ProviderUnavailable without touching the network while the
+        circuit is open. Connection errors, timeouts, 5xx answers and calls
+        slower than SLOW_CALL_SECONDS count as failures.
+        """
+        with start_span(f'http {self.name}.{operation}', **{'http.method': method, 'http.url': url}) as span:
+            if span is not None:
+                kwargs['headers'] = {**(kwargs.get('headers') or {}), 'traceparent': span.context.to_traceparent()}
+            response = self._send(method, url, operation, idempotent, **kwargs)
+            if span is not None:
+                span.set_attribute('http.status_code', response.status_code)
+            return response
+
+    def _send(self, method, url, operation, idempotent, **kwargs):
+        breaker = self.get_breaker(operation)
+        probe = breaker.before_call()
+        session = self.idempotent_session if idempotent else self.session
+        kwargs.setdefault('timeout', self.get_timeout(operation))
+        started = time.monotonic()
+        try:
+            response = session.request(method, url, **kwargs)
+        except requests.RequestException:
+            elapsed = time.monotonic() - started
+            breaker.record(failed=True, probe=probe)
+            provider_request_seconds.observe(elapsed, provider=self.name, operation=operation, outcome='exception')
+            record_provider_call(elapsed)
+            raise
+        elapsed = time.monotonic() - started
+        record_provider_call(elapsed)
+        breaker.record(failed=response.status_code >= 500 or elapsed > breaker.options['SLOW_CALL_SECONDS'],
+                       probe=probe)
+        provider_request_seconds.observe(
+            elapsed, provider=self.name, operation=operation, outcome=f'{response.status_code // 100}xx'
+        )
+        return response
+
+    def get(self, url, operation, idempotent=True, **kwargs):
+        return self.request('GET', url, operation, idempotent=idempotent, **kwargs)
+
+    def post(self, url, operation, idempotent=False, **kwargs):
+        return self.request('POST', url, operation, idempotent=idempotent, **kwargs)
+
+    def close(self):
+        self.session.close()
+        self.idempotent_session.close()
+
+
+def get_provider_client(name):
+    """Return the per-process client for a provider, creating it on first use.
+
+    Clients are keyed by PID as well so a worker forked from a preloaded master
+    never shares pooled sockets with its parent.
+    """
+    key = (name, os.getpid())
+    client = _clients.get(key)
+    if client is None:
+        with _clients_lock:
+            client = _clients.get(key)
+            if client is None:
+                client = _clients[key] = ProviderClient(name)
+    return client
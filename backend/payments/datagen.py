@@ -0,0 +1,227 @@
+import csv
+import io
+import json
+import random
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from django.contrib.auth.hashers import make_password
+from django.db import connection, transaction
+from django.utils import timezone
+from accounts.models import CustomUser
+from receipts.models import Receipt
+from receipts.services import ReceiptGenerator
+from .analytics import CachedPaymentAnalytics, PaymentAnalytics
+from .models import Payment, PaymentDailyRollup
+
+# Roughly what production looks like: most STK pushes complete, a few are abandoned
+DEFAULT_STATUS_MIX = {
+    'success': 70, 'failed': 12, 'cancelled': 6, 'timeout': 4, 'processing': 5, 'initiated': 2, 'pending': 1,
+}
+DEFAULT_USER_TYPE_MIX = {'staff': 90, 'admin': 5, 'auditor': 5}
+
+
+def parse_mix(value):
+    """'success=70,failed=30' -> {'success': 70.0, 'failed': 30.0}"""
+    mix = {}
+    for part in filter(None, (part.strip() for part in value.split(','))):
+        name, _, weight = part.partition('=')
+        mix[name.strip()] = float(weight)
+    return mix
+
+
+class SyntheticDataGenerator:
+    """
+    Bulk-inserts realistic users, payments and receipts for load and scale tests.
+
+    Payments are spread over the last `days` days and over users with a Zipf
+    distribution of exponent `skew` (0 = uniform; ~1.2 gives a few tills that
+    collect most of the volume, like production). Every successful payment gets
+    a receipt. On PostgreSQL rows are streamed in with COPY, elsewhere with
+    bulk_create. Rollups and cached stats are rebuilt at the end, since bulk
+    inserts bypass Payment.save() and its signal.
+    """
+
+    def __init__(self, status_mix=None, mpesa_share=0.8, skew=1.2, days=365, batch_size=10000, seed=None):
+        statuses = {status for status, _ in Payment.STATUS_CHOICES}
+        status_mix = status_mix or DEFAULT_STATUS_MIX
+        unknown = set(status_mix) - statuses
+        if unknown:
+            raise ValueError(f"Unknown payment statuses: {', '.join(sorted(unknown))}")
+        self.statuses = list(status_mix)
+        self.status_weights = list(status_mix.values())
+        self.mpesa_share = mpesa_share
+        self.skew = skew
+        self.days = days
+        self.batch_size = batch_size
+        self.random = random.Random(seed)
+        self.now = timezone.now()
+
+    def create_users(self, count, prefix='loadtest'):
+        """Create `count` users with a shared unusable password hash; returns them all"""
+        password = make_password(None)
+        user_types = self.random.choices(
+            list(DEFAULT_USER_TYPE_MIX), weights=list(DEFAULT_USER_TYPE_MIX.values()), k=count
+        )
+        run = uuid.uuid4().hex[:6]
+        users = [
+            CustomUser(
+                username=f"{prefix}_{run}_{i}",
+                first_name='Load',
+                last_name=f"Tester {i}",
+                email=f"{prefix}_{run}_{i}@example.com",
+                user_type=user_type,
+                phone_number=self.phone_number(),
+                password=password,
+            )
+            for i, user_type in enumerate(user_types)
+        ]
+        CustomUser.objects.bulk_create(users, batch_size=self.batch_size)
+        return list(CustomUser.objects.filter(username__startswith=f"{prefix}_{run}_"))
+
+    def create_payments(self, users, count, progress=None):
+        """Insert `count` payments initiated by `users` (and their receipts); returns the count"""
+        weights = [1 / (rank + 1) ** self.skew for rank in range(len(users))]
+        created = 0
+        while created < count:
+            size = min(self.batch_size, count - created)
+            initiators = self.random.choices(users, weights=weights, k=size)
+            payments = [self.payment(user) for user in initiators]
+            with transaction.atomic():
+                self.insert_payments(payments)
+                self.insert_receipts(payments, {user.pk: user for user in users})
+            created += size
+            if progress:
+                progress(created)
+        return created
+
+    def finish(self):
+        """Bring the rollups, stats counters and analytics caches in line with the new rows"""
+        PaymentDailyRollup.rebuild()
+        PaymentAnalytics.refresh_stats_counters()
+        today = timezone.localdate()
+        for offset in range(self.days + 1):
+            CachedPaymentAnalytics.bump_version(today - timedelta(days=offset))
+        if connection.vendor == 'postgresql':
+            with connection.cursor() as cursor:
+                for model in (CustomUser, Payment, Receipt):
+                    cursor.execute(f'ANALYZE {model._meta.db_table}')
+
+    def phone_number(self):
+        return f"2547{self.random.randint(10000000, 99999999)}"
+
+    def payment(self, user):
+        reference = str(uuid.uuid4())
+        status = self.random.choices(self.statuses, weights=self.status_weights)[0]
+        is_mpesa = self.random.random() < self.mpesa_share
+        created_at = self.now - timedelta(seconds=self.random.uniform(0, self.days * 86400))
+        # Amounts are log-uniform: many small payments, a long tail of large ones
+        amount = Decimal(round(10 ** self.random.uniform(1, 5), 2)).quantize(Decimal('0.01'))
+
+        if is_mpesa:
+            checkout_id = f"ws_CO_{created_at:%d%m%Y%H%M%S}{self.random.randint(100000, 999999)}"
+            response_data = {
+                'MerchantRequestID': f"{self.random.randint(10000, 99999)}-{self.random.randint(1000000, 9999999)}-1",
+                'CheckoutRequestID': checkout_id,
+                'ResponseCode': '0',
+                'ResponseDescription': 'Success. Request accepted for processing',
+                'CustomerMessage': 'Success. Request accepted for processing',
+            }
+        else:
+            response_data = {
+                'status': True,
+                'message': 'Authorization URL created',
+                'data': {'reference': reference, 'access_code': uuid.uuid4().hex[:15]},
+            }
+        return Payment(
+            reference_id=reference,
+            phone_number=self.phone_number(),
+            amount=amount,
+            description=self.random.choice(('Goods', 'Services', 'Deposit', None)),
+            status=status,
+            payment_method='mpesa' if is_mpesa else 'paystack',
+            initiated_by_id=user.pk,
+            mpesa_transaction_id=checkout_id if is_mpesa else None,
+            paystack_reference=None if is_mpesa else reference,
+            response_data=response_data,
+            created_at=created_at,
+            updated_at=created_at + timedelta(seconds=self.random.uniform(1, 120)),
+        )
+
+    def insert_payments(self, payments):
+        fields = [
+            'reference_id', 'phone_number', 'amount', 'description', 'status', 'payment_method',
+            'initiated_by_id', 'mpesa_transaction_id', 'paystack_reference', 'response_data',
+            'created_at', 'updated_at',
+        ]
+        self.bulk_insert(Payment, payments, fields, 'reference_id', ['created_at', 'updated_at'])
+
+    def insert_receipts(self, payments, users):
+        receipts = []
+        for payment in payments:
+            if payment.status != 'success':
+                continue
+            user = users[payment.initiated_by_id]
+            serial = f"SER_{payment.created_at:%Y%m%d}_{uuid.uuid4().hex[:12].upper()}"
+            receipts.append(Receipt(
+                payment_id=payment.pk,
+                receipt_number=f"RCP_{payment.created_at:%Y%m%d}_{uuid.uuid4().hex[:12].upper()}",
+                serial_number=serial,
+                staff_member_id=user.pk,
+                generated_at=payment.updated_at,
+                receipt_data={
+                    'transaction_time': payment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
+                    'masked_phone_number': ReceiptGenerator.mask_phone_number(payment.phone_number),
+                    'amount': f"{payment.amount:,.2f}",
+                    'description': payment.description or 'Payment',
+                    'reference_id': payment.reference_id,
+                    'initiated_by': f"{user.first_name} {user.last_name}",
+                    'payment_method': payment.get_payment_method_display(),
+                    'status': payment.get_status_display(),
+                    'serial_number': serial,
+                },
+            ))
+        fields = ['payment_id', 'receipt_number', 'serial_number', 'staff_member_id', 'receipt_data', 'generated_at']
+        self.bulk_insert(Receipt, receipts, fields, 'payment_id', ['generated_at'])
+
+    def bulk_insert(self, model, objects, fields, key_field, timestamp_fields):
+        """Insert objects with their generated timestamps and set their primary keys"""
+        if connection.vendor == 'postgresql':
+            self.copy(model, fields, [[getattr(obj, field) for field in fields] for obj in objects])
+        else:
+            # bulk_create stamps auto_now(_add) fields; the generated times are put back below
+            timestamps = [[getattr(obj, field) for field in timestamp_fields] for obj in objects]
+            model.objects.bulk_create(objects, batch_size=1000)
+
+        # COPY (and bulk_create on some backends) does not return ids; look them up by a unique column
+        keys = {getattr(obj, key_field): obj for obj in objects}
+        for key, pk in model.objects.filter(**{f'{key_field}__in': list(keys)}).values_list(key_field, 'id'):
+            keys[key].pk = pk
+
+        if connection.vendor != 'postgresql':
+            for obj, values in zip(objects, timestamps):
+                for field, value in zip(timestamp_fields, values):
+                    setattr(obj, field, value)
+            model.objects.bulk_update(objects, timestamp_fields, batch_size=1000)
+
+    @staticmethod
+    def copy(model, fields, rows):
+        """Stream rows into the model's table with COPY ... FROM STDIN (CSV)"""
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        for row in rows:
+            writer.writerow([
+                json.dumps(value) if isinstance(value, (dict, list)) else ('' if value is None else value)
+                for value in row
+            ])
+        columns = ', '.join(model._meta.get_field(field).column for field in fields)
+        sql = f"COPY {model._meta.db_table} ({columns}) FROM STDIN WITH (FORMAT csv)"
+
+        with connection.cursor() as cursor:
+            raw = cursor.cursor
+            if hasattr(raw, 'copy_expert'):  # psycopg2
+                buffer.seek(0)
+                raw.copy_expert(sql, buffer)
+            else:  # psycopg 3
+                with raw.copy(sql) as copy:
+                    copy.write(buffer.getvalue())
@@ -0,0 +1,69 @@
+import csv
+import json
+from django.conf import settings
+from django.core.serializers.json import DjangoJSONEncoder
+from django.db import connection, transaction
+
+EXPORT_COLUMNS = (
+    'reference_id', 'created_at', 'updated_at', 'status', 'payment_method', 'amount',
+    'phone_number', 'description', 'mpesa_transaction_id', 'paystack_reference',
+    'initiated_by__username',
+)
+EXPORT_HEADERS = tuple(column.replace('__username', '') for column in EXPORT_COLUMNS)
+
+
+class _Echo:
+    """File-like object whose write() returns the line csv.writer produced"""
+
+    def write(self, value):
+        return value
+
+
+_csv_writer = csv.writer(_Echo())
+
+
+class PaymentExporter:
+    CONTENT_TYPES = {
+        'csv': 'text/csv',
+        'ndjson': 'application/x-ndjson',
+    }
+
+    @staticmethod
+    def iter_export(payments, export_format='csv'):
+        """Yield the export in chunks from one consistent snapshot.
+
+        Rows come from a server-side cursor (.iterator) and are formatted as
+        they arrive, so memory use does not depend on how many payments match.
+        On Postgres the whole export runs in a REPEATABLE READ transaction,
+        so rows committed mid-export cannot skew the totals.
+        """
+        chunk_size = settings.PAYMENT_EXPORT_CHUNK_SIZE
+        format_row = PaymentExporter._csv_row if export_format == 'csv' else PaymentExporter._ndjson_row
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                with connection.cursor() as cursor:
+                    cursor.execute('SET TRANSACTION ISOLATION LEVEL REPEATABLE READ READ ONLY')
+
+            if export_format == 'csv':
+                yield PaymentExporter._csv_row(EXPORT_HEADERS)
+
+            rows = payments.values_list(*EXPORT_COLUMNS).iterator(chunk_size=chunk_size)
+            buffer = []
+            for row in rows:
+                buffer.append(format_row(row))
+                if len(buffer) >= chunk_size:
+                    yield ''.join(buffer)
+                    buffer = []
+            if buffer:
+                yield ''.join(buffer)
+
+    @staticmethod
+    def _csv_row(row):
+        return _csv_writer.writerow([
+            value.isoformat() if hasattr(value, 'isoformat') else value for value in row
+        ])
+
+    @staticmethod
+    def _ndjson_row(row):
+        return json.dumps(dict(zip(EXPORT_HEADERS, row)), cls=DjangoJSONEncoder) + '\n'
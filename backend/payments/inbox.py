@@ -0,0 +1,152 @@
+import json
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+from .models import CallbackInbox, Payment, ProcessedEvent
+from .services import PaymentProcessor
+
+
+class CallbackInboxDrainer:
+    """Applies inboxed M-Pesa and Paystack callbacks to payments in batches.
+
+    A batch costs two payment lookups, one bulk_update, one receipt INSERT and
+    one inbox UPDATE, plus the dedupe ledger insert per event, however many
+    callbacks it holds. Payments are settled by the same rules as
+    PaymentProcessor.apply_result, including its trace span. If applying the batch fails, its callbacks are applied
+    one at a time so only the failing one is retried. Callbacks for a payment
+    that is not known yet are retried with a delay, and failing ones are given
+    up on, after PAYMENT_INBOX_MAX_ATTEMPTS.
+    """
+
+    @staticmethod
+    def parse(entry):
+        """Return (lookup field, lookup value, event key, new status, payload) or None to ignore"""
+        payload = json.loads(entry.body)
+
+        if entry.provider == 'mpesa':
+            stk_callback = payload.get('Body', {}).get('stkCallback', {})
+            checkout_request_id = stk_callback.get('CheckoutRequestID')
+            result_code = stk_callback.get('ResultCode')
+            if not checkout_request_id:
+                return None
+            return (
+                'mpesa_transaction_id', checkout_request_id, f"{checkout_request_id}:{result_code}",
+                PaymentProcessor.mpesa_result_status(result_code), payload,
+            )
+
+        event = payload.get('event')
+        if event not in ('charge.success', 'charge.failed'):
+            return None
+        reference = payload['data']['reference']
+        return (
+            'paystack_reference', reference, f"{reference}:{event}",
+            'success' if event == 'charge.success' else 'failed', payload,
+        )
+
+    @staticmethod
+    def drain_batch(batch_size=None):
+        """Claim and apply one batch; returns the number of callbacks claimed"""
+        batch_size = batch_size or settings.PAYMENT_INBOX_BATCH_SIZE
+        with transaction.atomic():
+            entries = CallbackInbox.claim(batch_size)
+            if entries:
+                CallbackInboxDrainer._apply(entries)
+        return len(entries)
+
+    @staticmethod
+    def _apply(entries):
+        now = timezone.now()
+        parsed = {}
+        for entry in entries:
+            entry.attempts += 1
+            try:
+                parsed[entry.pk] = CallbackInboxDrainer.parse(entry)
+            except Exception as e:
+                # Malformed bodies (not JSON, or not the provider's shape) never become valid
+                entry.processed_at, entry.error = now, f"Unreadable callback: {e}"
+                continue
+            if parsed[entry.pk] is None:
+                entry.processed_at = now
+
+        # One locking lookup per provider column for the whole batch
+        wanted = {'mpesa_transaction_id': set(), 'paystack_reference': set()}
+        for event in filter(None, parsed.values()):
+            wanted[event[0]].add(event[1])
+        payments = {}
+        for field, values in wanted.items():
+            if values:
+                locked = Payment.objects.select_for_update().select_related('initiated_by').filter(
+                    **{f'{field}__in': values}
+                ).order_by('pk')
+                for payment in locked:
+                    # Duplicates are possible (failed pushes store error text); like the views, take the first
+                    payments.setdefault((field, getattr(payment, field)), payment)
+
+        pending = []
+        for entry in entries:
+            event = parsed.get(entry.pk)
+            if entry.processed_at or event is None:
+                continue
+            payment = payments.get(event[:2])
+            if payment is None:
+                CallbackInboxDrainer._retry_later(entry, 'Payment not found', now)
+                continue
+            pending.append((entry, event, payment))
+
+        try:
+            with transaction.atomic():
+                CallbackInboxDrainer._settle(pending, now)
+        except Exception:
+            # Apply one by one, on freshly locked rows, so one bad callback cannot fail the others
+            for entry, event, _ in pending:
+                field, value = event[:2]
+                try:
+                    with transaction.atomic():
+                        payment = Payment.objects.select_for_update().select_related('initiated_by').filter(
+                            **{field: value}
+                        ).order_by('pk').first()
+                        if payment is None:
+                            raise Payment.DoesNotExist('Payment not found')
+                        CallbackInboxDrainer._settle([(entry, event, payment)], now)
+                except Exception as e:
+                    CallbackInboxDrainer._retry_later(entry, str(e), now)
+                    continue
+                entry.processed_at, entry.error = now, None
+        else:
+            for entry, _, _ in pending:
+                entry.processed_at = now
+
+        CallbackInbox.objects.bulk_update(entries, ['attempts', 'available_at', 'processed_at', 'error'])
+
+    @staticmethod
+    def _settle(items, now):
+        """Record and apply (entry, event, locked payment) items; raises without side effects kept"""
+        from receipts.services import ReceiptGenerator
+
+        changed = {}
+        for entry, (_, _, event_key, new_status, payload), payment in items:
+            if not ProcessedEvent.record(entry.provider, event_key):
+                continue  # a retry of an event that was already applied
+            with PaymentProcessor.settlement_span(payment, new_status) as span:
+                # Same rule as apply_result: settled meanwhile, e.g. by the reconciler or an earlier event
+                if payment.status in Payment.FINAL_STATUSES:
+                    if span is not None:
+                        span.set_attribute('settlement.skipped', payment.status)
+                    continue
+                payment.status = new_status
+                payment.response_data = payload
+                payment.updated_at = now
+                changed[payment.pk] = payment
+
+        if changed:
+            Payment.bulk_update_with_signals(list(changed.values()), ['status', 'response_data', 'updated_at'])
+            ReceiptGenerator.generate_receipts([p for p in changed.values() if p.status == 'success'])
+
+    @staticmethod
+    def _retry_later(entry, error, now):
+        entry.error = error
+        if entry.attempts >= settings.PAYMENT_INBOX_MAX_ATTEMPTS:
+            entry.processed_at = now
+        else:
+            entry.available_at = now + timedelta(seconds=settings.PAYMENT_INBOX_RETRY_DELAY)
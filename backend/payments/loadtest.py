@@ -0,0 +1,164 @@
+import random
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+import requests
+from requests.adapters import HTTPAdapter
+from .benchmarks import percentile
+
+FINAL_STATUSES = {'success', 'failed', 'cancelled', 'timeout'}
+
+
+def latency_summary(seconds):
+    values = sorted(value * 1000 for value in seconds)
+    if not values:
+        return None
+    return {
+        'n': len(values),
+        'p50_ms': round(percentile(values, 0.50), 1),
+        'p95_ms': round(percentile(values, 0.95), 1),
+        'p99_ms': round(percentile(values, 0.99), 1),
+        'max_ms': round(values[-1], 1),
+    }
+
+
+class PaymentLoadDriver:
+    """
+    Drives payments/initiate/ on a running portal that points at the provider
+    simulator, and measures what a customer would see.
+
+    Initiations are sent open-loop at `rate` per second for `duration`
+    seconds, with at most `concurrency` in flight. A poller follows each
+    accepted payment through payments/status/ like the frontend does, until it
+    reaches a final status; every `poll_interval` it checks all unsettled
+    payments, `poll_concurrency` at a time. The settlement latency runs from
+    the moment the simulator sent the first callback that was delivered to the
+    first poll showing the final status, so it overstates the true latency by
+    up to `poll_interval` plus one polling round (about one status request
+    while fewer than `poll_concurrency` payments are unsettled).
+    """
+
+    def __init__(self, portal_url, token, simulator_url, rate=10.0, duration=60.0, concurrency=50,
+                 paystack_share=0.0, poll_interval=0.1, poll_concurrency=20, settle_timeout=120.0, seed=None):
+        self.portal_url = portal_url.rstrip('/')
+        self.simulator_url = simulator_url.rstrip('/')
+        self.rate = rate
+        self.duration = duration
+        self.concurrency = concurrency
+        self.paystack_share = paystack_share
+        self.poll_interval = poll_interval
+        self.poll_concurrency = poll_concurrency
+        self.settle_timeout = settle_timeout
+        self.random = random.Random(seed)
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=2, pool_maxsize=concurrency + poll_concurrency + 1)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.session.headers['Authorization'] = f'Token {token}'
+        self.lock = threading.Lock()
+        self.initiations = []  # (seconds, HTTP status)
+        self.pending = {}  # reference_id -> provider id (CheckoutRequestID / Paystack reference)
+        self.visible = {}  # reference_id -> (provider id, final status, epoch seconds first seen)
+        self.loading = True
+
+    def run(self):
+        poller = threading.Thread(target=self.poll, daemon=True)
+        poller.start()
+        started = time.monotonic()
+        with ThreadPoolExecutor(max_workers=self.concurrency) as executor:
+            sent = 0
+            while time.monotonic() - started < self.duration:
+                # Open loop: keep to the schedule even when responses are slow
+                due = started + sent / self.rate
+                time.sleep(max(0.0, due - time.monotonic()))
+                executor.submit(self.initiate)
+                sent += 1
+        load_seconds = time.monotonic() - started
+        self.loading = False
+        poller.join()
+        return self.report(load_seconds)
+
+    def initiate(self):
+        method = 'paystack' if self.random.random() < self.paystack_share else 'mpesa'
+        data = {
+            'phone_number': f"2547{self.random.randint(10000000, 99999999)}",
+            'amount': str(Decimal(self.random.randint(10, 5000))),
+            'payment_method': method,
+            'description': 'Load test',
+        }
+        started = time.perf_counter()
+        try:
+            response = self.session.post(f'{self.portal_url}/api/payments/initiate/', json=data, timeout=60)
+            status_code = response.status_code
+        except requests.RequestException:
+            response, status_code = None, 0
+        elapsed = time.perf_counter() - started
+
+        with self.lock:
+            self.initiations.append((elapsed, status_code))
+            if status_code in (201, 202):
+                payment = response.json()
+                if payment['status'] in FINAL_STATUSES:
+                    return
+                provider_id = payment.get('mpesa_transaction_id') or payment.get('paystack_reference')
+                self.pending[payment['reference_id']] = provider_id
+
+    def poll(self):
+        deadline = None
+        with ThreadPoolExecutor(max_workers=self.poll_concurrency) as executor:
+            while True:
+                with self.lock:
+                    pending = list(self.pending)
+                if not self.loading:
+                    deadline = deadline or time.monotonic() + self.settle_timeout
+                    if not pending or time.monotonic() > deadline:
+                        return
+                # Checked in parallel, so a round does not grow with the number outstanding
+                list(executor.map(self.check_status, pending))
+                time.sleep(self.poll_interval)
+
+    def check_status(self, reference):
+        try:
+            payment = self.session.get(f'{self.portal_url}/api/payments/status/{reference}/', timeout=30).json()
+        except (requests.RequestException, ValueError):
+            return
+        if payment.get('status') in FINAL_STATUSES:
+            seen = time.time()
+            with self.lock:
+                provider_id = self.pending.pop(reference)
+                # Async initiation only learns the CheckoutRequestID in the worker
+                provider_id = provider_id or payment.get('mpesa_transaction_id')
+                self.visible[reference] = (provider_id, payment['status'], seen)
+
+    def report(self, load_seconds):
+        try:
+            deliveries = self.session.get(f'{self.simulator_url}/simulator/deliveries', timeout=30).json()
+        except (requests.RequestException, ValueError):
+            deliveries = {'deliveries': {}}
+
+        accepted = [seconds for seconds, status in self.initiations if status in (201, 202)]
+        outcomes = {}
+        for _, status in self.initiations:
+            outcomes[str(status)] = outcomes.get(str(status), 0) + 1
+        settle_latencies = [
+            seen - deliveries['deliveries'][provider_id]
+            for provider_id, _, seen in self.visible.values()
+            if provider_id in deliveries['deliveries']
+        ]
+        statuses = {}
+        for _, status, _ in self.visible.values():
+            statuses[status] = statuses.get(status, 0) + 1
+        return {
+            'load_seconds': round(load_seconds, 1),
+            'target_rate': self.rate,
+            'initiations': len(self.initiations),
+            'accepted_per_second': round(len(accepted) / load_seconds, 2) if load_seconds else 0,
+            'http_status': outcomes,
+            'initiation_latency': latency_summary(seconds for seconds, _ in self.initiations),
+            'settled': statuses,
+            'unsettled': len(self.pending),
+            'callback_to_visible': latency_summary(settle_latencies),
+            'callbacks_sent': deliveries.get('sent'),
+            'callbacks_failed': deliveries.get('failed'),
+        }
@@ -0,0 +1,107 @@
+import json
+import os
+import subprocess
+from datetime import datetime, timezone
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from accounts.models import CustomUser
+from payments.benchmarks import EndpointBenchmark
+from payments.datagen import SyntheticDataGenerator
+from payments.models import Payment
+
+
+class Command(BaseCommand):
+    help = (
+        "Benchmark the payment list, analytics and callback paths (p50/p95/p99 latency "
+        "and query counts), optionally growing the data set through several scales, and "
+        "save the results as JSON for comparison between commits. Use a scratch database."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--scales', type=lambda value: [int(n) for n in value.split(',')],
+                            help='Comma-separated payment counts, e.g. 10000,100000,1000000; '
+                                 'synthetic payments are added to reach each one before measuring')
+        parser.add_argument('--iterations', type=int, default=50)
+        parser.add_argument('--warmup', type=int, default=5)
+        parser.add_argument('--only', nargs='*', help='Run only these cases')
+        parser.add_argument('--users', type=int, default=200,
+                            help='Users to create when a scale needs generated payments')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output-dir', default=os.path.join(settings.BASE_DIR, 'benchmarks'))
+        parser.add_argument('--label', help='Name of the results file; defaults to the current commit')
+        parser.add_argument('--compare', help='Earlier results file to compare against')
+
+    def handle(self, *args, **options):
+        baseline = self.load(options['compare']) if options['compare'] else None
+        report = {
+            'label': options['label'] or self.commit(),
+            'created_at': datetime.now(timezone.utc).isoformat(timespec='seconds'),
+            'database': connection.vendor,
+            'iterations': options['iterations'],
+            'scales': {},
+        }
+
+        generator = users = None
+        for scale in options['scales'] or [None]:
+            current = Payment.objects.count()
+            if scale is not None and current < scale:
+                generator = generator or SyntheticDataGenerator(seed=options['seed'])
+                users = users or generator.create_users(options['users']) or list(CustomUser.objects.all())
+                self.stdout.write(f"generating {scale - current} payments to reach {scale}...")
+                generator.create_payments(users, scale - current)
+                generator.finish()
+                current = scale
+
+            self.stdout.write(self.style.MIGRATE_HEADING(f"{current} payments"))
+            benchmark = EndpointBenchmark(iterations=options['iterations'], warmup=options['warmup'])
+            results = benchmark.run(options['only'], progress=self.print_result)
+            report['scales'][str(current)] = results
+            if baseline:
+                self.print_comparison(results, baseline['scales'].get(str(current)))
+
+        os.makedirs(options['output_dir'], exist_ok=True)
+        path = os.path.join(options['output_dir'], f"{report['label']}.json")
+        with open(path, 'w') as results_file:
+            json.dump(report, results_file, indent=2)
+        self.stdout.write(self.style.SUCCESS(f"Results written to {path}"))
+
+    def print_result(self, name, result):
+        self.stdout.write(
+            f"  {name:<30} p50={result['p50_ms']:>9.2f}ms p95={result['p95_ms']:>9.2f}ms "
+            f"p99={result['p99_ms']:>9.2f}ms queries={result['queries']}"
+        )
+
+    def print_comparison(self, results, baseline):
+        if not baseline:
+            self.stdout.write("  (no baseline results at this scale)")
+            return
+        self.stdout.write("  p95 vs baseline:")
+        for name, result in results.items():
+            before = baseline.get(name)
+            if not before:
+                continue
+            change = (result['p95_ms'] - before['p95_ms']) / before['p95_ms'] * 100 if before['p95_ms'] else 0
+            queries = result['queries'] - before['queries']
+            self.stdout.write(
+                f"  {name:<30} {before['p95_ms']:>9.2f}ms -> {result['p95_ms']:>9.2f}ms ({change:+.1f}%)"
+                + (f", queries {queries:+d}" if queries else '')
+            )
+
+    @staticmethod
+    def load(path):
+        try:
+            with open(path) as results_file:
+                return json.load(results_file)
+        except (OSError, ValueError) as e:
+            raise CommandError(f"Cannot read {path}: {e}")
+
+    @staticmethod
+    def commit():
+        try:
+            return subprocess.run(
+                ['git', 'rev-parse', '--short', 'HEAD'], cwd=settings.BASE_DIR,
+                capture_output=True, text=True, check=True,
+            ).stdout.strip()
+        except (OSError, subprocess.CalledProcessError):
+            return datetime.now().strftime('%Y%m%d%H%M%S')
@@ -0,0 +1,62 @@
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.inbox import CallbackInboxDrainer
+from payments.models import CallbackInbox
+
+
+class Command(BaseCommand):
+    help = "Apply M-Pesa callbacks and Paystack webhooks stored in the callback inbox"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENT_INBOX_BATCH_SIZE,
+                            help='Callbacks applied per transaction')
+        parser.add_argument('--poll-interval', type=float, default=settings.PAYMENT_INBOX_POLL_INTERVAL,
+                            help='Seconds to sleep when the inbox is empty')
+        parser.add_argument('--lag-interval', type=float, default=10.0,
+                            help='Seconds between lag reports')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the inbox is empty instead of polling')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        applied = 0
+        next_report = 0.0
+        while not self.stopping:
+            close_old_connections()
+            started = time.monotonic()
+            try:
+                claimed = CallbackInboxDrainer.drain_batch(options['batch_size'])
+            except Exception as e:
+                # e.g. the database went away; the claimed rows were rolled back and stay pending
+                self.stderr.write(f"Inbox batch failed: {e}")
+                time.sleep(options['poll_interval'])
+                continue
+            applied += claimed
+            if claimed:
+                elapsed = time.monotonic() - started
+                self.stdout.write(f"batch={claimed} took={elapsed * 1000:.0f}ms rate={claimed / elapsed:.0f}/s")
+
+            if time.monotonic() >= next_report:
+                self.report_lag()
+                next_report = time.monotonic() + options['lag_interval']
+
+            if not claimed:
+                if options['once']:
+                    break
+                time.sleep(options['poll_interval'])
+
+        self.report_lag()
+        self.stdout.write(self.style.SUCCESS(f"Callback inbox drained {applied} callbacks"))
+
+    def report_lag(self):
+        lag = CallbackInbox.lag()
+        self.stdout.write(f"inbox lag: pending={lag['pending']} oldest={lag['oldest_pending_seconds']:.1f}s")
+
+    def _stop(self, signum, frame):
+        self.stopping = True
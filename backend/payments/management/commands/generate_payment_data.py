@@ -0,0 +1,47 @@
+from django.core.management.base import BaseCommand, CommandError
+from accounts.models import CustomUser
+from payments.datagen import DEFAULT_STATUS_MIX, SyntheticDataGenerator, parse_mix
+
+
+class Command(BaseCommand):
+    help = (
+        "Bulk-generate synthetic users, payments and receipts for scale tests. "
+        "Meant for a scratch database: rows are inserted with COPY on PostgreSQL."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payments', type=int, default=100000)
+        parser.add_argument('--users', type=int, default=200,
+                            help='New users to create; with 0, payments go to existing users')
+        parser.add_argument('--status-mix', type=parse_mix,
+                            default=','.join(f'{status}={weight}' for status, weight in DEFAULT_STATUS_MIX.items()),
+                            help='Relative weight of each status, e.g. "success=70,failed=20,processing=10"')
+        parser.add_argument('--mpesa-share', type=float, default=0.8,
+                            help='Fraction of payments made through M-Pesa; the rest are Paystack')
+        parser.add_argument('--skew', type=float, default=1.2,
+                            help='Zipf exponent of payments per user (0 = evenly spread)')
+        parser.add_argument('--days', type=int, default=365, help='Spread payments over this many past days')
+        parser.add_argument('--batch-size', type=int, default=10000)
+        parser.add_argument('--seed', type=int, help='Random seed, for reproducible data sets')
+
+    def handle(self, *args, **options):
+        try:
+            generator = SyntheticDataGenerator(
+                status_mix=options['status_mix'], mpesa_share=options['mpesa_share'], skew=options['skew'],
+                days=options['days'], batch_size=options['batch_size'], seed=options['seed'],
+            )
+        except ValueError as e:
+            raise CommandError(e)
+
+        if options['users']:
+            users = generator.create_users(options['users'])
+            self.stdout.write(f"created {len(users)} users")
+        else:
+            users = list(CustomUser.objects.all())
+            if not users:
+                raise CommandError("No users to attach payments to; pass --users")
+
+        total = options['payments']
+        generator.create_payments(users, total, progress=lambda done: self.stdout.write(f"payments: {done}/{total}"))
+        generator.finish()
+        self.stdout.write(self.style.SUCCESS(f"Generated {total} payments for {len(users)} users"))
@@ -0,0 +1,48 @@
+import json
+from django.core.management.base import BaseCommand, CommandError
+from payments.loadtest import PaymentLoadDriver
+
+
+class Command(BaseCommand):
+    help = (
+        "Send payment initiations to a running portal at a fixed rate and report sustained "
+        "payments per second and callback-to-status-visible latency. The portal must be "
+        "wired to `manage.py run_provider_simulator`."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--portal-url', default='http://127.0.0.1:8000')
+        parser.add_argument('--simulator-url', default='http://127.0.0.1:8001')
+        parser.add_argument('--token', required=True, help='API token of the user initiating payments')
+        parser.add_argument('--rate', type=float, default=10.0, help='Initiations per second')
+        parser.add_argument('--duration', type=float, default=60.0, help='Seconds to keep sending')
+        parser.add_argument('--concurrency', type=int, default=50, help='Maximum initiations in flight')
+        parser.add_argument('--paystack-share', type=float, default=0.0,
+                            help='Fraction of payments made through Paystack')
+        parser.add_argument('--poll-interval', type=float, default=0.1,
+                            help='Seconds between status polls of unsettled payments')
+        parser.add_argument('--poll-concurrency', type=int, default=20,
+                            help='Status requests in flight while polling')
+        parser.add_argument('--settle-timeout', type=float, default=120.0,
+                            help='Seconds to wait for outstanding payments after the load stops')
+        parser.add_argument('--seed', type=int)
+        parser.add_argument('--output', help='Also write the report to this JSON file')
+
+    def handle(self, *args, **options):
+        if options['rate'] <= 0:
+            raise CommandError("--rate must be positive")
+        driver = PaymentLoadDriver(
+            portal_url=options['portal_url'], token=options['token'], simulator_url=options['simulator_url'],
+            rate=options['rate'], duration=options['duration'], concurrency=options['concurrency'],
+            paystack_share=options['paystack_share'], poll_interval=options['poll_interval'],
+            poll_concurrency=options['poll_concurrency'],
+            settle_timeout=options['settle_timeout'], seed=options['seed'],
+        )
+        self.stdout.write(f"Sending {options['rate']}/s for {options['duration']}s to {options['portal_url']}...")
+        report = driver.run()
+
+        self.stdout.write(json.dumps(report, indent=2))
+        if options['output']:
+            with open(options['output'], 'w') as report_file:
+                json.dump(report, report_file, indent=2)
+            self.stdout.write(self.style.SUCCESS(f"Report written to {options['output']}"))
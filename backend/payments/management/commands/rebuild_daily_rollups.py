@@ -0,0 +1,17 @@
+from datetime import date
+from django.core.management.base import BaseCommand
+from payments.models import PaymentDailyRollup
+
+
+class Command(BaseCommand):
+    help = "Recompute PaymentDailyRollup rows from the payments table for a date range"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--start-date', type=date.fromisoformat,
+                            help='First day to rebuild (YYYY-MM-DD); defaults to the beginning')
+        parser.add_argument('--end-date', type=date.fromisoformat,
+                            help='Last day to rebuild (YYYY-MM-DD); defaults to the end')
+
+    def handle(self, *args, **options):
+        buckets = PaymentDailyRollup.rebuild(options['start_date'], options['end_date'])
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt {buckets} rollup buckets"))
@@ -0,0 +1,60 @@
+import signal
+import time
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from payments.models import ProcessedEvent
+from payments.reconciliation import PaymentReconciler
+
+
+class Command(BaseCommand):
+    help = (
+        "Settle payments stuck in `processing` by querying Daraja / Paystack, "
+        "and expire those older than the TTL to `timeout`"
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--min-age', type=int, default=settings.PAYMENT_RECONCILE_MIN_AGE,
+                            help='Seconds to leave a payment for its callback before querying the provider')
+        parser.add_argument('--ttl', type=int, default=settings.PAYMENT_RECONCILE_TTL,
+                            help='Seconds after which an unsettled payment is marked timeout')
+        parser.add_argument('--batch-size', type=int, default=settings.PAYMENT_RECONCILE_BATCH_SIZE,
+                            help='Payments loaded from the database at a time')
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENT_RECONCILE_CONCURRENCY,
+                            help='Maximum number of provider queries in flight')
+        parser.add_argument('--rate', type=float, default=settings.PAYMENT_RECONCILE_RATE,
+                            help='Maximum provider queries per second (0 for unlimited)')
+        parser.add_argument('--interval', type=float, default=settings.PAYMENT_RECONCILE_INTERVAL,
+                            help='Seconds between passes')
+        parser.add_argument('--once', action='store_true',
+                            help='Run a single pass, e.g. from cron')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        while not self.stopping:
+            close_old_connections()
+            outcome = PaymentReconciler.sweep(
+                min_age=options['min_age'],
+                ttl=options['ttl'],
+                batch_size=options['batch_size'],
+                concurrency=options['concurrency'],
+                rate=options['rate'],
+            )
+            outcome['pruned_events'] = ProcessedEvent.prune(settings.PAYMENT_EVENT_RETENTION_DAYS)
+            self.stdout.write(' '.join(f"{key}={value}" for key, value in sorted(outcome.items())))
+
+            if options['once'] or self._sleep(options['interval']):
+                break
+
+    def _sleep(self, seconds):
+        """Sleep unless asked to stop; returns True when stopping"""
+        deadline = time.monotonic() + seconds
+        while not self.stopping and time.monotonic() < deadline:
+            time.sleep(min(1.0, deadline - time.monotonic()))
+        return self.stopping
+
+    def _stop(self, signum, frame):
+        self.stopping = True
@@ -0,0 +1,72 @@
+import signal
+import time
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections, connection
+from payments.models import PaymentJob
+from payments.services import PaymentProcessor
+
+
+def _run_job(job_id):
+    try:
+        return PaymentProcessor.run_job(job_id)
+    finally:
+        # Each pool thread holds its own DB connection
+        connection.close()
+
+
+class Command(BaseCommand):
+    help = "Drain the payment job queue, pushing queued payments to their provider"
+
+    def add_arguments(self, parser):
+        parser.add_argument('--concurrency', type=int, default=settings.PAYMENT_WORKER_CONCURRENCY,
+                            help='Maximum number of provider calls in flight')
+        parser.add_argument('--poll-interval', type=float, default=settings.PAYMENT_WORKER_POLL_INTERVAL,
+                            help='Seconds to sleep when the queue is empty')
+        parser.add_argument('--lease', type=int, default=settings.PAYMENT_WORKER_LEASE_SECONDS,
+                            help='Seconds after which a running job is considered abandoned')
+        parser.add_argument('--once', action='store_true',
+                            help='Exit once the queue is empty instead of polling')
+
+    def handle(self, *args, **options):
+        concurrency = options['concurrency']
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self._stop)
+        signal.signal(signal.SIGINT, self._stop)
+
+        self.stdout.write(f"Payment workers started (concurrency={concurrency})")
+        in_flight = set()
+        processed = 0
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            while not self.stopping:
+                close_old_connections()
+                free_slots = concurrency - len(in_flight)
+                job_ids = PaymentJob.claim(free_slots, options['lease']) if free_slots else []
+
+                for job_id in job_ids:
+                    in_flight.add(executor.submit(_run_job, job_id))
+
+                if in_flight:
+                    done, in_flight = wait(in_flight, timeout=options['poll_interval'],
+                                           return_when=FIRST_COMPLETED)
+                    for future in done:
+                        processed += 1
+                        try:
+                            job = future.result()
+                        except Exception as e:
+                            self.stderr.write(f"Payment job crashed: {e}")
+                            continue
+                        self.stdout.write(f"{job.payment.reference_id}: {job.payment.status}")
+                elif options['once']:
+                    break
+                else:
+                    time.sleep(options['poll_interval'])
+
+            wait(in_flight)
+
+        self.stdout.write(self.style.SUCCESS(f"Payment workers stopped after {processed} jobs"))
+
+    def _stop(self, signum, frame):
+        self.stopping = True
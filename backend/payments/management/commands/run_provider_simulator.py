@@ -0,0 +1,61 @@
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from payments.datagen import parse_mix
+from payments.simulator import DEFAULT_MPESA_RESULT_MIX, LatencyModel, ProviderSimulator
+
+
+class Command(BaseCommand):
+    help = (
+        "Serve a local Daraja / Paystack simulator that settles payments with callbacks and "
+        "signed webhooks, for load tests. Start the portal with MPESA_BASE_URL and "
+        "PAYSTACK_BASE_URL pointing at it (and relaxed PAYMENT_THROTTLE_RATES)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8001)
+        parser.add_argument('--portal-url', default='http://127.0.0.1:8000',
+                            help='Where callbacks and webhooks are sent')
+        parser.add_argument('--latency-ms', type=float, default=300, help='Median API response time')
+        parser.add_argument('--latency-p99-ms', type=float, default=2000)
+        parser.add_argument('--callback-delay-ms', type=float, default=5000,
+                            help='Median time until the customer completes the payment')
+        parser.add_argument('--callback-delay-p99-ms', type=float, default=20000)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Fraction of API calls that fail')
+        parser.add_argument('--duplicate-rate', type=float, default=0.0,
+                            help='Fraction of callbacks delivered twice')
+        parser.add_argument('--reorder-rate', type=float, default=0.0,
+                            help='Fraction of callbacks sent before the initiation response, then retried')
+        parser.add_argument('--result-mix',
+                            default=','.join(f'{code}={weight}' for code, weight in DEFAULT_MPESA_RESULT_MIX.items()),
+                            help='Relative weight of each STK ResultCode, e.g. "0=90,1032=10"')
+        parser.add_argument('--paystack-success-rate', type=float, default=0.9)
+        parser.add_argument('--workers', type=int, default=8, help='Threads delivering callbacks')
+        parser.add_argument('--seed', type=int)
+
+    def handle(self, *args, **options):
+        portal = options['portal_url'].rstrip('/')
+        simulator = ProviderSimulator(
+            callback_url=f'{portal}/api/payments/mpesa/callback/',
+            webhook_url=f'{portal}/api/payments/webhook/',
+            webhook_secret=settings.PAYSTACK_WEBHOOK_SECRET,
+            latency=LatencyModel(options['latency_ms'], options['latency_p99_ms']),
+            callback_delay=LatencyModel(options['callback_delay_ms'], options['callback_delay_p99_ms']),
+            error_rate=options['error_rate'],
+            duplicate_rate=options['duplicate_rate'],
+            reorder_rate=options['reorder_rate'],
+            result_mix={int(code): weight for code, weight in parse_mix(options['result_mix']).items()},
+            paystack_success_rate=options['paystack_success_rate'],
+            workers=options['workers'],
+            seed=options['seed'],
+        )
+        server = simulator.serve(options['host'], options['port'])
+        self.stdout.write(f"Provider simulator listening on http://{options['host']}:{options['port']}, "
+                          f"calling back {portal}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            simulator.dispatcher.stop()
@@ -0,0 +1,24 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:50
+
+from django.db import migrations, models
+from business_portal.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('payments', '0003_payment_lookup_indexes'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['-created_at', 'id'], name='payment_created_id_idx'),
+        ),
+        AddIndexConcurrently(
+            model_name='payment',
+            index=models.Index(fields=['initiated_by', '-created_at', 'id'], name='payment_initiator_created_idx'),
+        ),
+    ]
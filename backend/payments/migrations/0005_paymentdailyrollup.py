@@ -0,0 +1,42 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:52
+
+from django.db import migrations, models
+from django.db.models import Count, Sum
+from django.db.models.functions import TruncDate
+
+
+def populate_rollups(apps, schema_editor):
+    Payment = apps.get_model('payments', 'Payment')
+    PaymentDailyRollup = apps.get_model('payments', 'PaymentDailyRollup')
+    buckets = Payment.objects.annotate(date=TruncDate('created_at')).values(
+        'date', 'payment_method', 'status'
+    ).annotate(count=Count('id'), total_amount=Sum('amount')).order_by()
+    PaymentDailyRollup.objects.bulk_create(
+        [PaymentDailyRollup(**bucket) for bucket in buckets], batch_size=1000
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_payment_keyset_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PaymentDailyRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('date', models.DateField()),
+                ('payment_method', models.CharField(choices=[('mpesa', 'Mpesa'), ('paystack', 'Paystack'), ('qr', 'QR Code')], max_length=20)),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('initiated', 'Initiated'), ('processing', 'Processing'), ('success', 'Success'), ('failed', 'Failed'), ('cancelled', 'Cancelled'), ('timeout', 'Timeout')], max_length=20)),
+                ('count', models.IntegerField(default=0)),
+                ('total_amount', models.DecimalField(decimal_places=2, default=0, max_digits=14)),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='paymentdailyrollup',
+            constraint=models.UniqueConstraint(fields=('date', 'payment_method', 'status'), name='payment_rollup_bucket_uniq'),
+        ),
+        migrations.RunPython(populate_rollups, migrations.RunPython.noop),
+    ]
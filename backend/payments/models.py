@@ -1,6 +1,11 @@
-from django.db import models
+from datetime import timedelta
+from decimal import Decimal
+from django.db import IntegrityError, models, transaction
+from django.db.models import F, Q
 from django.contrib.auth import get_user_model
+from django.utils import timezone
 from accounts.models import CustomUser
+from .signals import payment_status_changed
 
 class Payment(models.Model):
     STATUS_CHOICES = (
@@ -13,6 +18,9 @@ class Payment(models.Model):
         ('timeout', 'Timeout'),
     )
     
+    # Statuses a payment never leaves
+    FINAL_STATUSES = ('success', 'failed', 'cancelled', 'timeout')
+
     PAYMENT_METHOD_CHOICES = (
         ('mpesa', 'Mpesa'),
         ('paystack', 'Paystack'),
@@ -31,12 +39,292 @@ class Payment(models.Model):
     response_data = models.JSONField(default=dict, blank=True)  # Store API responses
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            # Callback / webhook lookups. Not unique: failed initiations store
+            # the provider's error message in these columns.
+            models.Index(fields=['mpesa_transaction_id'], name='payment_mpesa_txn_idx',
+                         condition=Q(mpesa_transaction_id__isnull=False)),
+            models.Index(fields=['paystack_reference'], name='payment_paystack_ref_idx',
+                         condition=Q(paystack_reference__isnull=False)),
+            # get_total_collected
+            models.Index(fields=['initiated_by', 'status'], name='payment_initiator_status_idx'),
+            # Analytics and status-filtered listings
+            models.Index(fields=['status', 'created_at'], name='payment_status_created_idx'),
+            # Keyset pagination of PaymentListView (all payments / own payments)
+            models.Index(fields=['-created_at', 'id'], name='payment_created_id_idx'),
+            models.Index(fields=['initiated_by', '-created_at', 'id'], name='payment_initiator_created_idx'),
+        ]
     
     def __str__(self):
         return f"Payment {self.reference_id} - {self.amount} - {self.status}"
     
+    @classmethod
+    def from_db(cls, db, field_names, values):
+        instance = super().from_db(db, field_names, values)
+        instance._remember_loaded_state()
+        return instance
+
+    def _remember_loaded_state(self):
+        # Deferred fields are absent from __dict__; such instances never report transitions
+        self._loaded_state = (self.__dict__.get('status'), self.__dict__.get('amount'))
+
+    def _has_transition(self):
+        """Whether status or amount differ from what was loaded from the database"""
+        loaded = getattr(self, '_loaded_state', (None, None))
+        return None not in loaded and loaded != (self.status, self.amount)
+
     def save(self, *args, **kwargs):
         if not self.reference_id:
             import uuid
             self.reference_id = str(uuid.uuid4())
-        super().save(*args, **kwargs)
\ No newline at end of file
+
+        adding = self._state.adding
+        previous_status, previous_amount = (None, None) if adding else getattr(self, '_loaded_state', (None, None))
+        changed = adding or self._has_transition()
+
+        with transaction.atomic():
+            super().save(*args, **kwargs)
+            if changed:
+                # Receivers (e.g. the daily rollups) update inside this transaction
+                payment_status_changed.send(
+                    sender=Payment, payment=self,
+                    previous_status=previous_status, previous_amount=previous_amount,
+                )
+        self._remember_loaded_state()
+
+    @classmethod
+    def bulk_create_with_signals(cls, payments):
+        """bulk_create new payments while still reporting them to payment_status_changed receivers"""
+        import uuid
+        for payment in payments:
+            payment.reference_id = payment.reference_id or str(uuid.uuid4())
+
+        with transaction.atomic():
+            created = cls.objects.bulk_create(payments)
+            for payment in created:
+                payment._remember_loaded_state()
+                payment_status_changed.send(
+                    sender=cls, payment=payment, previous_status=None, previous_amount=None,
+                )
+        return created
+
+    @classmethod
+    def bulk_update_with_signals(cls, payments, fields):
+        """bulk_update loaded payments, reporting status/amount transitions like save() does"""
+        with transaction.atomic():
+            cls.objects.bulk_update(payments, fields)
+            for payment in payments:
+                if payment._has_transition():
+                    previous_status, previous_amount = payment._loaded_state
+                    payment_status_changed.send(
+                        sender=cls, payment=payment,
+                        previous_status=previous_status, previous_amount=previous_amount,
+                    )
+                payment._remember_loaded_state()
+
+class PaymentJob(models.Model):
+    """Durable queue entry for a payment whose provider call runs in a worker"""
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('done', 'Done'),
+        ('failed', 'Failed'),
+    )
+
+    payment = models.OneToOneField(Payment, on_delete=models.CASCADE, related_name='job')
+    status = models.CharField(max_length=20, choices=STATUS_CHOICES, default='queued')
+    attempts = models.PositiveIntegerField(default=0)
+    last_error = models.TextField(blank=True, null=True)
+    available_at = models.DateTimeField(default=timezone.now)
+    locked_at = models.DateTimeField(blank=True, null=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'available_at'], name='payjob_status_avail_idx'),
+        ]
+
+    def __str__(self):
+        return f"Job for {self.payment.reference_id} - {self.status}"
+
+    @classmethod
+    def claim(cls, limit, lease_seconds):
+        """Lock up to `limit` runnable jobs for this worker and return their ids.
+
+        Jobs left `running` by a worker that died are picked up again once their
+        lease has expired. SKIP LOCKED lets several workers drain the queue
+        without blocking on each other.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            job_ids = list(
+                cls.objects.select_for_update(skip_locked=True).filter(
+                    Q(status='queued', available_at__lte=now) |
+                    Q(status='running', locked_at__lt=now - timedelta(seconds=lease_seconds))
+                ).order_by('available_at').values_list('id', flat=True)[:limit]
+            )
+            cls.objects.filter(id__in=job_ids).update(
+                status='running', locked_at=now, attempts=F('attempts') + 1, updated_at=now
+            )
+        return job_ids
+
+
+class ProcessedEvent(models.Model):
+    """Ledger of provider callbacks already applied, so retries can be acknowledged cheaply"""
+    PROVIDER_CHOICES = (
+        ('mpesa', 'Mpesa'),
+        ('paystack', 'Paystack'),
+    )
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    event_key = models.CharField(max_length=200)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['provider', 'event_key'], name='processed_event_uniq'),
+        ]
+        indexes = [
+            models.Index(fields=['created_at'], name='processed_event_created_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} {self.event_key}"
+
+    @classmethod
+    def record(cls, provider, event_key):
+        """Insert the event unless it is already in the ledger; True if it is new.
+
+        A single INSERT ... ON CONFLICT DO NOTHING against the unique index, so a
+        duplicate costs one statement and never raises inside the caller's
+        transaction. Call it in the same transaction that applies the event:
+        if applying fails the ledger row rolls back and the retry is processed.
+        """
+        from django.db import connection
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {cls._meta.db_table} (provider, event_key, created_at) '
+                'VALUES (%s, %s, %s) ON CONFLICT (provider, event_key) DO NOTHING RETURNING id',
+                [provider, event_key, timezone.now()],
+            )
+            return cursor.fetchone() is not None
+
+    @classmethod
+    def prune(cls, older_than_days):
+        """Forget events older than any retry the providers would still send"""
+        cutoff = timezone.now() - timedelta(days=older_than_days)
+        return cls.objects.filter(created_at__lt=cutoff).delete()[0]
+
+
+class CallbackInbox(models.Model):
+    """Append-only inbox of raw provider callbacks, applied later by drain_callback_inbox"""
+    PROVIDER_CHOICES = ProcessedEvent.PROVIDER_CHOICES
+
+    provider = models.CharField(max_length=20, choices=PROVIDER_CHOICES)
+    body = models.TextField()
+    received_at = models.DateTimeField(default=timezone.now)
+    available_at = models.DateTimeField(default=timezone.now)
+    attempts = models.PositiveIntegerField(default=0)
+    processed_at = models.DateTimeField(blank=True, null=True)
+    error = models.TextField(blank=True, null=True)
+
+    class Meta:
+        verbose_name_plural = 'callback inbox'
+        indexes = [
+            # Only the unprocessed tail is ever scanned by the drain worker
+            models.Index(fields=['available_at', 'id'], name='callback_inbox_pending_idx',
+                         condition=Q(processed_at__isnull=True)),
+        ]
+
+    def __str__(self):
+        return f"{self.provider} callback {self.id} ({'processed' if self.processed_at else 'pending'})"
+
+    @classmethod
+    def claim(cls, limit):
+        """Lock the next `limit` unprocessed callbacks, oldest first; call inside a transaction"""
+        return list(
+            cls.objects.select_for_update(skip_locked=True)
+            .filter(processed_at__isnull=True, available_at__lte=timezone.now())
+            .order_by('available_at', 'id')[:limit]
+        )
+
+    @classmethod
+    def lag(cls):
+        """How far behind the drain worker is: pending callbacks and the age of the oldest"""
+        pending = cls.objects.filter(processed_at__isnull=True)
+        oldest = pending.order_by('received_at').values_list('received_at', flat=True).first()
+        return {
+            'pending': pending.count(),
+            'oldest_pending_seconds': (timezone.now() - oldest).total_seconds() if oldest else 0.0,
+        }
+
+
+class PaymentDailyRollup(models.Model):
+    """Per-day payment counts and amounts, maintained on every status transition"""
+    date = models.DateField()
+    payment_method = models.CharField(max_length=20, choices=Payment.PAYMENT_METHOD_CHOICES)
+    status = models.CharField(max_length=20, choices=Payment.STATUS_CHOICES)
+    count = models.IntegerField(default=0)
+    total_amount = models.DecimalField(max_digits=14, decimal_places=2, default=0)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['date', 'payment_method', 'status'], name='payment_rollup_bucket_uniq'),
+        ]
+
+    def __str__(self):
+        return f"{self.date} {self.payment_method} {self.status}: {self.count}"
+
+    @classmethod
+    def apply(cls, date, payment_method, status, count, amount):
+        """Add `count` payments worth `amount` to a bucket, creating it if needed"""
+        bucket = cls.objects.filter(date=date, payment_method=payment_method, status=status)
+        delta = {'count': F('count') + count, 'total_amount': F('total_amount') + amount}
+        if bucket.update(**delta):
+            return
+        try:
+            with transaction.atomic():
+                cls.objects.create(date=date, payment_method=payment_method, status=status,
+                                   count=count, total_amount=amount)
+        except IntegrityError:
+            # Another transaction created the bucket first
+            bucket.update(**delta)
+
+    @classmethod
+    def record_transition(cls, payment, previous_status, previous_amount):
+        """Move a payment from its previous bucket to its current one"""
+        date = timezone.localdate(payment.created_at)
+        if previous_status is not None:
+            cls.apply(date, payment.payment_method, previous_status, -1, -Decimal(previous_amount))
+        cls.apply(date, payment.payment_method, payment.status, 1, Decimal(payment.amount))
+
+    @classmethod
+    def rebuild(cls, start_date=None, end_date=None):
+        """Recompute the rollups for a date range (everything if unbounded) from payments"""
+        from django.db import connection
+        from django.db.models import Count, Sum
+        from django.db.models.functions import TruncDate
+
+        payments = Payment.objects.all()
+        rollups = cls.objects.all()
+        if start_date:
+            payments = payments.filter(created_at__date__gte=start_date)
+            rollups = rollups.filter(date__gte=start_date)
+        if end_date:
+            payments = payments.filter(created_at__date__lte=end_date)
+            rollups = rollups.filter(date__lte=end_date)
+
+        with transaction.atomic():
+            if connection.vendor == 'postgresql':
+                # Transitions committing during the rebuild wait here and apply
+                # their deltas on top of the rebuilt rows afterwards
+                with connection.cursor() as cursor:
+                    cursor.execute(f'LOCK TABLE {cls._meta.db_table} IN EXCLUSIVE MODE')
+            rollups.delete()
+            buckets = payments.annotate(date=TruncDate('created_at')).values(
+                'date', 'payment_method', 'status'
+            ).annotate(count=Count('id'), total_amount=Sum('amount')).order_by()
+            return len(cls.objects.bulk_create([cls(**bucket) for bucket in buckets], batch_size=1000))
@@ -0,0 +1,146 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Q
+from django.utils import timezone
+from .models import Payment
+from .services import MpesaService, PaystackService, PaymentProcessor
+
+
+class RateLimiter:
+    """Spaces calls at least 1/rate seconds apart across all threads"""
+
+    def __init__(self, rate):
+        self.interval = 1.0 / rate if rate else 0
+        self.lock = threading.Lock()
+        self.next_slot = time.monotonic()
+
+    def wait(self):
+        with self.lock:
+            now = time.monotonic()
+            slot = max(now, self.next_slot)
+            self.next_slot = slot + self.interval
+        if slot > now:
+            time.sleep(slot - now)
+
+
+class PaymentReconciler:
+    """Settles payments whose callback or webhook never arrived.
+
+    Stale `processing` payments are looked up through the (status, created_at)
+    index, checked against the provider with a bounded number of concurrent,
+    rate-limited status queries, and settled with the same mapping and receipt
+    generation as mpesa_callback / verify_payment. Payments nobody has settled
+    within the TTL are expired to `timeout`.
+    """
+
+    @staticmethod
+    def stale_payments(min_age, ttl, limit, after=None):
+        """Next `limit` open payments older than min_age but within the TTL, oldest first.
+
+        `after` is the (created_at, id) of the last payment of the previous batch.
+        """
+        now = timezone.now()
+        payments = Payment.objects.filter(
+            status='processing',
+            created_at__lte=now - timedelta(seconds=min_age),
+            created_at__gt=now - timedelta(seconds=ttl),
+        )
+        if after is not None:
+            created_at, pk = after
+            payments = payments.filter(Q(created_at__gt=created_at) | Q(created_at=created_at, id__gt=pk))
+        return list(
+            payments.order_by('created_at', 'id')
+            .only('id', 'status', 'amount', 'payment_method', 'mpesa_transaction_id', 'paystack_reference', 'created_at')
+            [:limit]
+        )
+
+    @staticmethod
+    def expire_payments(ttl):
+        """Move payments stuck in `processing` past the TTL to `timeout`"""
+        cutoff = timezone.now() - timedelta(seconds=ttl)
+        expired = 0
+        with transaction.atomic():
+            payments = Payment.objects.select_for_update(skip_locked=True).filter(
+                status='processing', created_at__lte=cutoff,
+            )
+            for payment in payments:
+                # save() rather than update() so the rollups and counters follow
+                payment.status = 'timeout'
+                payment.save(update_fields=['status', 'updated_at'])
+                expired += 1
+        return expired
+
+    @staticmethod
+    def query_provider(payment):
+        """Ask the provider about a payment; returns (status, response) or (None, response) if still open"""
+        if payment.payment_method == 'mpesa' and payment.mpesa_transaction_id:
+            result = MpesaService().query_transaction_status(payment.mpesa_transaction_id)
+            # Daraja answers with an errorCode while the customer has not responded yet
+            if 'ResultCode' not in result:
+                return None, result
+            return PaymentProcessor.mpesa_result_status(int(result['ResultCode'])), result
+
+        if payment.payment_method == 'paystack' and payment.paystack_reference:
+            result = PaystackService().verify_transaction(payment.paystack_reference)
+            if not result.get('status'):
+                return None, result
+            # Unlike verify_payment, leave transactions Paystack still reports as ongoing alone
+            return PaymentProcessor.paystack_result_status(result['data']['status'], default=None), result
+
+        return None, None
+
+    @staticmethod
+    def reconcile_payment(payment):
+        """Query the provider and settle the payment; returns the new status or None"""
+        new_status, result = PaymentReconciler.query_provider(payment)
+        if new_status is None:
+            return None
+
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=payment.pk)
+            # A callback may have settled the payment while we were asking
+            if payment.status != 'processing':
+                return None
+            PaymentProcessor.apply_result(payment, new_status, result)
+        return new_status
+
+    @staticmethod
+    def sweep(min_age=None, ttl=None, batch_size=None, concurrency=None, rate=None):
+        """Run one reconciliation pass and return counts per outcome"""
+        min_age = settings.PAYMENT_RECONCILE_MIN_AGE if min_age is None else min_age
+        ttl = settings.PAYMENT_RECONCILE_TTL if ttl is None else ttl
+        batch_size = batch_size or settings.PAYMENT_RECONCILE_BATCH_SIZE
+        concurrency = concurrency or settings.PAYMENT_RECONCILE_CONCURRENCY
+        rate = settings.PAYMENT_RECONCILE_RATE if rate is None else rate
+
+        outcome = {'expired': PaymentReconciler.expire_payments(ttl), 'checked': 0, 'errors': 0}
+        limiter = RateLimiter(rate)
+
+        def reconcile(payment):
+            limiter.wait()
+            try:
+                return PaymentReconciler.reconcile_payment(payment)
+            except Exception:
+                return 'error'
+            finally:
+                # Each pool thread holds its own DB connection
+                connection.close()
+
+        with ThreadPoolExecutor(max_workers=concurrency) as executor:
+            after = None
+            while True:
+                payments = PaymentReconciler.stale_payments(min_age, ttl, batch_size, after)
+                if not payments:
+                    break
+                for new_status in executor.map(reconcile, payments):
+                    outcome['checked'] += 1
+                    if new_status == 'error':
+                        outcome['errors'] += 1
+                    elif new_status:
+                        outcome[new_status] = outcome.get(new_status, 0) + 1
+                after = (payments[-1].created_at, payments[-1].pk)
+        return outcome
@@ -1,3 +1,5 @@
+from django.conf import settings
+from django.core.exceptions import ValidationError
 from rest_framework import serializers
 from .models import Payment
 from accounts.serializers import UserSerializer
@@ -24,3 +26,45 @@ class PaymentSerializer(serializers.ModelSerializer):
         user = self.context['request'].user
         validated_data['initiated_by'] = user
         return super().create(validated_data)
+
+
+class PaymentListSerializer(serializers.ModelSerializer):
+    """Columns shown in payment listings; provider payloads stay out of lists"""
+
+    class Meta:
+        model = Payment
+        fields = (
+            'id', 'reference_id', 'phone_number', 'amount', 'description',
+            'status', 'payment_method', 'created_at', 'updated_at',
+        )
+        read_only_fields = fields
+
+
+class BatchPaymentItemSerializer(serializers.Serializer):
+    phone_number = serializers.CharField(max_length=15)
+    amount = serializers.DecimalField(max_digits=10, decimal_places=2)
+    description = serializers.CharField(required=False, allow_blank=True, allow_null=True)
+
+
+class BatchPaymentInitiateSerializer(serializers.Serializer):
+    """Validates every item of a batch STK push before anything is created"""
+    items = BatchPaymentItemSerializer(many=True, allow_empty=False)
+
+    def validate_items(self, items):
+        from .services import PaymentProcessor
+
+        if len(items) > settings.PAYMENT_BATCH_MAX_ITEMS:
+            raise serializers.ValidationError(
+                f"A batch may contain at most {settings.PAYMENT_BATCH_MAX_ITEMS} items"
+            )
+
+        errors = {}
+        for index, item in enumerate(items):
+            try:
+                item['phone_number'] = PaymentProcessor.validate_phone_number(item['phone_number'])
+                item['amount'] = PaymentProcessor.validate_amount(item['amount'])
+            except ValidationError as e:
+                errors[index] = e.messages
+        if errors:
+            raise serializers.ValidationError(errors)
+        return items
@@ -1,13 +1,31 @@
-import requests
+import contextvars
 import json
+import logging
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager
 from django.conf import settings
+from django.db import connection, transaction
+from django.core.cache import cache
 from django.core.exceptions import ValidationError
-from .models import Payment
+from .models import Payment, PaymentJob
+from business_portal.logging_config import log_context
+from business_portal.tracing import current_span, recall_trace, remember_trace, start_span, traced
+from .clients import ProviderUnavailable, get_provider_client
 from decouple import config
 import hashlib
 import hmac
 import base64
-from datetime import datetime
+from datetime import datetime, timedelta
+from django.utils import timezone
+
+logger = logging.getLogger(__name__)
+
+# OAuth token shared by every worker through the cache
+MPESA_TOKEN_CACHE_KEY = 'mpesa:access_token'
+MPESA_TOKEN_LOCK_KEY = 'mpesa:access_token:lock'
+MPESA_TOKEN_LOCK_TIMEOUT = 10  # seconds a refresh may hold the lock
+MPESA_TOKEN_DEFAULT_TTL = 3599  # Daraja tokens live for an hour
 
 class MpesaService:
     def __init__(self):
@@ -17,33 +35,84 @@ class MpesaService:
         self.passkey = settings.MPESA_PASSKEY
         self.callback_url = settings.MPESA_CALLBACK_URL
         self.party_b = settings.MPESA_TILL_NUMBER
-        self.base_url = 'https://api.safaricom.co.ke'
+        self.base_url = settings.MPESA_BASE_URL.rstrip('/')
+        self.client = get_provider_client('mpesa')
     
-    def get_access_token(self):
-        """Get OAuth access token for Mpesa API"""
+    @traced()
+    def get_access_token(self, force_refresh=False):
+        """Get OAuth access token for Mpesa API, shared across workers through the cache"""
+        cached = None if force_refresh else cache.get(MPESA_TOKEN_CACHE_KEY)
+        now = time.time()
+
+        if cached and now < cached['expires_at'] - settings.MPESA_TOKEN_REFRESH_MARGIN:
+            return cached['access_token']
+
+        # Token is missing or about to expire: only one worker refreshes it
+        if cache.add(MPESA_TOKEN_LOCK_KEY, 1, timeout=MPESA_TOKEN_LOCK_TIMEOUT):
+            try:
+                return self._refresh_access_token()
+            finally:
+                cache.delete(MPESA_TOKEN_LOCK_KEY)
+
+        # Someone else is refreshing; a token that has not yet expired is still usable
+        if cached and now < cached['expires_at']:
+            return cached['access_token']
+
+        deadline = now + MPESA_TOKEN_LOCK_TIMEOUT
+        while time.time() < deadline:
+            time.sleep(0.05)
+            cached = cache.get(MPESA_TOKEN_CACHE_KEY)
+            if cached and time.time() < cached['expires_at']:
+                return cached['access_token']
+
+        return self._refresh_access_token()
+
+    def _refresh_access_token(self):
+        """Fetch a fresh token from Daraja and store it until just before it expires"""
         url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
         
-        response = requests.get(
+        response = self.client.get(
             url,
+            operation='get_access_token',
             auth=(self.consumer_key, self.consumer_secret)
         )
         
-        if response.status_code == 200:
-            return response.json()['access_token']
-        else:
+        if response.status_code != 200:
             raise Exception(f"Failed to get access token: {response.text}")
+
+        data = response.json()
+        expires_in = int(data.get('expires_in') or MPESA_TOKEN_DEFAULT_TTL)
+        cache.set(
+            MPESA_TOKEN_CACHE_KEY,
+            {'access_token': data['access_token'], 'expires_at': time.time() + expires_in},
+            timeout=expires_in,
+        )
+        return data['access_token']
+
+    def invalidate_access_token(self):
+        """Drop the cached token, e.g. after Daraja rejected it"""
+        cache.delete(MPESA_TOKEN_CACHE_KEY)
+
+    def _authorized_post(self, url, payload, operation, idempotent=False):
+        """POST with a bearer token, refreshing the token and retrying once on 401"""
+        for attempt in range(2):
+            headers = {
+                "Authorization": f"Bearer {self.get_access_token(force_refresh=attempt > 0)}",
+                "Content-Type": "application/json"
+            }
+            response = self.client.post(
+                url, operation=operation, idempotent=idempotent, headers=headers, json=payload
+            )
+            if response.status_code != 401:
+                break
+            self.invalidate_access_token()
+        return response.json()
     
+    @traced()
     def initiate_stk_push(self, phone_number, amount, account_reference, transaction_desc):
         """Initiate STK Push for payment"""
-        access_token = self.get_access_token()
-        
         url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
         # Generate password
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         password = f"{self.business_short_code}{self.passkey}{timestamp}"
@@ -63,20 +132,13 @@ class MpesaService:
             "TransactionDesc": transaction_desc
         }
         
-        response = requests.post(url, headers=headers, json=payload)
-        return response.json()
+        return self._authorized_post(url, payload, operation='initiate_stk_push')
 
+    @traced()
     def register_url(self):
         """Register callback URLs with Mpesa"""
-        access_token = self.get_access_token()
-        
         url = f"{self.base_url}/mpesa/c2b/v1/registerurl"
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
         payload = {
             "ValidationURL": f"{self.callback_url}/validation",
             "ConfirmationURL": f"{self.callback_url}/confirmation",
@@ -84,20 +146,13 @@ class MpesaService:
             "BusinessShortCode": self.business_short_code
         }
         
-        response = requests.post(url, headers=headers, json=payload)
-        return response.json()
+        return self._authorized_post(url, payload, operation='register_url', idempotent=True)
 
+    @traced()
     def query_transaction_status(self, checkout_request_id):
         """Query the status of an STK push transaction"""
-        access_token = self.get_access_token()
-        
         url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
         
-        headers = {
-            "Authorization": f"Bearer {access_token}",
-            "Content-Type": "application/json"
-        }
-        
         timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
         password = f"{self.business_short_code}{self.passkey}{timestamp}"
         encoded_password = base64.b64encode(password.encode()).decode()
@@ -109,16 +164,19 @@ class MpesaService:
             "CheckoutRequestID": checkout_request_id
         }
         
-        response = requests.post(url, headers=headers, json=payload)
-        return response.json()
+        return self._authorized_post(
+            url, payload, operation='query_transaction_status', idempotent=True
+        )
 
 class PaystackService:
     def __init__(self):
         self.secret_key = config('PAYSTACK_SECRET_KEY', default='')
         self.public_key = config('PAYSTACK_PUBLIC_KEY', default='')
-        self.base_url = 'https://api.paystack.co'
+        self.base_url = settings.PAYSTACK_BASE_URL.rstrip('/')
+        self.client = get_provider_client('paystack')
         self.frontend_url = config('FRONTEND_URL', default='http://localhost:3000')
     
+    @traced()
     def initialize_transaction(self, email, amount, phone_number, reference):
         """Initialize a Paystack transaction"""
         url = f"{self.base_url}/transaction/initialize"
@@ -149,9 +207,10 @@ class PaystackService:
             "channels": ["card", "bank", "ussd", "qr", "mobile_money", "bank_transfer"]
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = self.client.post(url, operation='initialize_transaction', headers=headers, json=payload)
         return response.json()
     
+    @traced()
     def verify_transaction(self, reference):
         """Verify a Paystack transaction"""
         url = f"{self.base_url}/transaction/verify/{reference}"
@@ -160,9 +219,10 @@ class PaystackService:
             "Authorization": f"Bearer {self.secret_key}",
         }
         
-        response = requests.get(url, headers=headers)
+        response = self.client.get(url, operation='verify_transaction', headers=headers)
         return response.json()
     
+    @traced()
     def charge_authorization(self, authorization_code, email, amount):
         """Charge a customer using their authorization code"""
         url = f"{self.base_url}/transaction/charge_authorization"
@@ -180,9 +240,10 @@ class PaystackService:
             "amount": amount_kobo
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = self.client.post(url, operation='charge_authorization', headers=headers, json=payload)
         return response.json()
     
+    @traced()
     def create_customer(self, email, first_name=None, last_name=None, phone=None):
         """Create a Paystack customer"""
         url = f"{self.base_url}/customer"
@@ -199,10 +260,77 @@ class PaystackService:
             "phone": phone
         }
         
-        response = requests.post(url, headers=headers, json=payload)
+        response = self.client.post(url, operation='create_customer', headers=headers, json=payload)
         return response.json()
 
 class PaymentProcessor:
+    # Daraja ResultCode -> payment status (any other code is a failure)
+    MPESA_RESULT_STATUSES = {
+        0: 'success',
+        1032: 'cancelled',
+        1037: 'timeout',
+    }
+    # Paystack transaction status -> payment status
+    PAYSTACK_STATUSES = {
+        'failed': 'failed',
+        'success': 'success',
+        'cancelled': 'cancelled',
+    }
+
+    @staticmethod
+    def mpesa_result_status(result_code):
+        return PaymentProcessor.MPESA_RESULT_STATUSES.get(result_code, 'failed')
+
+    @staticmethod
+    def paystack_result_status(paystack_status, default='failed'):
+        return PaymentProcessor.PAYSTACK_STATUSES.get(paystack_status, default)
+
+    @staticmethod
+    def settlement_trace_key(payment):
+        """Provider id that links an initiation to the callback or check that settles it"""
+        reference = payment.mpesa_transaction_id if payment.payment_method == 'mpesa' else payment.paystack_reference
+        return f"settlement:{payment.payment_method}:{reference}"
+
+    @staticmethod
+    @contextmanager
+    def settlement_span(payment, new_status):
+        """Span for settling a payment, inside the initiation's trace so one trace spans push to callback"""
+        initiation = recall_trace(PaymentProcessor.settlement_trace_key(payment))
+        caller = current_span()
+        parent = initiation[0] if initiation else None
+        with start_span('PaymentProcessor.apply_result', parent=parent, **{
+            'payment.reference': payment.reference_id, 'payment.status': new_status,
+        }) as span:
+            if span is not None and initiation:
+                span.set_attribute('settlement.latency_ms', round((span.start_ns - initiation[1]) / 1e6, 1))
+                if caller is not None:
+                    span.set_attribute('settlement.request_trace_id', caller.context.trace_id)
+            yield span
+
+    @staticmethod
+    def apply_result(payment, new_status, response_data):
+        """Record the provider's verdict on a payment and issue its receipt on success.
+
+        A payment already in a final status is returned unchanged: the first
+        verdict wins, whether it came from a callback, the inbox or the reconciler.
+        """
+        with PaymentProcessor.settlement_span(payment, new_status) as span:
+            if payment.status in Payment.FINAL_STATUSES:
+                if span is not None:
+                    span.set_attribute('settlement.skipped', payment.status)
+                return payment
+
+            payment.status = new_status
+            payment.response_data = response_data
+            payment.save()
+
+            if payment.status == 'success':
+                from receipts.models import Receipt
+                if not Receipt.objects.filter(payment=payment).exists():
+                    from receipts.services import ReceiptGenerator
+                    ReceiptGenerator.generate_receipt(payment)
+        return payment
+
     @staticmethod
     def validate_phone_number(phone_number):
         """Validate phone number format"""
@@ -230,6 +358,22 @@ class PaymentProcessor:
     @staticmethod
     def process_payment(payment):
         """Process payment based on method"""
+        started = time.perf_counter()
+        with log_context(payment_reference=payment.reference_id, provider=payment.payment_method), \
+                start_span('PaymentProcessor.process_payment', **{'payment.reference': payment.reference_id}) as span:
+            payment = PaymentProcessor._process_payment(payment)
+            if span is not None:
+                span.set_attribute('payment.status', payment.status)
+            if payment.status == 'processing':
+                remember_trace(PaymentProcessor.settlement_trace_key(payment), settings.TRACING_SETTLEMENT_TTL)
+            logger.info("Payment initiation finished", extra={
+                'status': payment.status,
+                'duration_ms': round((time.perf_counter() - started) * 1000, 2),
+            })
+        return payment
+
+    @staticmethod
+    def _process_payment(payment):
         try:
 
             validated_phone = PaymentProcessor.validate_phone_number(payment.phone_number)
@@ -289,8 +433,91 @@ class PaymentProcessor:
             payment.response_data = {'error': str(e)}
             payment.save()
             return payment
+        except ProviderUnavailable as e:
+            # Circuit open: failed straight away instead of after a full timeout
+            payment.status = 'failed'
+            payment.response_data = {'error': str(e), 'provider_unavailable': True}
+            payment.save()
+            return payment
         except Exception as e:
             payment.status = 'failed'
             payment.response_data = {'error': str(e)}
             payment.save()
-            return payment
\ No newline at end of file
+            return payment
+
+    @staticmethod
+    def process_batch(payments, max_workers=None):
+        """Process payments with at most `max_workers` provider calls in flight"""
+        def process(payment):
+            try:
+                return PaymentProcessor.process_payment(payment)
+            finally:
+                # Each pool thread holds its own DB connection
+                connection.close()
+
+        max_workers = min(max_workers or settings.PAYMENT_BATCH_CONCURRENCY, len(payments))
+        with ThreadPoolExecutor(max_workers=max(max_workers, 1)) as executor:
+            # Run each payment in a copy of the caller's context so request-scoped state follows it
+            futures = [executor.submit(contextvars.copy_context().run, process, payment) for payment in payments]
+            return [future.result() for future in futures]
+
+    @staticmethod
+    def run_job(job_id):
+        """Process a queued payment claimed by a payment worker.
+
+        Failed runs are retried with a growing delay; after
+        PAYMENT_JOB_MAX_ATTEMPTS claims the job and its payment are failed.
+        """
+        job = PaymentJob.objects.select_related('payment', 'payment__initiated_by').get(id=job_id)
+        max_attempts = settings.PAYMENT_JOB_MAX_ATTEMPTS
+        try:
+            # `initiated` means a worker died between saving that status and
+            # recording the provider response, so the push may not have been
+            # sent; anything later was answered and is left to the callbacks.
+            # A stored CheckoutRequestID proves the push was accepted: pushing
+            # again would prompt the customer twice, so hand it to the
+            # callbacks and the reconciler (which settles `processing`) instead
+            payment = job.payment
+            if payment.status == 'initiated' and payment.mpesa_transaction_id:
+                payment.status = 'processing'
+                payment.save()
+            elif payment.status in ('pending', 'initiated'):
+                if job.attempts > max_attempts:
+                    return PaymentProcessor._fail_job(job, f"Gave up after {max_attempts} attempts")
+                breaker = get_provider_client('mpesa').get_breaker('initiate_stk_push')
+                if breaker.state() == 'open':
+                    # Leave the payment pending and retry once the circuit may have closed;
+                    # waiting on the circuit does not use up an attempt
+                    job.status = 'queued'
+                    job.attempts -= 1
+                    job.available_at = timezone.now() + timedelta(seconds=breaker.options['OPEN_SECONDS'])
+                    job.locked_at = None
+                    job.save(update_fields=['status', 'attempts', 'available_at', 'locked_at', 'updated_at'])
+                    return job
+                PaymentProcessor.process_payment(job.payment)
+            job.status = 'done'
+        except Exception as e:
+            if job.attempts >= max_attempts:
+                return PaymentProcessor._fail_job(job, str(e))
+            job.status = 'queued'
+            job.last_error = str(e)
+            job.available_at = timezone.now() + timedelta(seconds=settings.PAYMENT_JOB_RETRY_DELAY * job.attempts)
+        job.locked_at = None
+        job.save(update_fields=['status', 'last_error', 'available_at', 'locked_at', 'updated_at'])
+        return job
+
+    @staticmethod
+    def _fail_job(job, error):
+        """Terminal failure: the job is not claimed again and its payment is failed"""
+        with transaction.atomic():
+            payment = Payment.objects.select_for_update().get(pk=job.payment_id)
+            if payment.status in ('pending', 'initiated'):
+                payment.status = 'failed'
+                payment.response_data = {'error': error}
+                payment.save()
+            job.payment = payment
+            job.status = 'failed'
+            job.last_error = error
+            job.locked_at = None
+            job.save(update_fields=['status', 'last_error', 'locked_at', 'updated_at'])
+        return job
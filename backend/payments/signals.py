@@ -0,0 +1,52 @@
+from django.db import transaction
+from django.dispatch import Signal
+from django.utils import timezone
+
+# Sent inside the saving transaction whenever a payment is created or its
+# status (or amount) changes. Arguments: payment, previous_status, previous_amount
+# (both None for a new payment).
+payment_status_changed = Signal()
+
+
+def update_daily_rollup(sender, payment, previous_status, previous_amount, **kwargs):
+    from .models import PaymentDailyRollup
+    PaymentDailyRollup.record_transition(payment, previous_status, previous_amount)
+
+
+def update_stats_counters(sender, payment, previous_status, previous_amount, **kwargs):
+    from .analytics import PaymentAnalytics
+    status, amount = payment.status, payment.amount
+
+    def apply():
+        if previous_status is not None:
+            PaymentAnalytics.update_stats_counters(previous_status, -1, -previous_amount)
+        PaymentAnalytics.update_stats_counters(status, 1, amount)
+
+    # Counters live outside the database, so only touch them once the transition is committed
+    transaction.on_commit(apply)
+
+
+def bump_analytics_version(sender, payment, **kwargs):
+    from .analytics import CachedPaymentAnalytics
+    day = timezone.localdate(payment.created_at)
+    transaction.on_commit(lambda: CachedPaymentAnalytics.bump_version(day))
+
+
+def count_status_transition(sender, payment, previous_status, **kwargs):
+    from business_portal.metrics import payment_status_transitions
+    labels = {
+        'payment_method': payment.payment_method,
+        'from_status': previous_status or 'none',
+        'to_status': payment.status,
+    }
+    transaction.on_commit(lambda: payment_status_transitions.inc(**labels))
+
+
+def forget_deleted_payment(sender, instance, **kwargs):
+    from .models import PaymentDailyRollup
+    from .analytics import PaymentAnalytics
+    PaymentDailyRollup.apply(
+        timezone.localdate(instance.created_at), instance.payment_method, instance.status, -1, -instance.amount
+    )
+    transaction.on_commit(lambda: PaymentAnalytics.update_stats_counters(instance.status, -1, -instance.amount))
+    bump_analytics_version(sender, instance)
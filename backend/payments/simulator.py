@@ -0,0 +1,314 @@
+import hashlib
+import heapq
+import hmac
+import itertools
+import json
+import math
+import random
+import re
+import secrets
+import threading
+import time
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import requests
+
+# ResultCode -> ResultDesc for the STK callbacks the simulator sends
+MPESA_RESULT_DESCRIPTIONS = {
+    0: 'The service request is processed successfully.',
+    1: 'The balance is insufficient for the transaction.',
+    1032: 'Request cancelled by user',
+    1037: 'DS timeout user cannot be reached',
+}
+DEFAULT_MPESA_RESULT_MIX = {0: 85, 1032: 9, 1037: 4, 1: 2}
+
+
+class LatencyModel:
+    """Log-normal delay described by its median and 99th percentile, in milliseconds"""
+
+    def __init__(self, median_ms, p99_ms=None, rng=None):
+        self.median = median_ms / 1000
+        p99_ms = max(p99_ms or median_ms, median_ms)
+        # 2.326 is the z-score of the 99th percentile
+        self.sigma = math.log(p99_ms / median_ms) / 2.326 if median_ms > 0 else 0
+        self.random = rng or random.Random()
+
+    def sample(self):
+        if self.median <= 0:
+            return 0.0
+        return self.median * math.exp(self.random.gauss(0, self.sigma))
+
+
+class CallbackDispatcher:
+    """
+    Delivers scheduled callbacks from a few worker threads, in due-time order.
+
+    Pending callbacks wait on one heap, so the number of threads stays at
+    `workers` however many transactions are outstanding.
+    """
+
+    def __init__(self, workers=4):
+        self.queue = []
+        self.sequence = itertools.count()
+        self.condition = threading.Condition()
+        self.session = requests.Session()
+        self.deliveries = {}  # event id -> epoch seconds its first successful delivery was sent
+        self.stats = {'sent': 0, 'failed': 0}
+        self.stopping = False
+        self.threads = [threading.Thread(target=self.run, daemon=True) for _ in range(workers)]
+        for thread in self.threads:
+            thread.start()
+
+    def schedule(self, delay, event_id, message):
+        """Deliver `message` in `delay` seconds.
+
+        `message` is a (url, body, headers) tuple, or a callable returning
+        one that runs only when the delivery is due.
+        """
+        with self.condition:
+            heapq.heappush(self.queue, (time.monotonic() + delay, next(self.sequence), event_id, message))
+            self.condition.notify()
+
+    def run(self):
+        while True:
+            with self.condition:
+                while not self.stopping and (not self.queue or self.queue[0][0] > time.monotonic()):
+                    self.condition.wait(timeout=self.queue[0][0] - time.monotonic() if self.queue else None)
+                if self.stopping:
+                    return
+                _, _, event_id, message = heapq.heappop(self.queue)
+            if callable(message):
+                message = message()
+            sent_at = time.time()
+            ok = self.send(*message)
+            with self.condition:
+                self.stats['sent' if ok else 'failed'] += 1
+                if ok:
+                    self.deliveries.setdefault(event_id, sent_at)
+
+    def send(self, url, body, headers=None):
+        """POST one callback; True if the portal accepted it"""
+        try:
+            response = self.session.post(
+                url, data=body, headers={'Content-Type': 'application/json', **(headers or {})}, timeout=30
+            )
+        except requests.RequestException:
+            return False
+        return response.status_code < 500
+
+    def stop(self):
+        with self.condition:
+            self.stopping = True
+            self.condition.notify_all()
+
+
+class ProviderSimulator:
+    """
+    In-memory stand-in for the Daraja and Paystack endpoints MpesaService and
+    PaystackService call, for load tests without real providers.
+
+    Every request waits `latency` first and fails with `error_rate`
+    probability (503 for Daraja, 500 for Paystack). Accepted STK pushes and
+    Paystack transactions are settled after `callback_delay` (the customer
+    entering their PIN / paying), and the result is POSTed to the portal: the
+    STK callback to `callback_url`, a charge webhook signed with
+    `webhook_secret` to `webhook_url`. With `duplicate_rate` a callback is sent
+    twice; with `reorder_rate` it is sent right away, before the initiation
+    response reaches the portal, and retried after the usual delay.
+    """
+
+    def __init__(self, callback_url, webhook_url, webhook_secret='', latency=None, callback_delay=None,
+                 error_rate=0.0, duplicate_rate=0.0, reorder_rate=0.0, result_mix=None, paystack_success_rate=0.9,
+                 workers=4, seed=None):
+        self.random = random.Random(seed)
+        self.callback_url = callback_url
+        self.webhook_url = webhook_url
+        self.webhook_secret = webhook_secret
+        self.latency = latency or LatencyModel(0)
+        self.callback_delay = callback_delay or LatencyModel(0)
+        self.error_rate = error_rate
+        self.duplicate_rate = duplicate_rate
+        self.reorder_rate = reorder_rate
+        result_mix = result_mix or DEFAULT_MPESA_RESULT_MIX
+        self.result_codes, self.result_weights = list(result_mix), list(result_mix.values())
+        self.paystack_success_rate = paystack_success_rate
+        self.lock = threading.Lock()
+        self.stk_pushes = {}  # CheckoutRequestID -> ResultCode once settled, else None
+        self.transactions = {}  # Paystack reference -> {'amount', 'email', 'status'}
+        self.dispatcher = CallbackDispatcher(workers)
+
+    def handle(self, method, path, body):
+        """Answer one provider API call; returns (status code, JSON-serializable body)"""
+        time.sleep(self.latency.sample())
+        path = path.split('?')[0].rstrip('/')
+        if path == '/simulator/deliveries':
+            return 200, {'deliveries': dict(self.dispatcher.deliveries), **self.dispatcher.stats}
+
+        routes = [
+            ('GET', r'/oauth/v1/generate', self.oauth_token),
+            ('POST', r'/mpesa/stkpush/v1/processrequest', self.stk_push),
+            ('POST', r'/mpesa/stkpushquery/v1/query', self.stk_query),
+            ('POST', r'/mpesa/c2b/v1/registerurl', self.register_url),
+            ('POST', r'/transaction/initialize', self.initialize_transaction),
+            ('GET', r'/transaction/verify/(?P<reference>[^/]+)', self.verify_transaction),
+            ('POST', r'/transaction/charge_authorization', self.charge_authorization),
+            ('POST', r'/customer', self.create_customer),
+        ]
+        for route_method, pattern, view in routes:
+            match = re.fullmatch(pattern, path)
+            if match and method == route_method:
+                if self.random.random() < self.error_rate:
+                    return self.injected_error(path)
+                return view(body, **match.groupdict())
+        return 404, {'errorMessage': f'No simulated endpoint for {method} {path}'}
+
+    def injected_error(self, path):
+        if path.startswith(('/oauth', '/mpesa')):
+            return 503, {'requestId': secrets.token_hex(8), 'errorCode': '500.003.02',
+                         'errorMessage': 'System is busy. Please try again in few minutes.'}
+        return 500, {'status': False, 'message': 'An error occurred'}
+
+    # Daraja
+
+    def oauth_token(self, body):
+        return 200, {'access_token': secrets.token_urlsafe(24), 'expires_in': '3599'}
+
+    def stk_push(self, body):
+        checkout_id = f"ws_CO_{datetime.now():%d%m%Y%H%M%S}{secrets.randbelow(10 ** 9):09d}"
+        with self.lock:
+            self.stk_pushes[checkout_id] = None
+        result_code = self.random.choices(self.result_codes, weights=self.result_weights)[0]
+        self.schedule_callback(checkout_id, lambda: self.settle_stk_push(checkout_id, result_code))
+        return 200, {
+            'MerchantRequestID': f"{secrets.randbelow(10 ** 5)}-{secrets.randbelow(10 ** 8)}-1",
+            'CheckoutRequestID': checkout_id,
+            'ResponseCode': '0',
+            'ResponseDescription': 'Success. Request accepted for processing',
+            'CustomerMessage': 'Success. Request accepted for processing',
+        }
+
+    def settle_stk_push(self, checkout_id, result_code):
+        with self.lock:
+            self.stk_pushes[checkout_id] = result_code
+        callback = {'MerchantRequestID': '', 'CheckoutRequestID': checkout_id, 'ResultCode': result_code,
+                    'ResultDesc': MPESA_RESULT_DESCRIPTIONS.get(result_code, 'Failed')}
+        if result_code == 0:
+            callback['CallbackMetadata'] = {'Item': [
+                {'Name': 'MpesaReceiptNumber', 'Value': secrets.token_hex(5).upper()},
+                {'Name': 'TransactionDate', 'Value': int(datetime.now().strftime('%Y%m%d%H%M%S'))},
+            ]}
+        return self.callback_url, json.dumps({'Body': {'stkCallback': callback}}), None
+
+    def stk_query(self, body):
+        with self.lock:
+            result_code = self.stk_pushes.get(body.get('CheckoutRequestID'), 'unknown')
+        if result_code == 'unknown':
+            return 400, {'errorCode': '400.002.02', 'errorMessage': 'Bad Request - Invalid CheckoutRequestID'}
+        if result_code is None:
+            return 500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+        return 200, {'ResponseCode': '0', 'ResponseDescription': 'The service request has been accepted successsfully',
+                     'CheckoutRequestID': body['CheckoutRequestID'], 'ResultCode': str(result_code),
+                     'ResultDesc': MPESA_RESULT_DESCRIPTIONS.get(result_code, 'Failed')}
+
+    def register_url(self, body):
+        return 200, {'ResponseCode': '0', 'ResponseDescription': 'Success'}
+
+    # Paystack
+
+    def initialize_transaction(self, body):
+        reference = body.get('reference') or secrets.token_hex(8)
+        with self.lock:
+            self.transactions[reference] = {'amount': body.get('amount'), 'email': body.get('email'),
+                                            'status': 'abandoned'}
+        status = 'success' if self.random.random() < self.paystack_success_rate else 'failed'
+        self.schedule_callback(reference, lambda: self.settle_transaction(reference, status))
+        access_code = secrets.token_hex(8)
+        return 200, {'status': True, 'message': 'Authorization URL created', 'data': {
+            'authorization_url': f'https://checkout.paystack.com/{access_code}',
+            'access_code': access_code, 'reference': reference,
+        }}
+
+    def settle_transaction(self, reference, status):
+        with self.lock:
+            transaction = self.transactions[reference]
+            transaction['status'] = status
+            data = {'reference': reference, 'status': status, 'amount': transaction['amount'],
+                    'customer': {'email': transaction['email']}}
+        body = json.dumps({'event': f'charge.{status}', 'data': data})
+        signature = hmac.new(self.webhook_secret.encode(), body.encode(), hashlib.sha512).hexdigest()
+        return self.webhook_url, body, {'X-Paystack-Signature': signature}
+
+    def verify_transaction(self, body, reference):
+        with self.lock:
+            transaction = self.transactions.get(reference)
+            transaction = dict(transaction) if transaction else None
+        if transaction is None:
+            return 404, {'status': False, 'message': 'Transaction reference not found'}
+        return 200, {
+            'status': True, 'message': 'Verification successful', 'data': {'reference': reference, **transaction},
+        }
+
+    def charge_authorization(self, body):
+        return 200, {'status': True, 'message': 'Charge attempted', 'data': {
+            'reference': secrets.token_hex(8), 'amount': body.get('amount'), 'status': 'success',
+        }}
+
+    def create_customer(self, body):
+        return 200, {'status': True, 'message': 'Customer created', 'data': {
+            'email': body.get('email'), 'customer_code': f'CUS_{secrets.token_hex(7)}',
+        }}
+
+    # Callback delivery
+
+    def schedule_callback(self, event_id, settle):
+        """Settle after the callback delay (or, when reordered, at once) and deliver the result"""
+        reordered = self.random.random() < self.reorder_rate
+        delay = self.callback_delay.sample()
+        delays = [0.0, delay] if reordered else [delay]
+        if self.random.random() < self.duplicate_rate:
+            delays.append(delays[-1] + self.callback_delay.sample())
+
+        def settle_and_deliver():
+            message = settle()
+            for later in delays[1:]:
+                self.dispatcher.schedule(later - delays[0], event_id, message)
+            return message
+
+        # Settled only when the first callback is due, so status queries see the result from then on
+        self.dispatcher.schedule(delays[0], event_id, settle_and_deliver)
+
+    # Serving
+
+    def serve(self, host='127.0.0.1', port=8001):
+        """A threaded HTTP server answering with this simulator; call serve_forever() on it"""
+        simulator = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+
+            def do_GET(self):
+                self.respond()
+
+            def do_POST(self):
+                self.respond()
+
+            def respond(self):
+                length = int(self.headers.get('Content-Length') or 0)
+                try:
+                    body = json.loads(self.rfile.read(length) or b'{}')
+                except ValueError:
+                    body = {}
+                status, payload = simulator.handle(self.command, self.path, body)
+                data = json.dumps(payload).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        server = ThreadingHTTPServer((host, port), Handler)
+        server.daemon_threads = True
+        return server
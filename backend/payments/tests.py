@@ -1,3 +1,1034 @@
-from django.test import TestCase
+import csv
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from datetime import timedelta
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import StringIO
+from unittest import mock
+import requests
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from rest_framework.test import APIClient
+from accounts.models import CustomUser
+from business_portal.logging_config import ContextFilter, JsonFormatter, QueueListenerHandler, log_context
+from business_portal.metrics import REGISTRY, Registry, receipt_generation_seconds
+from business_portal.throttling import TokenBucketThrottle
+from business_portal.tracing import FileSpanExporter, InMemorySpanExporter, set_exporter
+from receipts.models import Receipt
+from .analytics import CachedPaymentAnalytics, PaymentAnalytics
+from .benchmarks import EndpointBenchmark
+from .clients import CircuitBreaker, ProviderClient, ProviderUnavailable
+from .datagen import SyntheticDataGenerator
+from .inbox import CallbackInboxDrainer
+from .models import CallbackInbox, Payment, PaymentDailyRollup, PaymentJob, ProcessedEvent
+from .reconciliation import PaymentReconciler
+from .services import MPESA_TOKEN_CACHE_KEY, MPESA_TOKEN_LOCK_KEY, MpesaService, PaymentProcessor
+from .simulator import LatencyModel, ProviderSimulator
 
-# Create your tests here.
+
+def create_payments(user, count, **kwargs):
+    return Payment.objects.bulk_create([
+        Payment(
+            reference_id=f"{user.username}-{i}",
+            phone_number='254712345678',
+            amount=100,
+            initiated_by=user,
+            response_data={'Body': {'stkCallback': {'CallbackMetadata': {'Item': ['x'] * 50}}}},
+            **kwargs,
+        )
+        for i in range(count)
+    ])
+
+
+class PaymentListQueryCountTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username='admin', user_type='admin')
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+        self.client = APIClient()
+
+    def assert_list_queries(self, user, page_size, expected_rows):
+        self.client.force_authenticate(user)
+        with self.assertNumQueries(1):
+            response = self.client.get('/api/payments/list/', {'page_size': page_size})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.data['results']), expected_rows)
+        return response
+
+    def test_admin_list_is_one_query_regardless_of_page_size(self):
+        create_payments(self.admin, 30)
+        create_payments(self.staff, 30)
+        self.assert_list_queries(self.admin, 5, 5)
+        self.assert_list_queries(self.admin, 60, 60)
+
+    def test_staff_list_is_one_query_regardless_of_page_size(self):
+        create_payments(self.admin, 10)
+        create_payments(self.staff, 30)
+        self.assert_list_queries(self.staff, 5, 5)
+        self.assert_list_queries(self.staff, 100, 30)
+
+    def test_list_omits_provider_payloads(self):
+        create_payments(self.admin, 1)
+        response = self.assert_list_queries(self.admin, 5, 1)
+        self.assertNotIn('response_data', response.data['results'][0])
+        self.assertNotIn('initiated_by', response.data['results'][0])
+
+
+class KeysetPaginationTests(TestCase):
+    def setUp(self):
+        self.admin = CustomUser.objects.create(username='admin', user_type='admin')
+        self.client = APIClient()
+        self.client.force_authenticate(self.admin)
+
+    def walk(self, **params):
+        """Reference ids of every page, following next links"""
+        seen = []
+        response = self.client.get('/api/payments/list/', {'page_size': 2, **params})
+        while True:
+            seen += [payment['reference_id'] for payment in response.data['results']]
+            if not response.data['next']:
+                return seen
+            response = self.client.get(response.data['next'])
+
+    def test_cursor_walk_returns_every_row_once_in_order(self):
+        create_payments(self.admin, 5)
+        expected = list(Payment.objects.order_by('-created_at', 'id').values_list('reference_id', flat=True))
+        self.assertEqual(self.walk(), expected)
+
+    def test_rows_sharing_created_at_are_split_by_id(self):
+        create_payments(self.admin, 5)
+        Payment.objects.update(created_at=timezone.now())
+        expected = list(Payment.objects.order_by('id').values_list('reference_id', flat=True))
+        self.assertEqual(self.walk(), expected)
+
+    def test_previous_link_returns_the_earlier_page(self):
+        create_payments(self.admin, 5)
+        first = self.client.get('/api/payments/list/', {'page_size': 2})
+        self.assertIsNone(first.data['previous'])
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(back.data['results'], first.data['results'])
+
+    def test_invalid_cursor_is_not_found(self):
+        response = self.client.get('/api/payments/list/', {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_filters_apply_across_pages(self):
+        create_payments(self.admin, 4, status='success')
+        create_payments(CustomUser.objects.create(username='other', user_type='staff'), 3, status='failed')
+        self.assertEqual(len(self.walk(status='failed')), 3)
+        self.assertEqual(len(self.walk(search='other-')), 3)
+        response = self.client.get('/api/payments/list/', {'start_date': '18/10/2026'})
+        self.assertEqual(response.status_code, 400)
+
+
+class DailyRollupTests(TestCase):
+    def setUp(self):
+        self.user = CustomUser.objects.create(username='staff', user_type='staff')
+
+    def test_rollups_follow_status_transitions(self):
+        payment = Payment.objects.create(phone_number='254712345678', amount=250, initiated_by=self.user)
+        payment.status = 'processing'
+        payment.save()
+        payment = Payment.objects.get(pk=payment.pk)
+        payment.status = 'success'
+        payment.save()
+        Payment.objects.create(phone_number='254712345678', amount=100, initiated_by=self.user, status='failed')
+
+        [day] = PaymentAnalytics.get_daily_summary()
+        self.assertEqual(day['total_count'], 2)
+        self.assertEqual(day['success_count'], 1)
+        self.assertEqual(day['failed_count'], 1)
+        self.assertEqual(day['total_amount'], Decimal('350'))
+        self.assertFalse(PaymentDailyRollup.objects.filter(status='pending').exclude(count=0).exists())
+
+    def test_rebuild_matches_incremental_rollups(self):
+        for status in ('success', 'success', 'failed', 'pending'):
+            Payment.objects.create(phone_number='254712345678', amount=10, status=status)
+        Payment.objects.filter(status='pending').delete()
+        incremental = PaymentAnalytics.get_daily_summary()
+
+        PaymentDailyRollup.objects.all().delete()
+        call_command('rebuild_daily_rollups', stdout=StringIO())
+        self.assertEqual(PaymentAnalytics.get_daily_summary(), incremental)
+
+
+class OverallStatsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def test_counters_follow_transitions_without_querying_payments(self):
+        for status in ('success', 'failed', 'pending', 'processing'):
+            Payment.objects.create(phone_number='254712345678', amount=100, status=status)
+        self.assertEqual(PaymentAnalytics.get_overall_stats()['total_payments'], 4)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payment.objects.get(status='processing')
+            payment.status = 'success'
+            payment.save()
+
+        with self.assertNumQueries(0):
+            stats = PaymentAnalytics.get_overall_stats()
+        self.assertEqual(stats['successful_payments'], 2)
+        self.assertEqual(stats['failed_payments'], 1)
+        self.assertEqual(stats['pending_payments'], 1)
+        self.assertEqual(stats['processing_payments'], 0)
+        self.assertEqual(stats['total_amount_processed'], Decimal('200'))
+
+
+class CachedAnalyticsTests(TestCase):
+    def setUp(self):
+        cache.clear()
+
+    def create_payment(self, days_ago, **kwargs):
+        payment = Payment.objects.create(phone_number='254712345678', amount=100, **kwargs)
+        created_at = timezone.now() - timedelta(days=days_ago)
+        Payment.objects.filter(pk=payment.pk).update(created_at=created_at)
+        PaymentDailyRollup.rebuild()
+        return Payment.objects.get(pk=payment.pk)
+
+    def test_closed_days_are_served_from_cache_until_they_change(self):
+        payment = self.create_payment(2, status='processing')
+        self.create_payment(0, status='success')
+
+        first = CachedPaymentAnalytics.get_daily_summary()
+        self.assertEqual([day['total_count'] for day in first], [1, 1])
+        # Only today's partial bucket is recomputed
+        with self.assertNumQueries(1):
+            self.assertEqual(CachedPaymentAnalytics.get_daily_summary(), first)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.status = 'success'
+            payment.save()
+        closed_day = CachedPaymentAnalytics.get_daily_summary()[-1]
+        self.assertEqual(closed_day['success_count'], 1)
+        self.assertEqual(CachedPaymentAnalytics.get_cache_stats()['daily']['misses'], 3)
+
+
+    def test_range_starts_at_the_first_payment(self):
+        self.create_payment(2, status='success')
+        start = timezone.localdate() - timedelta(days=3650)
+        self.assertEqual(len(CachedPaymentAnalytics.get_daily_summary(start_date=start)), 1)
+        self.assertEqual(CachedPaymentAnalytics.get_cache_stats()['daily']['misses'], 2)
+
+    def test_overall_stats_count_a_miss_when_counters_are_recounted(self):
+        CachedPaymentAnalytics.get_overall_stats()
+        CachedPaymentAnalytics.get_overall_stats()
+        stats = CachedPaymentAnalytics.get_cache_stats()['overall']
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+
+
+class PaymentExportTests(TestCase):
+    def setUp(self):
+        self.auditor = CustomUser.objects.create(username='auditor', user_type='auditor')
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+        create_payments(self.staff, 3, status='success')
+        create_payments(self.auditor, 2, status='failed')
+        self.client = APIClient()
+
+    def export(self, user, **params):
+        self.client.force_authenticate(user)
+        response = self.client.get('/api/payments/export/', params)
+        self.assertTrue(response.streaming)
+        return b''.join(response.streaming_content).decode()
+
+    def test_csv_export_applies_filters(self):
+        rows = list(csv.DictReader(StringIO(self.export(self.auditor, status='success'))))
+        self.assertEqual(len(rows), 3)
+        self.assertEqual({row['initiated_by'] for row in rows}, {'staff'})
+
+    def test_ndjson_export_is_scoped_to_staff_member(self):
+        lines = self.export(self.staff, export_format='ndjson').splitlines()
+        self.assertEqual(len(lines), 3)
+        self.assertEqual(json.loads(lines[0])['amount'], '100.00')
+
+
+class BatchPaymentInitiateTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def post(self, items):
+        return self.client.post('/api/payments/initiate/batch/', {'items': items}, format='json')
+
+    def test_invalid_item_rejects_whole_batch(self):
+        response = self.post([
+            {'phone_number': '0712345678', 'amount': '100'},
+            {'phone_number': '12345', 'amount': '100'},
+        ])
+        self.assertEqual(response.status_code, 400)
+        self.assertIn(1, response.data['items'])
+        self.assertFalse(Payment.objects.exists())
+
+    @override_settings(PAYMENT_ASYNC_INITIATION=True)
+    def test_batch_is_created_and_queued_together(self):
+        response = self.post([
+            {'phone_number': '0712345678', 'amount': '100', 'description': 'Rent'},
+            {'phone_number': '254798765432', 'amount': '250.50'},
+        ])
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual([r['phone_number'] for r in response.data['results']], ['254712345678', '254798765432'])
+        self.assertEqual(PaymentJob.objects.count(), 2)
+        rollup = PaymentDailyRollup.objects.get(status='pending')
+        self.assertEqual((rollup.count, rollup.total_amount), (2, Decimal('350.50')))
+
+
+@override_settings(PAYMENT_JOB_MAX_ATTEMPTS=3, PAYMENT_JOB_RETRY_DELAY=30)
+class PaymentJobTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+
+    def create_job(self, status='pending', **kwargs):
+        payment = Payment.objects.create(phone_number='254712345678', amount=10, initiated_by=self.staff,
+                                         status=status)
+        return PaymentJob.objects.create(payment=payment, **kwargs)
+
+    @override_settings(PAYMENT_ASYNC_INITIATION=True)
+    def test_initiation_is_queued_with_202(self):
+        api = APIClient()
+        api.force_authenticate(self.staff)
+        with mock.patch('requests.Session.request') as send:
+            response = api.post('/api/payments/initiate/', {'phone_number': '0712345678', 'amount': '10'})
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(response.data['status'], 'pending')
+        send.assert_not_called()
+        self.assertEqual(PaymentJob.objects.get().payment.reference_id, response.data['reference_id'])
+
+    def test_claim_skips_jobs_not_yet_due_and_counts_attempts(self):
+        due = self.create_job()
+        self.create_job(available_at=timezone.now() + timedelta(minutes=5))
+        self.assertEqual(PaymentJob.claim(10, lease_seconds=300), [due.id])
+        due.refresh_from_db()
+        self.assertEqual((due.status, due.attempts), ('running', 1))
+        self.assertEqual(PaymentJob.claim(10, lease_seconds=300), [])
+
+    def test_expired_lease_is_reclaimed(self):
+        abandoned = self.create_job(status='initiated')
+        PaymentJob.objects.filter(pk=abandoned.pk).update(
+            status='running', attempts=1, locked_at=timezone.now() - timedelta(seconds=301)
+        )
+        live = self.create_job()
+        PaymentJob.objects.filter(pk=live.pk).update(status='running', attempts=1, locked_at=timezone.now())
+        self.assertEqual(PaymentJob.claim(10, lease_seconds=300), [abandoned.id])
+        abandoned.refresh_from_db()
+        self.assertEqual(abandoned.attempts, 2)
+
+    def test_reclaimed_initiated_payment_is_pushed_again(self):
+        job = self.create_job(status='initiated', attempts=2)
+        with mock.patch.object(PaymentProcessor, 'process_payment') as process:
+            job = PaymentProcessor.run_job(job.id)
+        process.assert_called_once()
+        self.assertEqual(job.status, 'done')
+
+    def test_initiated_payment_with_checkout_id_is_not_pushed_again(self):
+        job = self.create_job(status='initiated', attempts=2)
+        Payment.objects.filter(pk=job.payment_id).update(mpesa_transaction_id='ws_CO_accepted')
+        with mock.patch.object(PaymentProcessor, 'process_payment') as process:
+            self.assertEqual(PaymentProcessor.run_job(job.id).status, 'done')
+        process.assert_not_called()
+        self.assertEqual(Payment.objects.get(pk=job.payment_id).status, 'processing')
+
+    def test_processing_payment_is_left_to_callbacks(self):
+        job = self.create_job(status='processing', attempts=2)
+        with mock.patch.object(PaymentProcessor, 'process_payment') as process:
+            self.assertEqual(PaymentProcessor.run_job(job.id).status, 'done')
+        process.assert_not_called()
+
+    def test_error_is_retried_later(self):
+        job = self.create_job(attempts=1)
+        with mock.patch.object(PaymentProcessor, 'process_payment', side_effect=RuntimeError('db gone')):
+            job = PaymentProcessor.run_job(job.id)
+        self.assertEqual((job.status, job.last_error), ('queued', 'db gone'))
+        self.assertGreater(job.available_at, timezone.now() + timedelta(seconds=20))
+
+    def test_attempts_cap_fails_job_and_payment(self):
+        job = self.create_job(status='initiated', attempts=4)
+        with mock.patch.object(PaymentProcessor, 'process_payment') as process:
+            job = PaymentProcessor.run_job(job.id)
+        process.assert_not_called()
+        self.assertEqual(job.status, 'failed')
+        self.assertEqual(Payment.objects.get(pk=job.payment_id).status, 'failed')
+        self.assertEqual(PaymentJob.claim(10, lease_seconds=0), [])
+
+
+class PaymentReconcilerTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+
+    def create_processing(self, checkout_request_id, age):
+        payment = Payment.objects.create(
+            phone_number='254712345678', amount=100, status='processing',
+            mpesa_transaction_id=checkout_request_id, initiated_by=self.staff,
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - age)
+        return Payment.objects.get(pk=payment.pk)
+
+    def test_stale_payments_skip_fresh_and_expired(self):
+        stale = self.create_processing('ws_CO_stale', timedelta(minutes=10))
+        self.create_processing('ws_CO_fresh', timedelta(seconds=10))
+        self.create_processing('ws_CO_old', timedelta(days=2))
+        payments = PaymentReconciler.stale_payments(min_age=120, ttl=86400, limit=10)
+        self.assertEqual([p.pk for p in payments], [stale.pk])
+
+    @mock.patch('payments.reconciliation.MpesaService.query_transaction_status')
+    def test_successful_query_settles_payment_with_receipt(self, query):
+        query.return_value = {'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.'}
+        payment = self.create_processing('ws_CO_1', timedelta(minutes=10))
+        self.assertEqual(PaymentReconciler.reconcile_payment(payment), 'success')
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'success')
+        self.assertTrue(payment.receipt)
+
+    @mock.patch('payments.reconciliation.MpesaService.query_transaction_status')
+    def test_pending_query_leaves_payment_open(self, query):
+        query.return_value = {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}
+        payment = self.create_processing('ws_CO_2', timedelta(minutes=10))
+        self.assertIsNone(PaymentReconciler.reconcile_payment(payment))
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'processing')
+
+    def test_expired_payments_time_out(self):
+        payment = self.create_processing('ws_CO_3', timedelta(days=2))
+        self.assertEqual(PaymentReconciler.expire_payments(ttl=86400), 1)
+        self.assertEqual(Payment.objects.get(pk=payment.pk).status, 'timeout')
+        self.assertTrue(PaymentDailyRollup.objects.filter(status='timeout', count=1).exists())
+
+
+class CallbackDedupeTests(TestCase):
+    def setUp(self):
+        staff = CustomUser.objects.create(username='staff', user_type='staff')
+        self.payment = Payment.objects.create(
+            phone_number='254712345678', amount=100, status='processing',
+            mpesa_transaction_id='ws_CO_1', initiated_by=staff,
+        )
+
+    def callback(self, checkout_request_id='ws_CO_1', result_code=0):
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code}}}
+        return self.client.post('/api/payments/mpesa/callback/', json.dumps(body), content_type='application/json')
+
+    def test_retried_callback_is_acknowledged_with_one_insert(self):
+        self.assertEqual(self.callback().status_code, 200)
+        self.payment.refresh_from_db()
+        self.assertEqual(self.payment.status, 'success')
+
+        with self.assertNumQueries(3):  # savepoint, INSERT ... ON CONFLICT, release
+            self.assertEqual(self.callback().status_code, 200)
+        self.assertEqual(ProcessedEvent.objects.count(), 1)
+
+    def test_callback_for_unknown_payment_is_not_recorded(self):
+        self.assertEqual(self.callback('ws_CO_unknown').status_code, 200)
+        self.assertFalse(ProcessedEvent.objects.exists())
+
+
+@override_settings(PAYMENT_CALLBACK_INBOX=True)
+class CallbackInboxTests(TestCase):
+    def setUp(self):
+        staff = CustomUser.objects.create(username='staff', user_type='staff')
+        self.payments = [
+            Payment.objects.create(
+                phone_number='254712345678', amount=100, status='processing',
+                mpesa_transaction_id=f'ws_CO_{i}', initiated_by=staff,
+            )
+            for i in range(3)
+        ]
+
+    def callback(self, checkout_request_id, result_code=0):
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code}}}
+        return self.client.post('/api/payments/mpesa/callback/', json.dumps(body), content_type='application/json')
+
+    def test_callback_is_acknowledged_with_one_insert(self):
+        with self.assertNumQueries(1):
+            self.assertEqual(self.callback('ws_CO_0').status_code, 200)
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, 'processing')
+
+    def test_drain_applies_batch(self):
+        self.callback('ws_CO_0')
+        self.callback('ws_CO_0')  # provider retry
+        self.callback('ws_CO_1', 1032)
+        self.callback('ws_CO_2')
+        self.callback('ws_CO_unknown')
+
+        self.assertEqual(CallbackInboxDrainer.drain_batch(), 5)
+        statuses = dict(Payment.objects.values_list('mpesa_transaction_id', 'status'))
+        self.assertEqual(statuses, {'ws_CO_0': 'success', 'ws_CO_1': 'cancelled', 'ws_CO_2': 'success'})
+        self.assertEqual(Receipt.objects.count(), 2)
+        self.assertEqual(PaymentDailyRollup.objects.get(status='success').count, 2)
+
+        # Only the unknown callback is left, waiting for its retry
+        self.assertEqual(CallbackInbox.lag()['pending'], 1)
+        self.assertEqual(CallbackInboxDrainer.drain_batch(), 0)
+
+    def test_malformed_body_does_not_fail_the_batch(self):
+        self.callback('ws_CO_0')
+        CallbackInbox.objects.create(provider='mpesa', body='[1,2]')
+
+        self.assertEqual(CallbackInboxDrainer.drain_batch(), 2)
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, 'success')
+        bad = CallbackInbox.objects.get(body='[1,2]')
+        self.assertIsNotNone(bad.processed_at)
+        self.assertIn('Unreadable callback', bad.error)
+        self.assertIsNone(CallbackInbox.objects.exclude(pk=bad.pk).get().error)
+
+    def test_failing_callback_is_retried_alone(self):
+        from receipts.services import ReceiptGenerator
+        build_receipt = ReceiptGenerator.build_receipt
+
+        def fail_for_second(payment):
+            if payment.mpesa_transaction_id == 'ws_CO_1':
+                raise RuntimeError('renderer down')
+            return build_receipt(payment)
+
+        for i in range(3):
+            self.callback(f'ws_CO_{i}')
+        with mock.patch('receipts.services.ReceiptGenerator.build_receipt', side_effect=fail_for_second):
+            self.assertEqual(CallbackInboxDrainer.drain_batch(), 3)
+
+        statuses = dict(Payment.objects.values_list('mpesa_transaction_id', 'status'))
+        self.assertEqual(statuses, {'ws_CO_0': 'success', 'ws_CO_1': 'processing', 'ws_CO_2': 'success'})
+        retried = CallbackInbox.objects.get(processed_at__isnull=True)
+        self.assertEqual((retried.attempts, retried.error), (1, 'renderer down'))
+        self.assertFalse(ProcessedEvent.objects.filter(event_key='ws_CO_1:0').exists())
+
+    def test_duplicate_provider_ids_settle_the_first_payment(self):
+        from receipts.services import ReceiptGenerator
+        build_receipt = ReceiptGenerator.build_receipt
+        duplicate = Payment.objects.create(
+            phone_number='254712345678', amount=100, status='processing', mpesa_transaction_id='ws_CO_0',
+        )
+
+        def fail_for_second(payment):
+            if payment.mpesa_transaction_id == 'ws_CO_1':
+                raise RuntimeError('renderer down')
+            return build_receipt(payment)
+
+        self.callback('ws_CO_0')
+        self.callback('ws_CO_1')
+        # The batch fails, so ws_CO_0 is applied alone through the per-callback lookup
+        with mock.patch('receipts.services.ReceiptGenerator.build_receipt', side_effect=fail_for_second):
+            self.assertEqual(CallbackInboxDrainer.drain_batch(), 2)
+
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, 'success')
+        self.assertEqual(Payment.objects.get(pk=duplicate.pk).status, 'processing')
+        settled = CallbackInbox.objects.get(processed_at__isnull=False)
+        self.assertIsNone(settled.error)
+
+    def test_settled_payment_is_not_overwritten(self):
+        Payment.objects.filter(pk=self.payments[0].pk).update(status='cancelled')
+        self.callback('ws_CO_0')
+        CallbackInboxDrainer.drain_batch()
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, 'cancelled')
+        self.assertFalse(Receipt.objects.exists())
+
+    def test_settled_payment_is_not_overwritten_without_inbox(self):
+        Payment.objects.filter(pk=self.payments[0].pk).update(status='cancelled')
+        with override_settings(PAYMENT_CALLBACK_INBOX=False):
+            self.callback('ws_CO_0')
+        self.assertEqual(Payment.objects.get(pk=self.payments[0].pk).status, 'cancelled')
+        self.assertFalse(Receipt.objects.exists())
+
+
+@override_settings(PAYMENT_ASYNC_INITIATION=True, PAYMENT_THROTTLE_RATES={
+    'payment_user': '5/min', 'payment_phone': '2/min', 'payment_till': None,
+})
+class PaymentThrottleTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = APIClient()
+        self.client.force_authenticate(CustomUser.objects.create(username='staff', user_type='staff'))
+
+    def initiate(self, phone_number):
+        return self.client.post('/api/payments/initiate/', {'phone_number': phone_number, 'amount': '10'})
+
+    def test_phone_bucket_rejects_with_retry_after(self):
+        self.assertEqual(self.initiate('0712345678').status_code, 202)
+        self.assertEqual(self.initiate('254712345678').status_code, 202)
+        response = self.initiate('0712345678')
+        self.assertEqual(response.status_code, 429)
+        self.assertGreater(int(response['Retry-After']), 0)
+        self.assertEqual(self.initiate('0798765432').status_code, 202)
+        self.assertEqual(TokenBucketThrottle.get_rejection_counts()['payment_phone'], 1)
+
+    def test_batch_items_count_against_user_bucket(self):
+        items = [{'phone_number': f'07123456{i:02d}', 'amount': '10'} for i in range(4)]
+        response = self.client.post('/api/payments/initiate/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 202)
+        response = self.client.post('/api/payments/initiate/batch/', {'items': items[:2]}, format='json')
+        self.assertEqual(response.status_code, 429)
+
+    def test_rejected_request_does_not_use_other_buckets(self):
+        self.initiate('0712345678')
+        self.initiate('0712345678')
+        self.assertEqual(self.initiate('0712345678').status_code, 429)
+        # The phone rejection gave the user bucket its token back: 3 more fit in 5/min
+        for phone_number in ('0711111111', '0722222222', '0733333333'):
+            self.assertEqual(self.initiate(phone_number).status_code, 202)
+        self.assertEqual(self.initiate('0744444444').status_code, 429)
+
+    def test_batch_rejected_by_one_phone_refunds_the_others(self):
+        self.initiate('0712345678')
+        self.initiate('0712345678')
+        items = [{'phone_number': '0798765432', 'amount': '10'}, {'phone_number': '0712345678', 'amount': '10'}]
+        response = self.client.post('/api/payments/initiate/batch/', {'items': items}, format='json')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(self.initiate('0798765432').status_code, 202)
+        self.assertEqual(self.initiate('0798765432').status_code, 202)
+
+    def test_invalid_request_gives_its_tokens_back(self):
+        for _ in range(3):
+            response = self.client.post('/api/payments/initiate/', {'phone_number': '0712345678', 'amount': 'ten'})
+            self.assertEqual(response.status_code, 400)
+        self.assertEqual(self.initiate('0712345678').status_code, 202)
+        self.assertEqual(self.initiate('0712345678').status_code, 202)
+
+    def test_request_is_denied_when_bucket_lock_is_held(self):
+        cache.add('throttle:payment_user:%s:lock' % CustomUser.objects.get().pk, 1, timeout=60)
+        with self.assertLogs('business_portal.throttling', 'WARNING'):
+            response = self.initiate('0712345678')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(TokenBucketThrottle.get_rejection_counts()['payment_user'], 1)
+
+
+class ProviderClientTests(TestCase):
+    """Against a local HTTP server, so urllib3's real retry logic runs"""
+
+    options = {
+        'POOL_CONNECTIONS': 1, 'POOL_MAXSIZE': 2, 'RETRIES': 2, 'BACKOFF_FACTOR': 0,
+        'TIMEOUTS': {'default': (1, 5), 'query_transaction_status': (1, 0.2)},
+    }
+
+    def setUp(self):
+        cache.clear()
+        self.hits = []
+
+        test = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def handle_one(self):
+                test.hits.append((self.command, self.path))
+                if self.path == '/slow':
+                    time.sleep(0.5)
+                self.send_response(503 if self.path == '/unavailable' else 200)
+                self.send_header('Content-Length', '0')
+                self.end_headers()
+
+            do_GET = do_POST = handle_one
+
+            def log_message(self, *args):
+                pass
+
+        server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+        self.base_url = f'http://127.0.0.1:{server.server_address[1]}'
+        self.client = ProviderClient('mpesa', self.options)
+        self.addCleanup(self.client.close)
+
+    def test_operation_timeouts_are_passed_to_the_session(self):
+        with mock.patch.object(self.client.session, 'request', return_value=mock.Mock(status_code=200)) as send:
+            self.client.post(f'{self.base_url}/stk', 'query_transaction_status')
+            self.client.post(f'{self.base_url}/stk', 'initiate_stk_push')
+        self.assertEqual([call.kwargs['timeout'] for call in send.call_args_list], [(1, 0.2), (1, 5)])
+
+    def test_idempotent_calls_are_retried_on_5xx(self):
+        response = self.client.get(f'{self.base_url}/unavailable', 'verify_transaction')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(len(self.hits), 3)
+
+    def test_post_is_not_repeated_after_5xx(self):
+        response = self.client.post(f'{self.base_url}/unavailable', 'initiate_stk_push')
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(self.hits, [('POST', '/unavailable')])
+
+    def test_post_is_not_repeated_after_read_timeout(self):
+        with self.assertRaises(requests.ReadTimeout):
+            self.client.post(f'{self.base_url}/slow', 'query_transaction_status')
+        self.assertEqual(self.hits, [('POST', '/slow')])
+
+
+@override_settings(PAYMENT_CIRCUIT_BREAKER={
+    'FAILURE_THRESHOLD': 2, 'WINDOW': 60, 'SLOW_CALL_SECONDS': 10, 'OPEN_SECONDS': 30, 'HALF_OPEN_PROBES': 1,
+})
+class CircuitBreakerTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = ProviderClient('mpesa')
+
+    def test_opens_after_failures_and_closes_after_probe(self):
+        with mock.patch.object(self.client.session, 'request', side_effect=requests.ConnectionError) as send:
+            for _ in range(2):
+                with self.assertRaises(requests.ConnectionError):
+                    self.client.post('https://provider.test/stk', 'initiate_stk_push')
+            with self.assertRaises(ProviderUnavailable):
+                self.client.post('https://provider.test/stk', 'initiate_stk_push')
+            self.assertEqual(send.call_count, 2)
+
+        # Other operations keep their own circuit
+        breaker = self.client.get_breaker('initiate_stk_push')
+        self.assertEqual(self.client.get_breaker('query_transaction_status').state(), 'closed')
+
+        cache.delete(f'{breaker.key}:open')  # open period elapsed
+        self.assertEqual(breaker.state(), 'half_open')
+        with mock.patch.object(self.client.session, 'request', return_value=mock.Mock(status_code=200)):
+            self.client.post('https://provider.test/stk', 'initiate_stk_push')
+        self.assertEqual(breaker.state(), 'closed')
+
+    def test_finished_probe_frees_only_its_own_slot(self):
+        breaker = CircuitBreaker('mpesa', 'initiate_stk_push', {**settings.PAYMENT_CIRCUIT_BREAKER, 'HALF_OPEN_PROBES': 2})
+        breaker.trip()
+        cache.delete(f'{breaker.key}:open')
+        self.assertTrue(breaker.before_call())
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(ProviderUnavailable):
+            breaker.before_call()
+
+        # One probe fails and re-opens the circuit while the other is still in flight
+        breaker.record(failed=True, probe=True)
+        cache.delete(f'{breaker.key}:open')
+        self.assertTrue(breaker.before_call())
+        with self.assertRaises(ProviderUnavailable):
+            breaker.before_call()
+
+    def test_open_circuit_fails_payment_fast(self):
+        self.client.get_breaker('get_access_token').trip()
+        staff = CustomUser.objects.create(username='staff', user_type='staff')
+        with mock.patch('payments.services.get_provider_client', return_value=self.client):
+            api = APIClient()
+            api.force_authenticate(staff)
+            response = api.post('/api/payments/initiate/', {'phone_number': '0712345678', 'amount': '10'})
+        self.assertEqual(response.status_code, 503)
+        self.assertEqual(response.data['status'], 'failed')
+
+
+class MpesaAccessTokenTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.client = mock.Mock(spec=ProviderClient)
+        patcher = mock.patch('payments.services.get_provider_client', return_value=self.client)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def token_response(self, token, expires_in=3599):
+        return mock.Mock(status_code=200, json=lambda: {'access_token': token, 'expires_in': expires_in})
+
+    def test_token_is_shared_between_instances(self):
+        self.client.get.return_value = self.token_response('shared')
+        self.assertEqual(MpesaService().get_access_token(), 'shared')
+        self.assertEqual(MpesaService().get_access_token(), 'shared')
+        self.assertEqual(self.client.get.call_count, 1)
+
+    def test_expiring_token_is_served_while_another_worker_refreshes(self):
+        cache.set(MPESA_TOKEN_CACHE_KEY, {'access_token': 'old', 'expires_at': time.time() + 30})
+        cache.add(MPESA_TOKEN_LOCK_KEY, 1)
+        self.assertEqual(MpesaService().get_access_token(), 'old')
+        self.client.get.assert_not_called()
+
+    def test_waits_for_the_refreshing_worker_without_a_usable_token(self):
+        cache.add(MPESA_TOKEN_LOCK_KEY, 1)
+        refreshed = {'access_token': 'fresh', 'expires_at': time.time() + 3599}
+        # The other worker stores its token while this one sleeps
+        with mock.patch('payments.services.time.sleep', side_effect=lambda _: cache.set(MPESA_TOKEN_CACHE_KEY, refreshed)):
+            self.assertEqual(MpesaService().get_access_token(), 'fresh')
+        self.client.get.assert_not_called()
+
+    def test_rejected_token_is_refreshed_and_the_call_retried_once(self):
+        self.client.get.side_effect = [self.token_response('stale'), self.token_response('fresh')]
+        self.client.post.side_effect = [
+            mock.Mock(status_code=401, json=lambda: {'errorCode': '404.001.03'}),
+            mock.Mock(status_code=200, json=lambda: {'CheckoutRequestID': 'ws_CO_1', 'ResponseCode': '0'}),
+        ]
+        result = MpesaService().initiate_stk_push('254712345678', 10, 'PAY-1', 'Rent')
+        self.assertEqual(result['CheckoutRequestID'], 'ws_CO_1')
+        self.assertEqual(
+            [call.kwargs['headers']['Authorization'] for call in self.client.post.call_args_list],
+            ['Bearer stale', 'Bearer fresh'],
+        )
+        self.assertEqual(cache.get(MPESA_TOKEN_CACHE_KEY)['access_token'], 'fresh')
+
+    def test_second_rejection_is_returned_not_retried(self):
+        self.client.get.side_effect = [self.token_response('a'), self.token_response('b')]
+        self.client.post.return_value = mock.Mock(status_code=401, json=lambda: {'errorCode': '404.001.03'})
+        result = MpesaService().initiate_stk_push('254712345678', 10, 'PAY-1', 'Rent')
+        self.assertEqual(result['errorCode'], '404.001.03')
+        self.assertEqual(self.client.post.call_count, 2)
+
+
+class MetricsEndpointTests(TestCase):
+    def setUp(self):
+        REGISTRY.flush()
+        cache.clear()
+        for metric in REGISTRY.metrics.values():
+            getattr(metric, '_known_series', {}).clear()
+        self.admin = CustomUser.objects.create(username='admin', user_type='admin')
+        self.client = APIClient()
+
+    def scrape(self, user):
+        self.client.force_authenticate(user)
+        return self.client.get('/api/metrics/')
+
+    def test_admin_only(self):
+        staff = CustomUser.objects.create(username='staff', user_type='staff')
+        self.assertEqual(self.scrape(staff).status_code, 403)
+
+    def test_exposes_transitions_and_histograms(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            payment = Payment.objects.create(phone_number='254712345678', amount=100, initiated_by=self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            payment.status = 'success'
+            payment.save()
+        receipt_generation_seconds.observe(0.03)
+
+        response = self.scrape(self.admin)
+        self.assertTrue(response['Content-Type'].startswith('text/plain; version=0.0.4'))
+        body = response.content.decode()
+        self.assertIn(
+            'payment_status_transitions_total{payment_method="mpesa",from_status="pending",to_status="success"} 1', body
+        )
+        self.assertIn('receipt_generation_seconds_bucket{le="0.025"} 0', body)
+        self.assertIn('receipt_generation_seconds_bucket{le="0.05"} 1', body)
+        self.assertIn('receipt_generation_seconds_count 1', body)
+        self.assertIn('payment_callback_inbox_lag{measure="pending"} 0', body)
+
+
+    @override_settings(METRICS_FLUSH_INTERVAL=3600)
+    def test_observations_are_written_in_batches(self):
+        for _ in range(3):
+            receipt_generation_seconds.observe(0.03)
+        count_key = receipt_generation_seconds.key((), 'count')
+        self.assertIsNone(cache.get(count_key))
+        body = self.scrape(self.admin).content.decode()
+        self.assertIn('receipt_generation_seconds_count 3', body)
+        self.assertEqual(cache.get(count_key), 3)
+
+    @override_settings(METRICS_FLUSH_INTERVAL=0.05)
+    def test_idle_process_flushes_without_further_observations(self):
+        # Another worker's buffer: nothing in this process flushes it
+        other = Registry()
+        receipt_generation_seconds._series({})
+        other.add(receipt_generation_seconds.key((), 'count'), 2)
+        deadline = time.monotonic() + 3
+        while cache.get(receipt_generation_seconds.key((), 'count')) is None and time.monotonic() < deadline:
+            time.sleep(0.02)
+        self.assertIn('receipt_generation_seconds_count 2', self.scrape(self.admin).content.decode())
+
+
+@override_settings(REQUEST_PROFILING=True, SLOW_REQUEST_THRESHOLD_MS=0, SLOW_REQUEST_TOP_SQL=1)
+class RequestProfilingTests(TestCase):
+    def test_server_timing_and_slow_request_log(self):
+        admin = CustomUser.objects.create(username='admin', user_type='admin')
+        create_payments(admin, 3)
+        client = APIClient()
+        client.force_authenticate(admin)
+
+        with self.assertLogs('business_portal.profiling', 'WARNING') as logs:
+            response = client.get('/api/payments/list/')
+        self.assertIn('db;dur=', response['Server-Timing'])
+        self.assertIn('desc="1 queries"', response['Server-Timing'])
+        self.assertIn('serialize;dur=', response['Server-Timing'])
+
+        record = logs.records[0]
+        self.assertEqual((record.path, record.db_queries), ('/api/payments/list/', 1))
+        self.assertIn('payments_payment', record.top_sql[0]['sql'])
+
+
+class StructuredLoggingTests(TestCase):
+    def test_json_lines_carry_bound_context(self):
+        record = logging.LogRecord('payments', logging.INFO, __file__, 1, 'Callback %s', ('applied',), None)
+        record.duration_ms = 1.5
+        with log_context(request_id='abc123', payment_reference='ref-1', provider='mpesa'):
+            ContextFilter().filter(record)
+        entry = json.loads(JsonFormatter().format(record))
+        self.assertEqual(entry['message'], 'Callback applied')
+        self.assertEqual(
+            (entry['request_id'], entry['payment_reference'], entry['provider'], entry['duration_ms']),
+            ('abc123', 'ref-1', 'mpesa', 1.5),
+        )
+
+    def test_listener_starts_with_the_first_record(self):
+        stream = StringIO()
+        target = logging.StreamHandler(stream)
+        handler = QueueListenerHandler([target])
+        self.assertIsNone(handler.listener)
+
+        handler.handle(logging.LogRecord('payments', logging.INFO, __file__, 1, 'queued', None, None))
+        handler.stop_listener()
+        self.assertIn('queued', stream.getvalue())
+
+    def test_request_id_is_echoed(self):
+        response = self.client.get('/api/', HTTP_X_REQUEST_ID='req-42')
+        self.assertEqual(response['X-Request-ID'], 'req-42')
+
+
+@override_settings(TRACING_ENABLED=True)
+class TracingTests(TestCase):
+    def setUp(self):
+        cache.clear()
+        self.exporter = InMemorySpanExporter()
+        set_exporter(self.exporter)
+        self.addCleanup(set_exporter, None)
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+
+    def spans(self, name):
+        return [span for span in self.exporter.spans if span.name == name]
+
+    def test_request_continues_incoming_trace(self):
+        trace_id = 'a' * 32
+        response = self.client.get('/api/', HTTP_TRACEPARENT=f'00-{trace_id}-{"b" * 16}-01')
+        self.assertTrue(response['traceresponse'].startswith(f'00-{trace_id}-'))
+        root = self.exporter.spans[-1]
+        self.assertEqual((root.context.trace_id, root.parent_id), (trace_id, 'b' * 16))
+
+    def test_unsampled_trace_is_not_exported(self):
+        response = self.client.get('/api/', HTTP_TRACEPARENT=f'00-{"a" * 32}-{"b" * 16}-00')
+        self.assertTrue(response['traceresponse'].endswith('-00'))
+        self.assertEqual(self.exporter.spans, [])
+
+    def test_file_exporter_writes_off_the_request_thread(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        path = os.path.join(directory.name, 'traces', 'spans.jsonl')
+        exporter = FileSpanExporter(path)
+        set_exporter(exporter)
+        self.client.get('/api/')
+        exporter.handler.stop_listener()
+        with open(path) as trace_file:
+            spans = [json.loads(line) for line in trace_file]
+        self.assertEqual(spans[-1]['name'], 'GET api/')
+
+    def initiate(self):
+        """Push one traced STK request; returns the initiation's trace id"""
+        token = mock.Mock(status_code=200, json=lambda: {'access_token': 't', 'expires_in': 3599})
+        stk = mock.Mock(status_code=200, json=lambda: {'CheckoutRequestID': 'ws_CO_traced', 'ResponseCode': '0'})
+        api = APIClient()
+        api.force_authenticate(self.staff)
+        with mock.patch('requests.Session.request', side_effect=[token, stk]) as send:
+            api.post('/api/payments/initiate/', {'phone_number': '0712345678', 'amount': '10'})
+        self.assertIn('traceparent', send.call_args.kwargs['headers'])
+        return self.spans('PaymentProcessor.process_payment')[0].context.trace_id
+
+    def send_callback(self):
+        body = {'Body': {'stkCallback': {'CheckoutRequestID': 'ws_CO_traced', 'ResultCode': 0}}}
+        self.client.post('/api/payments/mpesa/callback/', json.dumps(body), content_type='application/json')
+
+    def test_callback_settles_in_initiation_trace(self):
+        trace_id = self.initiate()
+        self.assertTrue(self.spans('http mpesa.initiate_stk_push'))
+        self.assertTrue(all(span.context.trace_id == trace_id for span in self.spans('db.query')))
+
+        self.send_callback()
+        settlement = self.spans('PaymentProcessor.apply_result')[0]
+        self.assertEqual(settlement.context.trace_id, trace_id)
+        self.assertIn('settlement.latency_ms', settlement.attributes)
+        self.assertTrue(self.spans('ReceiptGenerator.build_receipt'))
+
+    def test_inbox_settles_in_initiation_trace(self):
+        trace_id = self.initiate()
+        with override_settings(PAYMENT_CALLBACK_INBOX=True):
+            self.send_callback()
+        CallbackInboxDrainer.drain_batch()
+        settlement = self.spans('PaymentProcessor.apply_result')[0]
+        self.assertEqual(settlement.context.trace_id, trace_id)
+        self.assertIn('settlement.latency_ms', settlement.attributes)
+
+
+class SyntheticDataTests(TestCase):
+    def test_generates_payments_receipts_and_rollups(self):
+        generator = SyntheticDataGenerator(status_mix={'success': 3, 'processing': 1}, days=30, batch_size=40, seed=1)
+        users = generator.create_users(5)
+        generator.create_payments(users, 100)
+        generator.finish()
+
+        self.assertEqual(Payment.objects.count(), 100)
+        self.assertEqual(Receipt.objects.count(), Payment.objects.filter(status='success').count())
+        self.assertFalse(Payment.objects.exclude(status__in=['success', 'processing']).exists())
+        # Generated timestamps survive the auto_now fields
+        oldest = Payment.objects.order_by('created_at').first().created_at
+        self.assertLess(oldest, timezone.now() - timedelta(days=1))
+        self.assertEqual(PaymentAnalytics.get_overall_stats()['total_payments'], 100)
+
+    def test_benchmark_reports_percentiles_and_queries(self):
+        generator = SyntheticDataGenerator(seed=2)
+        users = generator.create_users(3)
+        CustomUser.objects.filter(pk=users[0].pk).update(user_type='admin')
+        generator.create_payments(users, 60)
+        generator.finish()
+
+        results = EndpointBenchmark(iterations=3, warmup=1).run()
+        self.assertEqual(results['payment_list']['n'], 3)
+        self.assertLessEqual(results['payment_list']['p50_ms'], results['payment_list']['p99_ms'])
+        self.assertGreater(results['mpesa_callback_unknown']['queries'], 0)
+        self.assertIn('total_collected_busiest_user', results)
+
+
+class ProviderSimulatorTests(TestCase):
+    def setUp(self):
+        self.simulator = ProviderSimulator(
+            '/api/payments/mpesa/callback/', '/api/payments/webhook/', webhook_secret='whsec',
+            duplicate_rate=1.0, result_mix={0: 1}, paystack_success_rate=1.0,
+        )
+        self.addCleanup(self.simulator.dispatcher.stop)
+        self.scheduled = []
+        self.delivered = threading.Semaphore(0)
+
+        # Deliveries are collected here and replayed through the test client
+        def send(url, body, headers=None):
+            self.scheduled.append((url, body, headers or {}))
+            self.delivered.release()
+            return True
+        self.simulator.dispatcher.send = send
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff')
+
+    def deliver(self, count):
+        for _ in range(count):
+            self.assertTrue(self.delivered.acquire(timeout=5))
+        for url, body, headers in self.scheduled:
+            extra = {f"HTTP_{name.upper().replace('-', '_')}": value for name, value in headers.items()}
+            self.assertEqual(self.client.post(url, body, content_type='application/json', **extra).status_code, 200)
+
+    def test_stk_push_is_settled_by_duplicated_callback(self):
+        _, pushed = self.simulator.handle('POST', '/mpesa/stkpush/v1/processrequest', {})
+        payment = Payment.objects.create(
+            phone_number='254712345678', amount=100, status='processing',
+            mpesa_transaction_id=pushed['CheckoutRequestID'], initiated_by=self.staff,
+        )
+        self.deliver(2)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'success')
+        _, status = self.simulator.handle('POST', '/mpesa/stkpushquery/v1/query', {
+            'CheckoutRequestID': pushed['CheckoutRequestID'],
+        })
+        self.assertEqual(status['ResultCode'], '0')
+
+    def test_pending_callbacks_wait_on_the_dispatcher_heap(self):
+        simulator = ProviderSimulator('/cb/', '/wh/', callback_delay=LatencyModel(60000), workers=1)
+        self.addCleanup(simulator.dispatcher.stop)
+        threads = threading.active_count()
+        pushes = [simulator.handle('POST', '/mpesa/stkpush/v1/processrequest', {})[1] for _ in range(5)]
+        self.assertEqual(threading.active_count(), threads)
+        self.assertEqual(len(simulator.dispatcher.queue), 5)
+        # Not settled until its callback is due
+        status, _ = simulator.handle('POST', '/mpesa/stkpushquery/v1/query', {
+            'CheckoutRequestID': pushes[0]['CheckoutRequestID'],
+        })
+        self.assertEqual(status, 500)
+
+    @override_settings(PAYSTACK_WEBHOOK_SECRET='whsec')
+    def test_paystack_webhook_is_signed(self):
+        payment = Payment.objects.create(
+            phone_number='254712345678', amount=100, status='processing', payment_method='paystack',
+            paystack_reference='ref-sim', initiated_by=self.staff,
+        )
+        self.simulator.handle('POST', '/transaction/initialize', {'reference': 'ref-sim', 'amount': 10000})
+        self.deliver(2)
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'success')
+        _, verified = self.simulator.handle('GET', '/transaction/verify/ref-sim', {})
+        self.assertEqual(verified['data']['status'], 'success')
@@ -3,13 +3,16 @@ from . import views
 
 urlpatterns = [
     path('initiate/', views.PaymentInitiateView.as_view(), name='payment-initiate'),
+    path('initiate/batch/', views.BatchPaymentInitiateView.as_view(), name='payment-initiate-batch'),
     path('status/<str:reference_id>/', views.PaymentStatusView.as_view(), name='payment-status'),
     path('list/', views.PaymentListView.as_view(), name='payment-list'),
+    path('export/', views.export_payments, name='payment-export'),
     path('verify/<str:reference_id>/', views.verify_payment, name='payment-verify'),
     path('mpesa/callback/', views.mpesa_callback, name='mpesa-callback'),
     path('webhook/', views.paystack_webhook, name='paystack-webhook'),
     path('analytics/daily/', views.daily_summary, name='daily-summary'),
     path('analytics/user/', views.user_summary, name='user-summary'),
     path('analytics/stats/', views.overall_stats, name='overall-stats'),
+    path('analytics/cache/', views.analytics_cache_stats, name='analytics-cache-stats'),
     path('total/', views.get_total_collected, name='total_collected'),
 ]
\ No newline at end of file
@@ -1,26 +1,67 @@
+from datetime import date
 from rest_framework import generics, status
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated, AllowAny
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import HttpResponse, StreamingHttpResponse
 from django.views.decorators.csrf import csrf_exempt
 from django.views.decorators.cache import never_cache
 from django.conf import settings
-from .models import Payment
-from .serializers import PaymentSerializer
+from django.db import transaction
+from business_portal.metrics import callback_processing_seconds
+from business_portal.pagination import PaymentCursorPagination
+from business_portal.throttling import (
+    AllOrNothingThrottleMixin, UserPaymentThrottle, PhonePaymentThrottle, TillPaymentThrottle,
+)
+from .models import CallbackInbox, Payment, PaymentJob, ProcessedEvent
+from .serializers import PaymentSerializer, PaymentListSerializer, BatchPaymentInitiateSerializer
 from .services import PaymentProcessor, PaystackService
+from .exports import PaymentExporter
 import json
-from django.db.models import Sum
+import logging
+from django.db.models import Q, Sum
 
-class PaymentInitiateView(generics.CreateAPIView):
+logger = logging.getLogger(__name__)
+
+def filter_payments(payments, params):
+    """Apply the list / export query filters; raises ValueError on a malformed date or id"""
+    if params.get('start_date'):
+        payments = payments.filter(created_at__date__gte=date.fromisoformat(params['start_date']))
+    if params.get('end_date'):
+        payments = payments.filter(created_at__date__lte=date.fromisoformat(params['end_date']))
+    if params.get('initiated_by'):
+        payments = payments.filter(initiated_by_id=int(params['initiated_by']))
+    if params.get('status'):
+        payments = payments.filter(status=params['status'])
+    if params.get('payment_method'):
+        payments = payments.filter(payment_method=params['payment_method'])
+    if params.get('search'):
+        term = params['search'].strip()
+        payments = payments.filter(
+            Q(reference_id__icontains=term) | Q(phone_number__icontains=term) | Q(description__icontains=term)
+        )
+    return payments
+
+class PaymentInitiateView(AllOrNothingThrottleMixin, generics.CreateAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
     permission_classes = [IsAuthenticated]
+    throttle_classes = [UserPaymentThrottle, PhonePaymentThrottle, TillPaymentThrottle]
 
     def create(self, request, *args, **kwargs):
         serializer = self.get_serializer(data=request.data)
         serializer.is_valid(raise_exception=True)
+
+        # Async mode: queue the STK push for a payment worker; the frontend
+        # already polls PaymentStatusView for the outcome
+        if settings.PAYMENT_ASYNC_INITIATION and serializer.validated_data.get('payment_method', 'mpesa') == 'mpesa':
+            with transaction.atomic():
+                payment = serializer.save(initiated_by=request.user)
+                PaymentJob.objects.create(payment=payment)
+            return Response(self.get_serializer(payment).data, status=status.HTTP_202_ACCEPTED)
+
         payment = serializer.save(initiated_by=request.user)
         
         # Process the payment
@@ -34,8 +75,52 @@ class PaymentInitiateView(generics.CreateAPIView):
         
         # Return the updated payment data
         response_serializer = self.get_serializer(processed_payment)
+        if processed_payment.response_data.get('provider_unavailable'):
+            return Response(response_serializer.data, status=status.HTTP_503_SERVICE_UNAVAILABLE)
         return Response(response_serializer.data, status=status.HTTP_201_CREATED)
 
+class BatchPaymentInitiateView(AllOrNothingThrottleMixin, generics.GenericAPIView):
+    """Request M-Pesa payments from many customers in one call"""
+    serializer_class = BatchPaymentInitiateSerializer
+    permission_classes = [IsAuthenticated]
+    throttle_classes = [UserPaymentThrottle, PhonePaymentThrottle, TillPaymentThrottle]
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+
+        payments = Payment.bulk_create_with_signals([
+            Payment(
+                phone_number=item['phone_number'],
+                amount=item['amount'],
+                description=item.get('description'),
+                payment_method='mpesa',
+                initiated_by=request.user,
+            )
+            for item in serializer.validated_data['items']
+        ])
+
+        if settings.PAYMENT_ASYNC_INITIATION:
+            PaymentJob.objects.bulk_create([PaymentJob(payment=payment) for payment in payments])
+            response_status = status.HTTP_202_ACCEPTED
+        else:
+            # STK pushes fan out concurrently; the batch takes about as long as its slowest calls
+            payments = PaymentProcessor.process_batch(payments)
+            response_status = status.HTTP_201_CREATED
+
+        results = [
+            {
+                'index': index,
+                'reference_id': payment.reference_id,
+                'phone_number': payment.phone_number,
+                'amount': payment.amount,
+                'status': payment.status,
+                'error': payment.response_data.get('error') or payment.response_data.get('errorMessage'),
+            }
+            for index, payment in enumerate(payments)
+        ]
+        return Response({'results': results}, status=response_status)
+
 class PaymentStatusView(generics.RetrieveAPIView):
     queryset = Payment.objects.all()
     serializer_class = PaymentSerializer
@@ -44,18 +129,54 @@ class PaymentStatusView(generics.RetrieveAPIView):
 
 class PaymentListView(generics.ListAPIView):
     queryset = Payment.objects.all()
-    serializer_class = PaymentSerializer
+    serializer_class = PaymentListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = PaymentCursorPagination
 
     def get_queryset(self):
         user = self.request.user
-        if user.user_type == 'admin':
-            return Payment.objects.all().order_by('-created_at')
-        elif user.user_type == 'staff':
-            return Payment.objects.filter(initiated_by=user).order_by('-created_at')
-        elif user.user_type == 'auditor':
-            return Payment.objects.all().order_by('-created_at')  # Auditors can see all but not modify
-        return Payment.objects.none()
+        # Only load the listed columns; response_data can be a large provider payload
+        payments = Payment.objects.only(*PaymentListSerializer.Meta.fields)
+        # Admins and auditors see every payment (auditors cannot modify them)
+        if user.user_type == 'staff':
+            payments = payments.filter(initiated_by=user)
+        elif user.user_type not in ('admin', 'auditor'):
+            return Payment.objects.none()
+        # Filters run in the database so they cover every page, not just the loaded ones
+        try:
+            payments = filter_payments(payments, self.request.query_params)
+        except ValueError:
+            raise ValidationError({'error': 'Use YYYY-MM-DD dates and a numeric initiated_by'})
+        return payments.order_by('-created_at')
+
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_payments(request):
+    """Stream payment history as CSV or NDJSON"""
+    export_format = request.GET.get('export_format', 'csv')
+    if export_format not in PaymentExporter.CONTENT_TYPES:
+        return Response({'error': 'export_format must be csv or ndjson'}, status=status.HTTP_400_BAD_REQUEST)
+
+    user = request.user
+    if user.user_type in ('admin', 'auditor'):
+        payments = Payment.objects.all()
+    elif user.user_type == 'staff':
+        payments = Payment.objects.filter(initiated_by=user)
+    else:
+        payments = Payment.objects.none()
+
+    try:
+        payments = filter_payments(payments, request.GET)
+    except ValueError:
+        return Response({'error': 'Use YYYY-MM-DD dates and a numeric initiated_by'},
+                        status=status.HTTP_400_BAD_REQUEST)
+
+    response = StreamingHttpResponse(
+        PaymentExporter.iter_export(payments.order_by('created_at', 'id'), export_format),
+        content_type=PaymentExporter.CONTENT_TYPES[export_format],
+    )
+    response['Content-Disposition'] = f'attachment; filename="payments.{export_format}"'
+    return response
 
 @api_view(['POST'])
 @permission_classes([IsAuthenticated])
@@ -68,24 +189,9 @@ def verify_payment(request, reference_id):
         result = paystack_service.verify_transaction(payment.paystack_reference)
         
         if result.get('status'):
-            status_map = {
-                'failed': 'failed',
-                'success': 'success',
-                'cancelled': 'cancelled'
-            }
-            
-            paystack_status = result['data']['status']
-            payment.status = status_map.get(paystack_status, 'failed')
-            payment.response_data = result
-            payment.save()
-            
-            # Generate receipt if payment is successful
-            if payment.status == 'success':
-                from receipts.models import Receipt
-                receipt_exists = Receipt.objects.filter(payment=payment).exists()
-                if not receipt_exists:
-                    from receipts.services import ReceiptGenerator
-                    ReceiptGenerator.generate_receipt(payment)
+            PaymentProcessor.apply_result(
+                payment, PaymentProcessor.paystack_result_status(result['data']['status']), result
+            )
         
         return Response({
             'status': payment.status,
@@ -97,6 +203,7 @@ def verify_payment(request, reference_id):
 
 # ✅ FIXED: Properly handle M-Pesa callback with CSRF exemption and raw JSON parsing
 @csrf_exempt
+@callback_processing_seconds.time(provider='mpesa')
 def mpesa_callback(request):
     """
     Handle M-Pesa STK Push callback from Safaricom.
@@ -105,6 +212,11 @@ def mpesa_callback(request):
     if request.method != 'POST':
         return HttpResponse("Method not allowed", status=405)
 
+    # Inbox mode: store the raw body and acknowledge; drain_callback_inbox applies it
+    if settings.PAYMENT_CALLBACK_INBOX:
+        CallbackInbox.objects.create(provider='mpesa', body=request.body.decode('utf-8', 'replace'))
+        return HttpResponse("OK", status=200)
+
     try:
         callback_data = json.loads(request.body)
 
@@ -113,38 +225,38 @@ def mpesa_callback(request):
         result_code = stk_callback.get('ResultCode')
 
         if checkout_request_id:
-            payment = Payment.objects.filter(mpesa_transaction_id=checkout_request_id).first()
-            if payment:
-                if result_code == 0:
-                    payment.status = 'success'
-                elif result_code == 1032:
-                    payment.status = 'cancelled'
-                elif result_code == 1037:
-                    payment.status = 'timeout'
-                else:
-                    payment.status = 'failed'
+            with transaction.atomic():
+                # Safaricom retries stop here: one insert, no payment read or write
+                if not ProcessedEvent.record('mpesa', f"{checkout_request_id}:{result_code}"):
+                    logger.debug("Duplicate M-Pesa callback", extra={'provider': 'mpesa'})
+                    return HttpResponse("OK", status=200)
 
-                payment.response_data = callback_data
-                payment.save()
-
-                if payment.status == 'success':
-                    from receipts.models import Receipt
-                    if not Receipt.objects.filter(payment=payment).exists():
-                        from receipts.services import ReceiptGenerator
-                        ReceiptGenerator.generate_receipt(payment)
+                payment = Payment.objects.select_for_update().filter(mpesa_transaction_id=checkout_request_id).first()
+                if payment:
+                    PaymentProcessor.apply_result(
+                        payment, PaymentProcessor.mpesa_result_status(result_code), callback_data
+                    )
+                    logger.info("M-Pesa callback applied", extra={
+                        'provider': 'mpesa', 'payment_reference': payment.reference_id, 'status': payment.status,
+                    })
+                else:
+                    # Unknown so far; leave the event unrecorded so a retry can still apply it
+                    transaction.set_rollback(True)
+                    logger.warning("M-Pesa callback for unknown payment", extra={'provider': 'mpesa'})
 
         return HttpResponse("OK", status=200)
 
     except json.JSONDecodeError:
-        print("M-Pesa Callback Error: Invalid JSON")
+        logger.warning("M-Pesa callback with invalid JSON", extra={'provider': 'mpesa'})
         return HttpResponse("Invalid JSON", status=400)
-    except Exception as e:
-        print(f"M-Pesa Callback Error: {str(e)}")
+    except Exception:
+        logger.exception("M-Pesa callback failed", extra={'provider': 'mpesa'})
         return HttpResponse("Internal Error", status=500)
 
 @csrf_exempt
 @api_view(['POST'])
 @permission_classes([AllowAny])
+@callback_processing_seconds.time(provider='paystack')
 def paystack_webhook(request):
     """Handle Paystack webhook"""
     if request.method == 'POST':
@@ -163,51 +275,53 @@ def paystack_webhook(request):
             ).hexdigest()
             
             if hmac.compare_digest(signature, expected_signature):
+                if settings.PAYMENT_CALLBACK_INBOX:
+                    CallbackInbox.objects.create(
+                        provider='paystack', body=request._request.body.decode('utf-8', 'replace')
+                    )
+                    return HttpResponse(status=200)
+
                 # Process the webhook
                 payload = json.loads(request._request.body)
                 event = payload.get('event')
                 
-                if event == 'charge.success':
-                    reference = payload['data']['reference']
-                    # Find payment by reference
-                    payment = Payment.objects.filter(paystack_reference=reference).first()
-                    
-                    if payment:
-                        payment.status = 'success'
-                        payment.response_data = payload
-                        payment.save()
-                        
-                        # Generate receipt if payment is successful
-                        from receipts.models import Receipt
-                        receipt_exists = Receipt.objects.filter(payment=payment).exists()
-                        if not receipt_exists:
-                            from receipts.services import ReceiptGenerator
-                            ReceiptGenerator.generate_receipt(payment)
-                
-                elif event == 'charge.failed':
+                if event in ('charge.success', 'charge.failed'):
                     reference = payload['data']['reference']
-                    payment = Payment.objects.filter(paystack_reference=reference).first()
-                    
-                    if payment:
-                        payment.status = 'failed'
-                        payment.response_data = payload
-                        payment.save()
+                    with transaction.atomic():
+                        # Paystack retries stop here: one insert, no payment read or write
+                        if ProcessedEvent.record('paystack', f"{reference}:{event}"):
+                            # Find payment by reference
+                            payment = Payment.objects.select_for_update().filter(paystack_reference=reference).first()
+
+                            if payment:
+                                new_status = 'success' if event == 'charge.success' else 'failed'
+                                PaymentProcessor.apply_result(payment, new_status, payload)
+                                logger.info("Paystack webhook applied", extra={
+                                    'provider': 'paystack', 'payment_reference': payment.reference_id,
+                                    'status': payment.status,
+                                })
+                            else:
+                                transaction.set_rollback(True)
         
         return HttpResponse(status=200)
     
     return HttpResponse(status=400)
 
 # Analytics views
-from .analytics import PaymentAnalytics
+from business_portal.permissions import IsAdmin
+from .analytics import CachedPaymentAnalytics
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def daily_summary(request):
     """Get daily payment summary"""
-    start_date = request.GET.get('start_date')
-    end_date = request.GET.get('end_date')
+    try:
+        start_date = date.fromisoformat(request.GET['start_date']) if request.GET.get('start_date') else None
+        end_date = date.fromisoformat(request.GET['end_date']) if request.GET.get('end_date') else None
+    except ValueError:
+        return Response({'error': 'Dates must be in YYYY-MM-DD format'}, status=status.HTTP_400_BAD_REQUEST)
     
-    summary = PaymentAnalytics.get_daily_summary(start_date, end_date)
+    summary = CachedPaymentAnalytics.get_daily_summary(start_date, end_date)
     return Response(summary)
 
 @api_view(['GET'])
@@ -215,16 +329,22 @@ def daily_summary(request):
 def user_summary(request):
     """Get payment summary by user"""
     user_type = request.GET.get('user_type')
-    summary = PaymentAnalytics.get_user_summary(user_type)
+    summary = CachedPaymentAnalytics.get_user_summary(user_type)
     return Response(summary)
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def overall_stats(request):
     """Get overall payment statistics"""
-    stats = PaymentAnalytics.get_overall_stats()
+    stats = CachedPaymentAnalytics.get_overall_stats()
     return Response(stats)
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated, IsAdmin])
+def analytics_cache_stats(request):
+    """Hit/miss counters of the analytics response cache"""
+    return Response(CachedPaymentAnalytics.get_cache_stats())
+
 
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
@@ -0,0 +1,20 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:50
+
+from django.db import migrations, models
+from business_portal.migration_operations import AddIndexConcurrently
+
+
+class Migration(migrations.Migration):
+    # CREATE INDEX CONCURRENTLY cannot run inside a transaction
+    atomic = False
+
+    dependencies = [
+        ('receipts', '0001_initial'),
+    ]
+
+    operations = [
+        AddIndexConcurrently(
+            model_name='receipt',
+            index=models.Index(fields=['-generated_at', 'id'], name='receipt_generated_id_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.7 on 2026-10-18 05:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('receipts', '0002_receipt_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='receipt',
+            name='rendered_html',
+            field=models.TextField(blank=True, editable=False, null=True),
+        ),
+    ]
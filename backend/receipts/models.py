@@ -9,13 +9,24 @@ class Receipt(models.Model):
     staff_member = models.ForeignKey(CustomUser, on_delete=models.SET_NULL, null=True, related_name='receipts')
     generated_at = models.DateTimeField(auto_now_add=True)
     receipt_data = models.JSONField()  # Store receipt details
+    rendered_html = models.TextField(blank=True, null=True, editable=False)  # Exported document
+
+    class Meta:
+        indexes = [
+            # Keyset pagination of ReceiptListView
+            models.Index(fields=['-generated_at', 'id'], name='receipt_generated_id_idx'),
+        ]
     
     def __str__(self):
         return f"Receipt {self.receipt_number} for Payment {self.payment.reference_id}"
     
+    @staticmethod
+    def generate_receipt_number():
+        import uuid
+        from datetime import datetime
+        return f"RCP_{datetime.now().strftime('%Y%m%d')}_{str(uuid.uuid4())[:8].upper()}"
+
     def save(self, *args, **kwargs):
         if not self.receipt_number:
-            import uuid
-            from datetime import datetime
-            self.receipt_number = f"RCP_{datetime.now().strftime('%Y%m%d')}_{str(uuid.uuid4())[:8].upper()}"
+            self.receipt_number = self.generate_receipt_number()
         super().save(*args, **kwargs)
\ No newline at end of file
@@ -1,11 +1,23 @@
 from rest_framework import serializers
 from .models import Receipt
-from payments.serializers import PaymentSerializer
+from payments.serializers import PaymentSerializer, PaymentListSerializer
+from accounts.serializers import UserSummarySerializer
 
 class ReceiptSerializer(serializers.ModelSerializer):
     payment = PaymentSerializer(read_only=True)
     
     class Meta:
         model = Receipt
-        fields = '__all__'
-        read_only_fields = ('receipt_number', 'generated_at')
\ No newline at end of file
+        exclude = ('rendered_html',)
+        read_only_fields = ('receipt_number', 'generated_at')
+
+
+class ReceiptListSerializer(serializers.ModelSerializer):
+    """Receipt listing with the slim payment and staff member the UI shows"""
+    payment = PaymentListSerializer(read_only=True)
+    staff_member = UserSummarySerializer(read_only=True)
+
+    class Meta:
+        model = Receipt
+        fields = ('id', 'receipt_number', 'serial_number', 'generated_at', 'payment', 'staff_member')
+        read_only_fields = fields
@@ -1,17 +1,44 @@
 # receipts/services.py
 import uuid
+import zipfile
 from datetime import datetime
 from django.template.loader import render_to_string
 from django.conf import settings
+from business_portal.metrics import receipt_generation_seconds
+from business_portal.tracing import traced
 from .models import Receipt
 from payments.models import Payment
 
+class _ZipStream:
+    """Write-only, non-seekable sink that lets zipfile output be streamed chunk by chunk"""
+
+    def __init__(self):
+        self._chunks = []
+        self._offset = 0
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        self._offset += len(data)
+        return len(data)
+
+    def tell(self):
+        return self._offset
+
+    def flush(self):
+        pass
+
+    def pop(self):
+        data = b''.join(self._chunks)
+        self._chunks = []
+        return data
+
+
 class ReceiptGenerator:
     @staticmethod
-    def generate_receipt(payment):
-        """Generate a receipt for a successful payment"""
-        from accounts.models import CustomUser
-        
+    @traced('ReceiptGenerator.build_receipt')
+    @receipt_generation_seconds.time()
+    def build_receipt(payment):
+        """Compile and render an unsaved receipt for a successful payment"""
         # Create receipt data
         receipt_data = {
             'transaction_time': payment.created_at.strftime('%Y-%m-%d %H:%M:%S'),
@@ -28,15 +55,34 @@ class ReceiptGenerator:
             'business_contact': '0728722746',  # Your contact
         }
         
-        # Create the receipt
-        receipt = Receipt.objects.create(
+        # Rendered once at issuance since its data never changes
+        receipt = Receipt(
             payment=payment,
+            receipt_number=Receipt.generate_receipt_number(),
             staff_member=payment.initiated_by,
             serial_number=receipt_data['serial_number'],
             receipt_data=receipt_data
         )
-        
+        receipt.rendered_html = ReceiptGenerator.render_receipt_html(receipt)
         return receipt
+
+    @staticmethod
+    def generate_receipt(payment):
+        """Generate a receipt for a successful payment"""
+        receipt = ReceiptGenerator.build_receipt(payment)
+        receipt.save()
+        return receipt
+
+    @staticmethod
+    def generate_receipts(payments):
+        """Issue receipts for many successful payments with one INSERT, skipping those that have one"""
+        payment_ids = [payment.pk for payment in payments]
+        issued = set(Receipt.objects.filter(payment_id__in=payment_ids).values_list('payment_id', flat=True))
+        receipts = [
+            ReceiptGenerator.build_receipt(payment) for payment in payments if payment.pk not in issued
+        ]
+        # A receipt issued concurrently (e.g. by the reconciler) is skipped rather than failing the INSERT
+        return Receipt.objects.bulk_create(receipts, ignore_conflicts=True)
     
     @staticmethod
     def mask_phone_number(phone_number):
@@ -45,83 +91,40 @@ class ReceiptGenerator:
             return phone_number[:-4] + '****'
         return phone_number
     
+    @staticmethod
+    def render_receipt_html(receipt):
+        """Render the receipt document from the compiled receipt template"""
+        return render_to_string('receipts/receipt.html', {
+            'receipt': receipt,
+            'data': receipt.receipt_data,
+        })
+
     @staticmethod
     def generate_receipt_html(receipt):
-        """Generate HTML for receipt"""
-        receipt_data = receipt.receipt_data
-        
-        html_content = f"""
-        <!DOCTYPE html>
-        <html>
-        <head>
-            <title>Payment Receipt - {receipt.receipt_number}</title>
-            <style>
-                body {{ font-family: Arial, sans-serif; max-width: 600px; margin: 0 auto; padding: 20px; }}
-                .receipt-header {{ text-align: center; border-bottom: 2px solid #4a7c59; padding-bottom: 15px; margin-bottom: 20px; }}
-                .receipt-title {{ color: #4a7c59; font-size: 24px; font-weight: bold; }}
-                .receipt-details {{ margin: 15px 0; }}
-                .detail-row {{ display: flex; justify-content: space-between; margin: 5px 0; }}
-                .detail-label {{ font-weight: bold; color: #333; }}
-                .detail-value {{ color: #666; }}
-                .amount {{ font-size: 20px; font-weight: bold; color: #4a7c59; text-align: center; margin: 20px 0; }}
-                .footer {{ text-align: center; margin-top: 30px; padding-top: 15px; border-top: 1px solid #ddd; font-size: 12px; color: #666; }}
-            </style>
-        </head>
-        <body>
-            <div class="receipt-header">
-                <div class="receipt-title">PAYMENT RECEIPT</div>
-                <div>Receipt #{receipt.receipt_number}</div>
-            </div>
-            
-            <div class="receipt-details">
-                <div class="detail-row">
-                    <span class="detail-label">Serial Number:</span>
-                    <span class="detail-value">{receipt_data['serial_number']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Transaction Time:</span>
-                    <span class="detail-value">{receipt_data['transaction_time']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Phone Number:</span>
-                    <span class="detail-value">{receipt_data['masked_phone_number']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Amount:</span>
-                    <span class="detail-value">KSH {receipt_data['amount']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Description:</span>
-                    <span class="detail-value">{receipt_data['description']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Payment Method:</span>
-                    <span class="detail-value">{receipt_data['payment_method']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Status:</span>
-                    <span class="detail-value">{receipt_data['status']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Initiated By:</span>
-                    <span class="detail-value">{receipt_data['initiated_by']}</span>
-                </div>
-                <div class="detail-row">
-                    <span class="detail-label">Reference ID:</span>
-                    <span class="detail-value">{receipt_data['reference_id']}</span>
-                </div>
-            </div>
-            
-            <div class="amount">KSH {receipt_data['amount']}</div>
-            
-            <div class="footer">
-                <div>{receipt_data['business_name']}</div>
-                <div>{receipt_data['business_address']}</div>
-                <div>Contact: {receipt_data['business_contact']}</div>
-                <div>All rights reserved</div>
-            </div>
-        </body>
-        </html>
+        """Get the HTML for a receipt, rendering and storing it on first use"""
+        if not receipt.rendered_html:
+            receipt.rendered_html = ReceiptGenerator.render_receipt_html(receipt)
+            receipt.save(update_fields=['rendered_html'])
+        return receipt.rendered_html
+
+    @staticmethod
+    def iter_receipts_zip(receipts):
+        """Yield a ZIP archive of receipt documents as it is being written.
+
+        Each receipt is rendered and compressed as it is read from `receipts`
+        (ideally a chunked .iterator()), so neither the result set nor the
+        archive is ever held in memory as a whole.
         """
-        
-        return html_content
+        stream = _ZipStream()
+        with zipfile.ZipFile(stream, 'w', compression=zipfile.ZIP_DEFLATED) as archive:
+            for receipt in receipts:
+                html = receipt.rendered_html or ReceiptGenerator.render_receipt_html(receipt)
+                entry = zipfile.ZipInfo(
+                    f"receipt_{receipt.receipt_number}.html",
+                    date_time=receipt.generated_at.timetuple()[:6],
+                )
+                entry.compress_type = zipfile.ZIP_DEFLATED
+                archive.writestr(entry, html)
+                yield stream.pop()
+        # Central directory
+        yield stream.pop()
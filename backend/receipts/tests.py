@@ -1,3 +1,108 @@
+import io
+import zipfile
 from django.test import TestCase
+from rest_framework.test import APIClient
+from accounts.models import CustomUser
+from payments.models import Payment
+from payments.tests import create_payments
+from .models import Receipt
+from .services import ReceiptGenerator
 
-# Create your tests here.
+
+class ReceiptListQueryCountTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff', first_name='Jane')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+
+    def create_receipts(self, count):
+        for i, payment in enumerate(create_payments(self.staff, count, status='success')):
+            Receipt.objects.create(
+                payment=payment, staff_member=self.staff,
+                serial_number=f"SER-{i}", receipt_data={'amount': '100.00'},
+            )
+
+    def test_list_is_one_query_regardless_of_page_size(self):
+        self.create_receipts(40)
+        for page_size, expected_rows in ((5, 5), (40, 40)):
+            with self.assertNumQueries(1):
+                response = self.client.get('/api/receipts/', {'page_size': page_size})
+            self.assertEqual(len(response.data['results']), expected_rows)
+
+    def test_list_nests_slim_payment_and_staff_member(self):
+        self.create_receipts(1)
+        receipt = self.client.get('/api/receipts/').data['results'][0]
+        self.assertEqual(receipt['staff_member']['first_name'], 'Jane')
+        self.assertEqual(receipt['payment']['status'], 'success')
+        self.assertNotIn('response_data', receipt['payment'])
+        self.assertNotIn('receipt_data', receipt)
+
+
+    def test_filters_run_in_the_database(self):
+        self.create_receipts(3)
+        Payment.objects.filter(reference_id='staff-1').update(status='failed')
+        response = self.client.get('/api/receipts/', {'status': 'failed', 'page_size': 1})
+        self.assertEqual([r['payment']['reference_id'] for r in response.data['results']], ['staff-1'])
+        self.assertIsNone(response.data['next'])
+        self.assertEqual(len(self.client.get('/api/receipts/', {'search': 'staff-2'}).data['results']), 1)
+
+class ReceiptExportTests(TestCase):
+    def setUp(self):
+        self.staff = CustomUser.objects.create(username='staff', user_type='staff', first_name='Jane')
+        self.client = APIClient()
+        self.client.force_authenticate(self.staff)
+        [payment] = create_payments(self.staff, 1, status='success', description='<b>Rent</b>')
+        self.receipt = ReceiptGenerator.generate_receipt(payment)
+
+    def test_receipt_is_rendered_once_at_issuance(self):
+        self.assertIn(self.receipt.receipt_number, self.receipt.rendered_html)
+        self.assertIn('&lt;b&gt;Rent&lt;/b&gt;', self.receipt.rendered_html)
+
+    def test_export_sends_validators_and_answers_304(self):
+        url = f'/api/receipts/export/{self.receipt.pk}/'
+        response = self.client.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.content.decode(), self.receipt.rendered_html)
+        self.assertIn('immutable', response['Cache-Control'])
+        self.assertIn('Last-Modified', response)
+
+        with self.assertNumQueries(1):
+            response = self.client.get(url, HTTP_IF_NONE_MATCH=response['ETag'])
+        self.assertEqual(response.status_code, 304)
+        self.assertEqual(response.content, b'')
+
+    def test_bulk_export_streams_a_zip_of_receipts(self):
+        payment = Payment.objects.create(
+            phone_number='254712345678', amount=50, status='success', initiated_by=self.staff
+        )
+        second = ReceiptGenerator.generate_receipt(payment)
+        Receipt.objects.filter(pk=second.pk).update(rendered_html=None)
+
+        response = self.client.get('/api/receipts/export/bulk/', {'staff': self.staff.pk})
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(
+            sorted(archive.namelist()),
+            sorted(f"receipt_{r.receipt_number}.html" for r in (self.receipt, second)),
+        )
+        self.assertIn(second.receipt_number, archive.read(f"receipt_{second.receipt_number}.html").decode())
+
+    def test_bulk_export_requires_a_filter(self):
+        admin = CustomUser.objects.create(username='admin', user_type='admin')
+        self.client.force_authenticate(admin)
+        self.assertEqual(self.client.get('/api/receipts/export/bulk/').status_code, 400)
+
+    def test_staff_cannot_export_other_staff_receipts(self):
+        other = CustomUser.objects.create(username='other', user_type='staff')
+        [payment] = create_payments(other, 1, status='success')
+        theirs = ReceiptGenerator.generate_receipt(payment)
+
+        response = self.client.get('/api/receipts/export/bulk/', {'staff': other.pk})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f"receipt_{self.receipt.receipt_number}.html"])
+
+        auditor = CustomUser.objects.create(username='auditor', user_type='auditor')
+        self.client.force_authenticate(auditor)
+        response = self.client.get('/api/receipts/export/bulk/', {'staff': other.pk})
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(archive.namelist(), [f"receipt_{theirs.receipt_number}.html"])
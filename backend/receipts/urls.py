@@ -7,5 +7,6 @@ urlpatterns = [
     path('<int:pk>/', views.ReceiptDetailView.as_view(), name='receipt-detail'),
     path('generate/<int:payment_id>/', views.ReceiptGenerateView.as_view(), name='receipt-generate'),
     path('export/<int:pk>/', views.ReceiptExportView.as_view(), name='receipt-export'),
+    path('export/bulk/', views.export_receipts_zip, name='receipt-export-bulk'),
     path('payment/<str:payment_reference_id>/', views.get_receipt_by_payment, name='receipt-by-payment'),
 ]
\ No newline at end of file
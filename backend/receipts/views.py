@@ -1,22 +1,57 @@
 # receipts/views.py
+from datetime import date
 from rest_framework import generics
 from rest_framework.response import Response
 from rest_framework.decorators import api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.permissions import IsAuthenticated
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.conf import settings
+from django.db.models import Q
+from django.http import HttpResponse, StreamingHttpResponse
+from django.utils.cache import get_conditional_response
+from django.utils.http import http_date, quote_etag
 from .models import Receipt
-from .serializers import ReceiptSerializer
+from .serializers import ReceiptSerializer, ReceiptListSerializer
+from accounts.serializers import UserSummarySerializer
+from payments.serializers import PaymentListSerializer
 from payments.models import Payment
 from .services import ReceiptGenerator
+from business_portal.pagination import ReceiptCursorPagination
 
 class ReceiptListView(generics.ListAPIView):
-    queryset = Receipt.objects.all().select_related('payment', 'staff_member').order_by('-generated_at')
-    serializer_class = ReceiptSerializer
+    queryset = Receipt.objects.all().select_related('payment', 'staff_member').only(
+        'id', 'receipt_number', 'serial_number', 'generated_at', 'payment', 'staff_member',
+        *(f'payment__{field}' for field in PaymentListSerializer.Meta.fields),
+        *(f'staff_member__{field}' for field in UserSummarySerializer.Meta.fields),
+    ).order_by('-generated_at')
+    serializer_class = ReceiptListSerializer
     permission_classes = [IsAuthenticated]
+    pagination_class = ReceiptCursorPagination
+
+    def get_queryset(self):
+        # Filters run in the database so they cover every page, not just the loaded ones
+        receipts = super().get_queryset()
+        params = self.request.query_params
+        try:
+            if params.get('start_date'):
+                receipts = receipts.filter(generated_at__date__gte=date.fromisoformat(params['start_date']))
+            if params.get('end_date'):
+                receipts = receipts.filter(generated_at__date__lte=date.fromisoformat(params['end_date']))
+        except ValueError:
+            raise ValidationError({'error': 'Use YYYY-MM-DD dates'})
+        if params.get('status'):
+            receipts = receipts.filter(payment__status=params['status'])
+        if params.get('search'):
+            term = params['search'].strip()
+            receipts = receipts.filter(
+                Q(receipt_number__icontains=term) | Q(payment__reference_id__icontains=term) |
+                Q(payment__phone_number__icontains=term) | Q(staff_member__username__icontains=term)
+            )
+        return receipts
 
 class ReceiptDetailView(generics.RetrieveAPIView):
-    queryset = Receipt.objects.all().select_related('payment', 'staff_member')
+    queryset = Receipt.objects.all().select_related('payment', 'staff_member').defer('rendered_html')
     serializer_class = ReceiptSerializer
     permission_classes = [IsAuthenticated]
 
@@ -53,20 +88,68 @@ class ReceiptGenerateView(generics.CreateAPIView):
         return Response(serializer.data, status=201)
 
 class ReceiptExportView(generics.RetrieveAPIView):
-    queryset = Receipt.objects.all()
+    # The document is only loaded when the client does not already have it
+    queryset = Receipt.objects.only('id', 'receipt_number', 'generated_at')
     permission_classes = [IsAuthenticated]
 
     def retrieve(self, request, *args, **kwargs):
         receipt = self.get_object()
-        
-        # Get the HTML content
-        html_content = ReceiptGenerator.generate_receipt_html(receipt)
-        
-        # Return as HTML response
-        response = HttpResponse(html_content, content_type='text/html')
-        response['Content-Disposition'] = f'attachment; filename="receipt_{receipt.receipt_number}.html"'
+
+        # Receipts never change once issued, so the number identifies the document
+        etag = quote_etag(f"receipt-{receipt.receipt_number}")
+        last_modified = int(receipt.generated_at.timestamp())
+        not_modified = get_conditional_response(request._request, etag=etag, last_modified=last_modified)
+        if not_modified is None:
+            # Get the HTML content
+            html_content = ReceiptGenerator.generate_receipt_html(receipt)
+            
+            # Return as HTML response
+            response = HttpResponse(html_content, content_type='text/html')
+            response['Content-Disposition'] = f'attachment; filename="receipt_{receipt.receipt_number}.html"'
+        else:
+            response = not_modified
+
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        response['Cache-Control'] = f'private, max-age={settings.RECEIPT_EXPORT_MAX_AGE}, immutable'
         return response
 
+@api_view(['GET'])
+@permission_classes([IsAuthenticated])
+def export_receipts_zip(request):
+    """Stream a ZIP of receipt documents filtered by date range and/or staff member (admins and auditors)"""
+    try:
+        start_date = date.fromisoformat(request.GET['start_date']) if request.GET.get('start_date') else None
+        end_date = date.fromisoformat(request.GET['end_date']) if request.GET.get('end_date') else None
+        staff_id = int(request.GET['staff']) if request.GET.get('staff') else None
+    except ValueError:
+        return Response({'error': 'Use YYYY-MM-DD dates and a numeric staff id'}, status=400)
+
+    # Staff export their own receipts; only admins and auditors choose whose
+    user = request.user
+    if user.user_type == 'staff':
+        staff_id = user.pk
+    elif user.user_type not in ('admin', 'auditor'):
+        return Response({'error': 'Not allowed to export receipts'}, status=403)
+
+    if not (start_date or end_date or staff_id):
+        return Response({'error': 'Provide start_date, end_date or staff'}, status=400)
+
+    receipts = Receipt.objects.only('id', 'receipt_number', 'generated_at', 'receipt_data', 'rendered_html')
+    if start_date:
+        receipts = receipts.filter(generated_at__date__gte=start_date)
+    if end_date:
+        receipts = receipts.filter(generated_at__date__lte=end_date)
+    if staff_id:
+        receipts = receipts.filter(staff_member_id=staff_id)
+    receipts = receipts.order_by('generated_at', 'id').iterator(chunk_size=settings.RECEIPT_EXPORT_CHUNK_SIZE)
+
+    response = StreamingHttpResponse(ReceiptGenerator.iter_receipts_zip(receipts), content_type='application/zip')
+    response['Content-Disposition'] = (
+        f'attachment; filename="receipts_{start_date or "start"}_{end_date or "latest"}.zip"'
+    )
+    return response
+
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def get_receipt_by_payment(request, payment_reference_id):
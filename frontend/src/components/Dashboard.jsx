@@ -47,10 +47,10 @@ const Dashboard = () => {
       await new Promise(resolve => setTimeout(resolve, 800));
       
       const statsResponse = await paymentAPI.getOverallStats();
-      const paymentsResponse = await paymentAPI.getPaymentList();
+      const paymentsResponse = await paymentAPI.getPaymentList({ page_size: 5 });
       
       setStats(statsResponse.data);
-      setRecentPayments(paymentsResponse.data.slice(0, 5));
+      setRecentPayments(paymentsResponse.data.results);
     } catch (error) {
       console.error('Error fetching dashboard data:', error);
     } finally {
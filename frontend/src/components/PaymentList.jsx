@@ -1,5 +1,5 @@
 // src/components/PaymentList.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import { 
   Container, 
   Typography, 
@@ -31,6 +31,7 @@ import {
   DialogContent,
   DialogActions,
   Skeleton,
+  LinearProgress,
   Divider
 } from '@mui/material';
 import {
@@ -42,11 +43,14 @@ import {
   Close as CloseIcon
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
-import { paymentAPI } from '../services/api';
+import { paymentAPI, getCursor } from '../services/api';
 
 const PaymentList = () => {
   const [payments, setPayments] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [loaded, setLoaded] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
   const [statusFilter, setStatusFilter] = useState('all');
   const [methodFilter, setMethodFilter] = useState('all');
@@ -60,22 +64,58 @@ const PaymentList = () => {
   const isMobile = useMediaQuery(theme.breakpoints.down('md'));
   const isTablet = useMediaQuery(theme.breakpoints.between('md', 'lg'));
 
+  const latestRequest = useRef(0);
+
+  // Filters are sent to the API so they cover every payment, not just the loaded pages
+  const listParams = () => {
+    const params = {};
+    if (searchTerm) params.search = searchTerm;
+    if (statusFilter !== 'all') params.status = statusFilter;
+    if (methodFilter !== 'all') params.payment_method = methodFilter;
+    if (dateFrom) params.start_date = dateFrom;
+    if (dateTo) params.end_date = dateTo;
+    return params;
+  };
+
   useEffect(() => {
-    fetchPayments();
-  }, []);
+    // Wait for typing to pause before searching
+    const timer = setTimeout(fetchPayments, searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm, statusFilter, methodFilter, dateFrom, dateTo]);
 
   const fetchPayments = async () => {
+    const request = ++latestRequest.current;
+    setLoading(true);
     try {
-      setLoading(true);
-      // Simulate loading for better UX
-      await new Promise(resolve => setTimeout(resolve, 800));
-      
-      const response = await paymentAPI.getPaymentList();
-      setPayments(response.data);
+      const response = await paymentAPI.getPaymentList(listParams());
+      // Ignore responses to filters that have since changed
+      if (request !== latestRequest.current) return;
+      setPayments(response.data.results);
+      setNextCursor(getCursor(response.data.next));
+      setPage(1);
     } catch (error) {
       console.error('Error fetching payments:', error);
     } finally {
-      setLoading(false);
+      // An older request finishing must not hide the newer one's progress
+      if (request === latestRequest.current) {
+        setLoading(false);
+        setLoaded(true);
+      }
+    }
+  };
+
+  const loadMorePayments = async () => {
+    const request = latestRequest.current;
+    try {
+      setLoadingMore(true);
+      const response = await paymentAPI.getPaymentList({ ...listParams(), cursor: nextCursor });
+      if (request !== latestRequest.current) return;
+      setPayments(prev => [...prev, ...response.data.results]);
+      setNextCursor(getCursor(response.data.next));
+    } catch (error) {
+      console.error('Error loading more payments:', error);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -111,18 +151,9 @@ const PaymentList = () => {
     }
   };
 
-  const filteredPayments = payments.filter(payment => {
-    const matchesSearch = payment.phone_number.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         payment.reference_id.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         payment.description?.toLowerCase().includes(searchTerm.toLowerCase());
-    
-    const matchesStatus = statusFilter === 'all' || payment.status === statusFilter;
-    const matchesMethod = methodFilter === 'all' || payment.payment_method === methodFilter;
-    
-    return matchesSearch && matchesStatus && matchesMethod;
-  });
+  const hasFilters = Object.keys(listParams()).length > 0;
 
-  const paginatedPayments = filteredPayments.slice(
+  const paginatedPayments = payments.slice(
     (page - 1) * rowsPerPage,
     page * rowsPerPage
   );
@@ -143,7 +174,8 @@ const PaymentList = () => {
     alert('PDF export functionality would be implemented here');
   };
 
-  if (loading) {
+  // Skeleton only until the first page arrives; later fetches keep the filters mounted
+  if (!loaded) {
     return (
       <Container maxWidth="xl" sx={{ mt: 4, mb: 4, px: { xs: 1, sm: 2, md: 3 }, overflowX: 'hidden' }}>
         <Box sx={{ 
@@ -476,11 +508,12 @@ const PaymentList = () => {
           gap: 2
         }}>
           <Typography variant="h6" color="text.secondary">
-            Showing {paginatedPayments.length} of {filteredPayments.length} payments
+            Showing {paginatedPayments.length} of {payments.length} loaded payments
+            {nextCursor && ' (more available)'}
           </Typography>
           <Box sx={{ display: 'flex', alignItems: 'center', gap: 1 }}>
             <Typography variant="body2" color="text.secondary">
-              Page {page} of {Math.ceil(filteredPayments.length / rowsPerPage)}
+              Page {page} of {Math.max(1, Math.ceil(payments.length / rowsPerPage))}
             </Typography>
           </Box>
         </Box>
@@ -494,6 +527,7 @@ const PaymentList = () => {
           boxShadow: '0 4px 6px -1px rgba(0,0,0,0.1)',
           border: '1px solid rgba(0,0,0,0.1)'
         }}>
+          {(loading || loadingMore) && <LinearProgress color="success" />}
           <Box sx={{ 
             overflowX: 'auto',
             width: '100%',
@@ -617,7 +651,7 @@ const PaymentList = () => {
                             No payments found
                           </Typography>
                           <Typography variant="body1" color="text.secondary" sx={{ mb: 2 }}>
-                            {filteredPayments.length === 0 && searchTerm ? 
+                            {hasFilters ? 
                               'No payments match your search criteria' : 
                               'Start by initiating your first payment'
                             }
@@ -762,10 +796,10 @@ const PaymentList = () => {
           </Box>
 
           {/* Pagination - Outside the scrollable area */}
-          {filteredPayments.length > rowsPerPage && (
+          {payments.length > rowsPerPage && (
             <Box sx={{ p: 2, display: 'flex', justifyContent: 'center' }}>
               <Pagination
-                count={Math.ceil(filteredPayments.length / rowsPerPage)}
+                count={Math.ceil(payments.length / rowsPerPage)}
                 page={page}
                 onChange={(event, value) => setPage(value)}
                 color="primary"
@@ -774,6 +808,15 @@ const PaymentList = () => {
               />
             </Box>
           )}
+
+          {/* Fetch the next cursor page from the server */}
+          {nextCursor && (
+            <Box sx={{ pb: 2, display: 'flex', justifyContent: 'center' }}>
+              <Button variant="outlined" onClick={loadMorePayments} disabled={loadingMore}>
+                {loadingMore ? 'Loading...' : 'Load more payments'}
+              </Button>
+            </Box>
+          )}
         </Card>
 
         {/* Payment Details Dialog */}
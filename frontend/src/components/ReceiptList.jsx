@@ -1,5 +1,5 @@
 // src/components/ReceiptList.jsx
-import React, { useState, useEffect } from 'react';
+import React, { useState, useEffect, useRef } from 'react';
 import jsPDF from 'jspdf';
 import { 
   Container, 
@@ -32,7 +32,8 @@ import {
   IconButton,
   useTheme,
   useMediaQuery,
-  Skeleton
+  Skeleton,
+  LinearProgress
 } from '@mui/material';
 import {
   Search as SearchIcon,
@@ -44,11 +45,14 @@ import {
   Print as PrintIcon
 } from '@mui/icons-material';
 import { useNavigate } from 'react-router-dom';
-import { receiptAPI } from '../services/api';
+import { receiptAPI, getCursor } from '../services/api';
 
 const ReceiptList = () => {
   const [receipts, setReceipts] = useState([]);
+  const [nextCursor, setNextCursor] = useState(null);
+  const [loadingMore, setLoadingMore] = useState(false);
   const [loading, setLoading] = useState(true);
+  const [loaded, setLoaded] = useState(false);
   const [searchTerm, setSearchTerm] = useState('');
   const [statusFilter, setStatusFilter] = useState('all');
   const [dateFrom, setDateFrom] = useState('');
@@ -61,22 +65,57 @@ const ReceiptList = () => {
   const theme = useTheme();
   const isMobile = useMediaQuery(theme.breakpoints.down('sm'));
 
+  const latestRequest = useRef(0);
+
+  // Filters are sent to the API so they cover every receipt, not just the loaded pages
+  const listParams = () => {
+    const params = {};
+    if (searchTerm) params.search = searchTerm;
+    if (statusFilter !== 'all') params.status = statusFilter;
+    if (dateFrom) params.start_date = dateFrom;
+    if (dateTo) params.end_date = dateTo;
+    return params;
+  };
+
   useEffect(() => {
-    fetchReceipts();
-  }, []);
+    // Wait for typing to pause before searching
+    const timer = setTimeout(fetchReceipts, searchTerm ? 300 : 0);
+    return () => clearTimeout(timer);
+  }, [searchTerm, statusFilter, dateFrom, dateTo]);
 
   const fetchReceipts = async () => {
+    const request = ++latestRequest.current;
+    setLoading(true);
     try {
-      setLoading(true);
-      // Simulate loading for better UX
-      await new Promise(resolve => setTimeout(resolve, 800));
-      
-      const response = await receiptAPI.getReceipts(); // This should be implemented in your API service
-      setReceipts(response.data);
+      const response = await receiptAPI.getReceipts(listParams());
+      // Ignore responses to filters that have since changed
+      if (request !== latestRequest.current) return;
+      setReceipts(response.data.results);
+      setNextCursor(getCursor(response.data.next));
+      setPage(1);
     } catch (error) {
       console.error('Error fetching receipts:', error);
     } finally {
-      setLoading(false);
+      // An older request finishing must not hide the newer one's progress
+      if (request === latestRequest.current) {
+        setLoading(false);
+        setLoaded(true);
+      }
+    }
+  };
+
+  const loadMoreReceipts = async () => {
+    const request = latestRequest.current;
+    try {
+      setLoadingMore(true);
+      const response = await receiptAPI.getReceipts({ ...listParams(), cursor: nextCursor });
+      if (request !== latestRequest.current) return;
+      setReceipts(prev => [...prev, ...response.data.results]);
+      setNextCursor(getCursor(response.data.next));
+    } catch (error) {
+      console.error('Error loading more receipts:', error);
+    } finally {
+      setLoadingMore(false);
     }
   };
 
@@ -93,24 +132,9 @@ const ReceiptList = () => {
     }
   };
 
-  const filteredReceipts = receipts.filter(receipt => {
-    const matchesSearch = receipt.receipt_number.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         receipt.payment?.reference_id.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         receipt.payment?.phone_number.toLowerCase().includes(searchTerm.toLowerCase()) ||
-                         receipt.staff_member?.username.toLowerCase().includes(searchTerm.toLowerCase());
-    
-    const matchesStatus = statusFilter === 'all' || receipt.payment?.status === statusFilter;
-    
-    const receiptDate = new Date(receipt.generated_at);
-    const fromDate = dateFrom ? new Date(dateFrom) : null;
-    const toDate = dateTo ? new Date(dateTo) : null;
-    
-    const matchesDate = (!fromDate || receiptDate >= fromDate) && (!toDate || receiptDate <= toDate);
-    
-    return matchesSearch && matchesStatus && matchesDate;
-  });
+  const hasFilters = Object.keys(listParams()).length > 0;
 
-  const paginatedReceipts = filteredReceipts.slice(
+  const paginatedReceipts = receipts.slice(
     (page - 1) * rowsPerPage,
     page * rowsPerPage
   );
@@ -199,7 +223,8 @@ const exportToCSV = () => {
   document.body.removeChild(link);
 };
 
-  if (loading) {
+  // Skeleton only until the first page arrives; later fetches keep the filters mounted
+  if (!loaded) {
     return (
       <Container maxWidth="xl" sx={{ mt: 4, mb: 4, px: { xs: 2, sm: 3, md: 4 } }}>
         {/* Header Skeleton */}
@@ -454,17 +479,19 @@ const exportToCSV = () => {
         gap: 2
       }}>
         <Typography variant="h6" color="text.secondary">
-          Showing {paginatedReceipts.length} of {filteredReceipts.length} receipts
+          Showing {paginatedReceipts.length} of {receipts.length} loaded receipts
+          {nextCursor && ' (more available)'}
         </Typography>
         <Box sx={{ display: 'flex', alignItems: 'center', gap: 1 }}>
           <Typography variant="body2" color="text.secondary">
-            Page {page} of {Math.ceil(filteredReceipts.length / rowsPerPage)}
+            Page {page} of {Math.max(1, Math.ceil(receipts.length / rowsPerPage))}
           </Typography>
         </Box>
       </Box>
 
       {/* Receipts Table */}
       <Paper sx={{ borderRadius: 3, overflow: 'hidden', boxShadow: '0 4px 6px -1px rgba(0,0,0,0.1)' }}>
+        {(loading || loadingMore) && <LinearProgress color="success" />}
         <TableContainer>
           <Table>
             <TableHead>
@@ -504,7 +531,7 @@ const exportToCSV = () => {
                         No receipts found
                       </Typography>
                       <Typography variant="body1" color="text.secondary" sx={{ mb: 2 }}>
-                        {filteredReceipts.length === 0 && searchTerm ? 
+                        {hasFilters ? 
                           'No receipts match your search criteria' : 
                           'Receipts are automatically generated when payments are successful'
                         }
@@ -613,10 +640,10 @@ const exportToCSV = () => {
         </TableContainer>
 
         {/* Pagination */}
-        {filteredReceipts.length > rowsPerPage && (
+        {receipts.length > rowsPerPage && (
           <Box sx={{ p: 2, display: 'flex', justifyContent: 'center' }}>
             <Pagination
-              count={Math.ceil(filteredReceipts.length / rowsPerPage)}
+              count={Math.ceil(receipts.length / rowsPerPage)}
               page={page}
               onChange={(event, value) => setPage(value)}
               color="primary"
@@ -625,6 +652,15 @@ const exportToCSV = () => {
             />
           </Box>
         )}
+
+        {/* Fetch the next cursor page from the server */}
+        {nextCursor && (
+          <Box sx={{ pb: 2, display: 'flex', justifyContent: 'center' }}>
+            <Button variant="outlined" onClick={loadMoreReceipts} disabled={loadingMore}>
+              {loadingMore ? 'Loading...' : 'Load more receipts'}
+            </Button>
+          </Box>
+        )}
       </Paper>
 
       {/* Receipt Details Dialog */}
@@ -77,11 +77,15 @@ export const authAPI = {
   },
 };
 
+// List endpoints are cursor-paginated: { next, previous, results }.
+// Pull the cursor out of a `next` link so requests keep using API_BASE_URL.
+export const getCursor = (link) => (link ? new URL(link).searchParams.get('cursor') : null);
+
 // Payment services (require authentication)
 export const paymentAPI = {
   initiatePayment: (paymentData) => api.post('/payments/initiate/', paymentData),
   getPaymentStatus: (referenceId) => api.get(`/payments/status/${referenceId}/`),
-  getPaymentList: () => api.get('/payments/list/'),
+  getPaymentList: (params) => api.get('/payments/list/', { params }),
   verifyPayment: (referenceId) => api.post(`/payments/verify/${referenceId}/`),
   getDailySummary: (params) => api.get('/payments/analytics/daily/', { params }),
   getUserSummary: (params) => api.get('/payments/analytics/user/', { params }),
@@ -90,7 +94,7 @@ export const paymentAPI = {
 
 // Receipt services (require authentication)
 export const receiptAPI = {
-  getReceipts: () => api.get('/receipts/'),
+  getReceipts: (params) => api.get('/receipts/', { params }),
   getReceipt: (id) => api.get(`/receipts/${id}/`),
   generateReceipt: (paymentId) => api.post(`/receipts/generate/${paymentId}/`),
   exportReceipt: (id) => api.get(`/receipts/export/${id}/`, { responseType: 'blob' }),